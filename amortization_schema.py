@@ -0,0 +1,121 @@
+"""
+Validación por columnas de los campos enteros (int_keys) de amortization.
+
+En lugar de revisar cuota por cuota con isinstance e imprimir una línea por cada
+cuota con problemas, cada lote de préstamos se aplana en una columna por campo
+de int_keys y cada columna se resuelve de una vez con el conjunto de tipos que
+contiene: si todos son enteros (el caso normal) la columna queda validada sin
+más trabajo; si no, se cuentan los valores por tipo. Los campos que no existen
+en la cuota se cuentan como faltantes, sin lanzar KeyError.
+
+Al final se imprime un resumen compacto por columna, con algunas cuotas de
+ejemplo, y summary() lo deja listo para los reportes JSON.
+"""
+import os
+from collections import Counter
+
+from bson.int64 import Int64
+
+from mongo_utils import chunked
+from projections import int_keys
+
+# Préstamos por lote validado
+INT_KEYS_BATCH_SIZE = int(os.getenv("INT_KEYS_BATCH_SIZE", "500"))
+
+# Cuotas de ejemplo que se guardan por columna
+INT_KEYS_SAMPLES_PER_COLUMN = int(os.getenv("INT_KEYS_SAMPLES_PER_COLUMN", "5"))
+
+# Tipos que isinstance(valor, int) acepta y que PyMongo puede devolver
+INTEGER_TYPES = frozenset({int, bool, Int64})
+
+
+class _Missing:
+    """Marca de campo inexistente en la cuota"""
+
+
+MISSING = _Missing()
+
+TYPE_NAMES = {float: "double", _Missing: "missing", type(None): "null", str: "string"}
+
+
+class IntKeysReport:
+    """Acumula, por columna de int_keys, los valores que no son enteros"""
+
+    def __init__(self, keys=int_keys, samples_per_column=INT_KEYS_SAMPLES_PER_COLUMN):
+        self.keys = list(keys)
+        self.samples_per_column = samples_per_column
+        self.loans_checked = 0
+        self.installments_checked = 0
+        self.columns = {}
+        self.invalid_installments = set()
+        self.invalid_loans = set()
+
+    def check(self, loans):
+        """Valida las cuotas de un lote de préstamos"""
+        refs = []
+        installments = []
+        for loan in loans:
+            for position, element in enumerate(loan.get("amortization") or []):
+                refs.append((loan.get("_id"), element.get("id", position)))
+                installments.append(element)
+        self.loans_checked += len(loans)
+        self.installments_checked += len(installments)
+        if not installments:
+            return
+
+        for key in self.keys:
+            column = [element.get(key, MISSING) for element in installments]
+            if set(map(type, column)) <= INTEGER_TYPES:
+                continue
+            self._record_column(key, column, refs)
+
+    def _record_column(self, key, column, refs):
+        stats = self.columns.setdefault(key, {"types": Counter(), "samples": []})
+        for value, ref in zip(column, refs):
+            value_type = type(value)
+            if value_type in INTEGER_TYPES:
+                continue
+            stats["types"][TYPE_NAMES.get(value_type, value_type.__name__)] += 1
+            self.invalid_installments.add(ref)
+            self.invalid_loans.add(ref[0])
+            if len(stats["samples"]) < self.samples_per_column:
+                stats["samples"].append({"loan_id": str(ref[0]), "installment_id": str(ref[1]), "value": repr(value)})
+
+    def summary(self):
+        """Resumen serializable: totales y, por columna, los valores no enteros por tipo"""
+        return {
+            "loans_checked": self.loans_checked,
+            "installments_checked": self.installments_checked,
+            "invalid_loans": len(self.invalid_loans),
+            "invalid_installments": len(self.invalid_installments),
+            "columns": {
+                key: {"types": dict(self.columns[key]["types"]), "samples": self.columns[key]["samples"]}
+                for key in self.keys
+                if key in self.columns
+            },
+        }
+
+    def print_summary(self):
+        """Una línea con el total y una por columna con valores no enteros"""
+        if not self.columns:
+            print(f"✅ int_keys: {self.installments_checked} cuotas de {self.loans_checked} préstamos con campos enteros")
+            return
+
+        print(
+            f"⚠️  int_keys: {len(self.invalid_installments)} cuotas de {len(self.invalid_loans)} préstamos "
+            f"con campos no enteros ({len(self.columns)} de {len(self.keys)} columnas)"
+        )
+        for key in self.keys:
+            if key not in self.columns:
+                continue
+            stats = self.columns[key]
+            types = ", ".join(f"{count} {name}" for name, count in stats["types"].most_common())
+            examples = ", ".join(f"{sample['loan_id']}/{sample['installment_id']}" for sample in stats["samples"][:3])
+            print(f"   • {key}: {types} (ej.: {examples})")
+
+
+def validate_int_keys(documents, report, batch_size=INT_KEYS_BATCH_SIZE):
+    """Valida los préstamos por lotes a medida que pasan por el pipeline"""
+    for loans in chunked(documents, batch_size):
+        report.check(loans)
+        yield from loans
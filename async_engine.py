@@ -0,0 +1,372 @@
+"""
+Motor asíncrono de las operaciones principales del checker.
+
+Usa el cliente asíncrono de PyMongo (AsyncMongoClient, incluido en pymongo 4.13,
+por lo que no agrega dependencias). Con la latencia de Atlas cada consulta $in y
+cada bulk_write cuesta al menos un round trip; este motor mantiene varias de
+esas operaciones en vuelo a la vez, acotadas por un asyncio.Semaphore de
+ASYNC_CONCURRENCY operaciones.
+
+La lógica de cada paso es la misma de main.py y pagos_no_aplicados.py; aquí solo
+cambia cómo se hacen las consultas y escrituras.
+
+Se selecciona con:
+    python main.py --engine async
+    python pagos_no_aplicados.py --engine async
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+from pymongo import AsyncMongoClient
+from pymongo.errors import BulkWriteError
+
+import config
+import main
+import pagos_no_aplicados
+from amortization_schema import INT_KEYS_BATCH_SIZE
+from mongo_utils import CURSOR_BATCH_SIZE, SESSION_REFRESH_SECONDS, chunked, client_options
+from projections import (
+    LOAN_ARREARS_PROJECTION,
+    LOAN_PAYMENT_INFO_PROJECTION,
+    PAYMENT_TRANSACTIONS_PROJECTION,
+    USER_STATUS_PROJECTION,
+)
+
+# Operaciones (consultas o bulk_write) en vuelo a la vez
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", "8"))
+
+
+def create_async_client(uri):
+    """Crea un AsyncMongoClient con el pool, la compresión y los timeouts de mongo_utils.create_client"""
+    return AsyncMongoClient(uri, **client_options())
+
+
+def run_with_client(db, operation, *args):
+    """Ejecuta `operation(async_db, semaphore, *args)` en un event loop propio y retorna su resultado.
+
+    `async_db` es la base de datos de nombre `db.name` sobre un cliente asíncrono
+    propio a MONGODB_URI, que se abre y cierra aquí (un AsyncMongoClient queda
+    ligado a su event loop), por lo que puede llamarse desde código síncrono,
+    incluidos los hilos del runner.
+    """
+
+    async def runner():
+        client = create_async_client(config.MONGODB_URI)
+        try:
+            return await operation(client[db.name], asyncio.Semaphore(ASYNC_CONCURRENCY), *args)
+        finally:
+            await client.close()
+
+    return asyncio.run(runner())
+
+
+async def execute_bulk(collection, operations, semaphore):
+    """Versión asíncrona de mongo_utils.execute_bulk"""
+    async with semaphore:
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as bulk_error:
+            details = bulk_error.details
+
+    errors = {error["index"]: error.get("errmsg", "") for error in details.get("writeErrors", [])}
+    return details, errors
+
+
+async def fetch_by_ids(collection, ids, projection, semaphore, lookup_cache=None):
+    """Versión asíncrona de mongo_utils.fetch_by_ids; con `lookup_cache` solo consulta los ids que no están en caché"""
+    if lookup_cache is not None:
+        found, missing = lookup_cache.cached(collection, ids, projection)
+        if missing:
+            fetched = await fetch_by_ids(collection, missing, projection, semaphore)
+            lookup_cache.store(collection, projection, missing, fetched)
+            found.update(fetched)
+        return found
+
+    unique_ids = list({_id for _id in ids if _id is not None})
+    if not unique_ids:
+        return {}
+
+    async with semaphore:
+        return {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": unique_ids}}, projection)}
+
+
+async def stream_find(collection, query, projection=None, limit=None, batch_size=CURSOR_BATCH_SIZE, sort=None):
+    """Versión asíncrona de mongo_utils.stream_find: cursor sin timeout en una sesión que se refresca"""
+    client = collection.database.client
+    async with client.start_session() as session:
+        cursor = collection.find(
+            query,
+            projection,
+            batch_size=batch_size,
+            no_cursor_timeout=True,
+            session=session,
+        )
+        if sort:
+            cursor = cursor.sort(sort).allow_disk_use(True)
+        if limit:
+            cursor = cursor.limit(limit)
+
+        last_refresh = time.monotonic()
+        try:
+            async for document in cursor:
+                yield document
+
+                if time.monotonic() - last_refresh > SESSION_REFRESH_SECONDS:
+                    await client.admin.command("refreshSessions", [session.session_id], session=session)
+                    last_refresh = time.monotonic()
+        finally:
+            await cursor.close()
+
+
+async def get_loan_documents(db, projection=LOAN_ARREARS_PROJECTION, loan_filter=None):
+    """Itera los préstamos de main.build_loan_documents_query con un cursor asíncrono"""
+    try:
+        async for document in stream_find(db.loan, main.build_loan_documents_query(loan_filter), projection):
+            yield document
+    except Exception as e:
+        print(f"❌ Error al consultar colección loan: {e}")
+        raise
+
+
+async def collect_loan_refs(documents, loan_refs):
+    """Versión asíncrona de main.collect_loan_refs"""
+    async for document in documents:
+        loan_refs.append({"_id": document.get("_id"), "user_id": document.get("user_id")})
+        yield document
+
+
+async def validate_int_keys(documents, report, batch_size=INT_KEYS_BATCH_SIZE):
+    """Versión asíncrona de amortization_schema.validate_int_keys"""
+    batch = []
+    async for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            report.check(batch)
+            for loan in batch:
+                yield loan
+            batch = []
+    if batch:
+        report.check(batch)
+        for loan in batch:
+            yield loan
+
+
+async def confirmed_operations(details, errors, operations_count, verify):
+    """Versión asíncrona de mongo_utils.confirmed_operations; `verify` es una corrutina"""
+    succeeded = {index for index in range(operations_count) if index not in errors}
+    if details["nModified"] >= len(succeeded):
+        return succeeded
+    return await verify(succeeded)
+
+
+async def flush_amortization_updates(loan_collection, pending_updates, semaphore):
+    """Envía un lote de actualizaciones de amortization y retorna los préstamos actualizados"""
+    operations = [operation for operation, _, _, _ in pending_updates]
+    try:
+        details, errors = await execute_bulk(loan_collection, operations, semaphore)
+    except Exception as update_error:
+        print(f"❌ Error al actualizar lote de {len(operations)} préstamos: {update_error}")
+        return []
+
+    async def verify(indexes):
+        loan_ids = [pending_updates[index][3] for index in indexes]
+        current_loans = await fetch_by_ids(loan_collection, loan_ids, LOAN_ARREARS_PROJECTION, semaphore)
+        return main.confirmed_amortization_updates(pending_updates, indexes, current_loans)
+
+    confirmed = await confirmed_operations(details, errors, len(operations), verify)
+    return main.report_amortization_batch(pending_updates, details, errors, confirmed)
+
+
+async def update_amortization_arrears(db, loan_documents, semaphore, batch_size=main.AMORTIZATION_BULK_BATCH_SIZE):
+    """Como main.update_amortization_arrears, enviando los lotes sin esperar a los anteriores.
+
+    Como en get_unapplied_transactions, no hay más de ASYNC_CONCURRENCY lotes en
+    vuelo: al alcanzarlos se espera el más antiguo antes de seguir leyendo.
+    """
+    try:
+        updated_loans = []
+        in_flight = deque()
+        pending_updates = []
+
+        print(f"\n🔄 Actualizando amortization de los préstamos encontrados...")
+
+        i = 0
+        async for loan_doc in loan_documents:
+            i += 1
+            pending_update = main.build_amortization_update(i, loan_doc)
+            if pending_update is None:
+                continue
+            pending_updates.append(pending_update)
+
+            if len(pending_updates) >= batch_size:
+                in_flight.append(asyncio.create_task(flush_amortization_updates(db.loan, pending_updates, semaphore)))
+                pending_updates = []
+                while len(in_flight) >= ASYNC_CONCURRENCY:
+                    updated_loans.extend(await in_flight.popleft())
+
+        if pending_updates:
+            in_flight.append(asyncio.create_task(flush_amortization_updates(db.loan, pending_updates, semaphore)))
+        while in_flight:
+            updated_loans.extend(await in_flight.popleft())
+
+        main.print_amortization_summary(updated_loans)
+        return updated_loans
+
+    except Exception as e:
+        # Como en main.update_amortization_arrears, un error del cursor interrumpe la ejecución
+        print(f"❌ Error al actualizar amortization: {e}")
+        for task in in_flight:
+            task.cancel()
+        raise
+
+
+async def count_user_loans(loan_collection, user_ids, semaphore):
+    """Versión asíncrona de main.count_user_loans, con una agregación por bloque de usuarios"""
+
+    async def count_chunk(user_ids_chunk):
+        async with semaphore:
+            cursor = await loan_collection.aggregate(main.build_user_loans_pipeline(user_ids_chunk))
+            return [row async for row in cursor]
+
+    chunks = await asyncio.gather(
+        *(count_chunk(user_ids_chunk) for user_ids_chunk in chunked(user_ids, main.USER_LOOKUP_CHUNK_SIZE))
+    )
+    return {row["_id"]: row for rows in chunks for row in rows}
+
+
+async def verify_user_updates(user_collection, pending_updates, indexes, semaphore):
+    """Como main.verify_user_updates, releyendo los bloques de usuarios en paralelo"""
+    chunks = await asyncio.gather(
+        *(
+            fetch_by_ids(user_collection, user_ids_chunk, USER_STATUS_PROJECTION, semaphore)
+            for user_ids_chunk in chunked(
+                [pending_updates[index][0] for index in indexes], main.USER_LOOKUP_CHUNK_SIZE
+            )
+        )
+    )
+    current_users = {}
+    for users in chunks:
+        current_users.update(users)
+    return main.confirmed_user_updates(pending_updates, indexes, current_users)
+
+
+async def validate_user_status(db, loan_documents, semaphore):
+    """Como main.validate_user_status, consultando los bloques de usuarios en paralelo"""
+    try:
+        updated_users = []
+
+        print(f"\n🔍 Validando status de {len(loan_documents)} usuarios...")
+        unique_user_ids = main.collect_user_ids(loan_documents)
+        print(f"📊 Procesando {len(unique_user_ids)} usuarios únicos...")
+
+        chunks = await asyncio.gather(
+            *(
+                fetch_by_ids(db.user, user_ids_chunk, USER_STATUS_PROJECTION, semaphore)
+                for user_ids_chunk in chunked(unique_user_ids, main.USER_LOOKUP_CHUNK_SIZE)
+            )
+        )
+        users_by_id = {}
+        for users in chunks:
+            users_by_id.update(users)
+
+        loan_counts = await count_user_loans(
+            db.loan, main.arrear_user_ids_of(unique_user_ids, users_by_id), semaphore
+        )
+
+        validation_results, pending_updates = main.evaluate_users(unique_user_ids, users_by_id, loan_counts)
+
+        if pending_updates:
+            try:
+                details, errors = await execute_bulk(
+                    db.user, main.build_user_status_updates(pending_updates), semaphore
+                )
+                confirmed = await confirmed_operations(
+                    details,
+                    errors,
+                    len(pending_updates),
+                    lambda indexes: verify_user_updates(db.user, pending_updates, indexes, semaphore),
+                )
+                updated_users = main.report_user_updates(pending_updates, details, errors, confirmed)
+            except Exception as update_error:
+                print(f"❌ Error al actualizar status: {update_error}")
+
+        main.print_user_updates_summary(updated_users)
+        return validation_results, updated_users
+
+    except Exception as e:
+        print(f"❌ Error al validar usuarios: {e}")
+        return [], []
+
+
+async def fix_arrears_and_users(db, semaphore, loan_filter=None, int_keys_report=None):
+    """Pasos 3 y 4 de main.run: retorna (amortization_updates, loan_refs, validation_results, updated_users)"""
+    loan_refs = []
+    loan_documents = get_loan_documents(db, loan_filter=loan_filter)
+    if int_keys_report is not None:
+        loan_documents = validate_int_keys(loan_documents, int_keys_report)
+    loan_documents = collect_loan_refs(loan_documents, loan_refs)
+    amortization_updates = await update_amortization_arrears(db, loan_documents, semaphore)
+
+    validation_results, updated_users = await validate_user_status(db, loan_refs, semaphore)
+    return amortization_updates, loan_refs, validation_results, updated_users
+
+
+async def get_unapplied_transactions(db, semaphore, date_range="recent", limit=None, lookup_cache=None):
+    """Como pagos_no_aplicados.get_unapplied_transactions, con varias consultas de préstamos en vuelo.
+
+    Mientras se recorren los pagos, la consulta de préstamos de cada bloque se
+    lanza de inmediato; los bloques se evalúan en orden y los pagos se recorren
+    ordenados por _id, por lo que el resultado es el mismo que el del motor python.
+    """
+    query, range_description = pagos_no_aplicados.build_payment_query(date_range)
+
+    if limit:
+        total_payments = await db.payment.count_documents(query, limit=limit)
+        print(f"Payments fetched {range_description} - LIMITED TO {limit}: {total_payments}")
+    else:
+        total_payments = await db.payment.count_documents(query)
+        print(f"Payments fetched {range_description}: {total_payments}")
+
+    count = 0
+    unapplied_payments = []
+    inconsistent_loans = set()
+    in_flight = deque()
+
+    def lookup(payment_chunk):
+        loan_ids = [payment.get("loan_id") for payment in payment_chunk]
+        return asyncio.create_task(
+            fetch_by_ids(db.loan, loan_ids, LOAN_PAYMENT_INFO_PROJECTION, semaphore, lookup_cache)
+        )
+
+    async def process_oldest():
+        payment_chunk, loans_task = in_flight.popleft()
+        return pagos_no_aplicados.process_payment_chunk(
+            payment_chunk, await loans_task, count, total_payments, unapplied_payments, inconsistent_loans
+        )
+
+    payments = stream_find(db.payment, query, PAYMENT_TRANSACTIONS_PROJECTION, limit=limit, sort=[("_id", 1)])
+
+    payment_chunk = []
+    try:
+        async for payment in payments:
+            payment_chunk.append(payment)
+            if len(payment_chunk) < pagos_no_aplicados.LOAN_LOOKUP_CHUNK_SIZE:
+                continue
+
+            in_flight.append((payment_chunk, lookup(payment_chunk)))
+            payment_chunk = []
+            # Los bloques pendientes ocupan memoria; no se adelantan más que las consultas permitidas
+            while len(in_flight) > ASYNC_CONCURRENCY:
+                count = await process_oldest()
+    finally:
+        await payments.aclose()
+
+    if payment_chunk:
+        in_flight.append((payment_chunk, lookup(payment_chunk)))
+    while in_flight:
+        count = await process_oldest()
+
+    return unapplied_payments, sorted(inconsistent_loans), count
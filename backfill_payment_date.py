@@ -0,0 +1,145 @@
+"""
+Migración única que llena el campo normalizado de payment_date en la colección loan.
+
+Para cada préstamo cuyo payment_date sigue en UTC-5 (termina en "-05:00") guarda
+una copia como datetime UTC en config.PAYMENT_DATE_NORMALIZED_FIELD, que permite a
+`python main.py --payment-date-mode range` buscar los pagos del día con un rango
+cubierto por índice.
+
+La migración avanza por lotes ordenados por _id y guarda el último _id procesado
+en un archivo de estado, por lo que puede interrumpirse y reanudarse. Al terminar
+el archivo de estado se elimina: los _id no siguen el orden de creación, así que
+una nueva ejecución recorre otra vez desde el inicio y completa los préstamos
+que aún no tienen el campo.
+
+Uso:
+    python backfill_payment_date.py [--batch-size 1000] [--restart]
+"""
+import os
+from datetime import datetime, timezone
+
+from bson import json_util
+from pymongo import ASCENDING, IndexModel, UpdateOne
+
+from config import DATABASE_NAME, MONGODB_URI, PAYMENT_DATE_NORMALIZED_FIELD
+from mongo_utils import create_client, execute_bulk
+
+STATE_FILE = os.path.join("backups", "backfill_payment_date_state.json")
+
+NORMALIZED_INDEX = IndexModel(
+    [(PAYMENT_DATE_NORMALIZED_FIELD, ASCENDING)],
+    name="checker_payment_date_normalized",
+    partialFilterExpression={PAYMENT_DATE_NORMALIZED_FIELD: {"$exists": True}},
+)
+
+
+def normalize_payment_date(date_string):
+    """Convierte un payment_date con offset -05:00 en un datetime UTC para PAYMENT_DATE_NORMALIZED_FIELD.
+
+    Retorna None si la fecha no está en UTC-5 (por ejemplo, si ya fue convertida a Z).
+    """
+    if not isinstance(date_string, str) or not date_string.endswith("-05:00"):
+        return None
+    return datetime.fromisoformat(date_string).astimezone(timezone.utc)
+
+
+def load_state():
+    """Lee el último _id procesado de una ejecución anterior"""
+    if not os.path.exists(STATE_FILE):
+        return {"last_id": None, "updated": 0}
+    with open(STATE_FILE, encoding="utf-8") as f:
+        return json_util.loads(f.read())
+
+
+def save_state(state):
+    """Guarda el avance de la migración de forma atómica (json_util conserva el tipo de _id)"""
+    temporary_file = f"{STATE_FILE}.tmp"
+    with open(temporary_file, "w", encoding="utf-8") as f:
+        f.write(json_util.dumps(state, indent=2))
+    os.replace(temporary_file, STATE_FILE)
+
+
+def clear_state():
+    """Elimina el avance de una migración que terminó"""
+    if os.path.exists(STATE_FILE):
+        os.remove(STATE_FILE)
+
+
+def backfill(loan_collection, batch_size=1000, state=None):
+    """Llena PAYMENT_DATE_NORMALIZED_FIELD por lotes, guardando el avance después de cada lote.
+
+    El avance se guarda solo mientras la migración está incompleta.
+    """
+    state = state or {"last_id": None, "updated": 0}
+
+    base_query = {
+        "payment_date": {"$regex": "-05:00$"},
+        PAYMENT_DATE_NORMALIZED_FIELD: {"$exists": False},
+    }
+
+    while True:
+        query = dict(base_query)
+        if state["last_id"] is not None:
+            query["_id"] = {"$gt": state["last_id"]}
+
+        batch = list(
+            loan_collection.find(query, {"payment_date": 1}).sort("_id", ASCENDING).limit(batch_size)
+        )
+        if not batch:
+            break
+
+        operations = []
+        operation_loan_ids = []
+        for loan in batch:
+            try:
+                normalized_date = normalize_payment_date(loan["payment_date"])
+            except ValueError as e:
+                print(f"⚠️  Préstamo {loan['_id']}: payment_date inválido {loan['payment_date']!r} ({e})")
+                continue
+
+            # El filtro incluye el payment_date leído para no pisar una conversión concurrente
+            operations.append(
+                UpdateOne(
+                    {"_id": loan["_id"], "payment_date": loan["payment_date"]},
+                    {"$set": {PAYMENT_DATE_NORMALIZED_FIELD: normalized_date}},
+                )
+            )
+            operation_loan_ids.append(loan["_id"])
+
+        if operations:
+            details, errors = execute_bulk(loan_collection, operations)
+            for index, message in errors.items():
+                print(f"❌ Error en préstamo {operation_loan_ids[index]}: {message}")
+            state["updated"] += details["nModified"]
+
+        state["last_id"] = batch[-1]["_id"]
+        save_state(state)
+        print(f"📦 Lote procesado hasta _id={state['last_id']} (total actualizados: {state['updated']})")
+
+    clear_state()
+    return state
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Llena el campo normalizado de payment_date")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--restart", action="store_true", help="Ignora el avance guardado y empieza desde el inicio")
+    args = parser.parse_args()
+
+    client = create_client(MONGODB_URI)
+    try:
+        loan_collection = client[DATABASE_NAME].loan
+
+        print(f"📇 Asegurando índice {NORMALIZED_INDEX.document['name']}...")
+        loan_collection.create_indexes([NORMALIZED_INDEX])
+
+        state = None if args.restart else load_state()
+        if state and state["last_id"] is not None:
+            print(f"⏩ Reanudando desde _id={state['last_id']}")
+
+        state = backfill(loan_collection, args.batch_size, state)
+        print(f"✅ Migración completada: {state['updated']} préstamos actualizados")
+    finally:
+        client.close()
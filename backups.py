@@ -0,0 +1,139 @@
+"""
+Escritura y lectura de los archivos de backup de los scripts del checker.
+
+Los backups se escriben documento por documento, directo del cursor, en NDJSON
+(un documento JSON extendido por línea) o BSON, opcionalmente comprimidos con
+gzip o zstd. El formato se deduce de la extensión del archivo:
+
+    loan_documents_20250101_070000.ndjson.gz
+    loan_documents_20250101_070000.bson.zst
+
+BACKUP_FORMAT (ndjson | bson) y BACKUP_COMPRESSION (gzip | zstd | none) definen
+la extensión que usan los scripts al crear backups nuevos.
+"""
+import gzip
+import io
+import os
+
+import bson
+from bson import json_util
+
+from mongo_utils import stream_find
+from serializers import dumps_extended
+
+BACKUP_FORMAT = os.getenv("BACKUP_FORMAT", "ndjson")
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip")
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+
+def backup_filename(base_path, backup_format=None, compression=None):
+    """Agrega a `base_path` la extensión del formato y compresión configurados"""
+    backup_format = backup_format or BACKUP_FORMAT
+    compression = compression or BACKUP_COMPRESSION
+
+    if backup_format not in ("ndjson", "bson"):
+        raise ValueError(f"Formato de backup desconocido: {backup_format}")
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Compresión de backup desconocida: {compression}")
+
+    return f"{base_path}.{backup_format}{COMPRESSION_EXTENSIONS[compression]}"
+
+
+def parse_backup_filename(filename):
+    """Retorna (formato, compresión) según la extensión del archivo"""
+    name = filename
+    compression = "none"
+    for candidate, extension in COMPRESSION_EXTENSIONS.items():
+        if extension and name.endswith(extension):
+            compression = candidate
+            name = name[: -len(extension)]
+            break
+
+    for backup_format in ("ndjson", "bson", "json"):
+        if name.endswith(f".{backup_format}"):
+            return backup_format, compression
+
+    raise ValueError(f"No se reconoce el formato del backup: {filename}")
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("La compresión zstd requiere el paquete 'zstandard' (pip install zstandard)") from e
+    return zstandard
+
+
+def _open_binary(filename, mode, compression):
+    if compression == "gzip":
+        return gzip.open(filename, mode)
+    if compression == "zstd":
+        zstandard = _zstandard()
+        raw = open(filename, mode)
+        if mode == "wb":
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    return open(filename, mode)
+
+
+class BackupWriter:
+    """Escribe un backup documento por documento en el formato que indica la extensión.
+
+    NDJSON usa JSON extendido (serializers.dumps_extended), de modo que ObjectId,
+    datetime, Decimal128, etc. se recuperan con su tipo al leer el backup.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.format, self.compression = parse_backup_filename(filename)
+        if self.format == "json":
+            raise ValueError("Los backups nuevos se escriben en NDJSON o BSON, no en JSON")
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = _open_binary(self.filename, "wb", self.compression)
+        return self
+
+    def write(self, document):
+        if self.format == "bson":
+            self._file.write(bson.encode(document))
+        else:
+            self._file.write(dumps_extended(document) + b"\n")
+        self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        return False
+
+
+def read_backup(filename):
+    """Itera los documentos de un backup, en cualquiera de los formatos soportados.
+
+    También lee los backups anteriores en arreglo JSON (*.json), que sí se cargan
+    completos en memoria.
+    """
+    backup_format, compression = parse_backup_filename(filename)
+
+    with _open_binary(filename, "rb", compression) as f:
+        if backup_format == "bson":
+            yield from bson.decode_file_iter(f)
+        elif backup_format == "ndjson":
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line)
+        else:
+            yield from json_util.loads(f.read())
+
+
+def backup_query(collection, query, filename, transform=None):
+    """Guarda en `filename` los documentos completos que cumplen `query`.
+
+    Los documentos pasan directo del cursor al archivo. `transform` permite
+    adaptar cada documento antes de serializarlo. Retorna la cantidad guardada.
+    """
+    with BackupWriter(filename) as writer:
+        for document in stream_find(collection, query):
+            writer.write(transform(document) if transform else document)
+        return writer.count
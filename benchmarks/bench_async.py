@@ -0,0 +1,229 @@
+"""
+Benchmark del motor asíncrono contra el síncrono con latencia de red simulada.
+
+Las colecciones de prueba guardan los documentos sintéticos en memoria y
+esperan `--rtt-ms` en cada round trip (cada lote del cursor, consulta $in,
+agregación, count o bulk_write), con time.sleep en la versión síncrona y
+asyncio.sleep en la asíncrona. Las escrituras no se aplican: solo se mide
+cuántos round trips quedan en el camino crítico de cada motor.
+
+Uso:
+    python -m benchmarks.bench_async [--loans 5000] [--rtt-ms 50,100] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import time
+
+os.environ.setdefault("STOP_ID", "stop-entity")
+os.environ.setdefault("YOYO_ID", "yoyo-entity")
+
+import async_engine  # noqa: E402
+import main  # noqa: E402
+import pagos_no_aplicados  # noqa: E402
+from benchmarks.synthetic import build_loan, build_payment  # noqa: E402
+from mongo_utils import CURSOR_BATCH_SIZE  # noqa: E402
+
+
+def _matching(documents, query):
+    """Solo se interpreta el filtro {_id: {$in: [...]}}; el resto de consultas devuelve todo"""
+    id_filter = (query or {}).get("_id")
+    if not isinstance(id_filter, dict) or "$in" not in id_filter:
+        return list(documents.values())
+    return [documents[_id] for _id in id_filter["$in"] if _id in documents]
+
+
+def _user_loan_counts(loans, pipeline):
+    user_ids = set(pipeline[0]["$match"]["user_id"]["$in"])
+    counts = {}
+    for loan in loans.values():
+        if loan["user_id"] in user_ids:
+            row = counts.setdefault(loan["user_id"], {"_id": loan["user_id"], "loans": 0, "arrear_loans": 0})
+            row["loans"] += 1
+            row["arrear_loans"] += loan["status"] == "arrear"
+    return list(counts.values())
+
+
+class _BulkResult:
+    def __init__(self, operations):
+        self.bulk_api_result = {"nMatched": len(operations), "nModified": len(operations), "writeErrors": []}
+
+
+class LatencyCursor:
+    def __init__(self, documents, rtt, batch_size):
+        self.documents, self.rtt, self.batch_size = documents, rtt, batch_size
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self.documents = sorted(self.documents, key=lambda document: document[key], reverse=direction < 0)
+        return self
+
+    def allow_disk_use(self, allow):
+        return self
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        for start in range(0, max(len(self.documents), 1), self.batch_size):
+            time.sleep(self.rtt)
+            yield from self.documents[start:start + self.batch_size]
+
+
+class LatencyCollection:
+    def __init__(self, database, documents, rtt):
+        self.database, self.documents, self.rtt = database, documents, rtt
+
+    def find(self, query=None, projection=None, batch_size=CURSOR_BATCH_SIZE, **kwargs):
+        return LatencyCursor(_matching(self.documents, query), self.rtt, batch_size or CURSOR_BATCH_SIZE)
+
+    def count_documents(self, query, limit=None):
+        time.sleep(self.rtt)
+        return min(len(self.documents), limit or len(self.documents))
+
+    def aggregate(self, pipeline):
+        time.sleep(self.rtt)
+        return _user_loan_counts(self.documents, pipeline)
+
+    def bulk_write(self, operations, ordered=True):
+        time.sleep(self.rtt)
+        return _BulkResult(operations)
+
+
+class AsyncLatencyCursor(LatencyCursor):
+    async def close(self):
+        pass
+
+    async def __aiter__(self):
+        for start in range(0, max(len(self.documents), 1), self.batch_size):
+            await asyncio.sleep(self.rtt)
+            for document in self.documents[start:start + self.batch_size]:
+                yield document
+
+
+class AsyncLatencyCollection(LatencyCollection):
+    def find(self, query=None, projection=None, batch_size=CURSOR_BATCH_SIZE, **kwargs):
+        return AsyncLatencyCursor(_matching(self.documents, query), self.rtt, batch_size or CURSOR_BATCH_SIZE)
+
+    async def count_documents(self, query, limit=None):
+        await asyncio.sleep(self.rtt)
+        return min(len(self.documents), limit or len(self.documents))
+
+    async def aggregate(self, pipeline):
+        await asyncio.sleep(self.rtt)
+        return AsyncLatencyCursor(_user_loan_counts(self.documents, pipeline), 0, CURSOR_BATCH_SIZE)
+
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(self.rtt)
+        return _BulkResult(operations)
+
+
+class _Session:
+    session_id = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class _Client:
+    admin = None
+
+    def start_session(self):
+        return _Session()
+
+
+class LatencyDatabase:
+    """Base de datos en memoria con colecciones loan, user y payment"""
+
+    def __init__(self, collections, rtt, asynchronous=False):
+        collection_class = AsyncLatencyCollection if asynchronous else LatencyCollection
+        self.client = _Client()
+        for name, documents in collections.items():
+            setattr(self, name, collection_class(self, documents, rtt))
+
+
+def build_dataset(loan_count, seed=42):
+    """Préstamos pagados en mora, sus usuarios (en arrear) y dos pagos por préstamo"""
+    rng = random.Random(seed)
+    loans = {}
+    for _ in range(loan_count):
+        loan = build_loan(rng, terms=12, status="paid")
+        loan["amortization"][0]["days_in_arrear"] = 5
+        loans[loan["_id"]] = loan
+    users = {loan["user_id"]: {"_id": loan["user_id"], "status": "arrear"} for loan in loans.values()}
+    payments = {}
+    for loan in loans.values():
+        for _ in range(2):
+            payment = build_payment(rng, loan)
+            payments[payment["_id"]] = payment
+    return {"loan": loans, "user": users, "payment": payments}
+
+
+def run_sync(dataset, rtt):
+    db = LatencyDatabase(dataset, rtt)
+    loan_refs = []
+    main.update_amortization_arrears(db, main.collect_loan_refs(main.get_loan_documents(db), loan_refs))
+    main.validate_user_status(db, loan_refs)
+    pagos_no_aplicados.get_unapplied_transactions(db)
+
+
+def run_async(dataset, rtt, concurrency):
+    async def runner():
+        db = LatencyDatabase(dataset, rtt, asynchronous=True)
+        semaphore = asyncio.Semaphore(concurrency)
+        loan_refs = []
+        documents = async_engine.collect_loan_refs(async_engine.get_loan_documents(db), loan_refs)
+        await async_engine.update_amortization_arrears(db, documents, semaphore)
+        await async_engine.validate_user_status(db, loan_refs, semaphore)
+        await async_engine.get_unapplied_transactions(db, semaphore)
+
+    asyncio.run(runner())
+
+
+def timed(function, *args):
+    """Ejecuta `function` sin su salida por consola y retorna los segundos transcurridos"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args)
+    return time.perf_counter() - start
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=5000)
+    parser.add_argument("--rtt-ms", default="50,100", help="Latencias a simular, separadas por coma")
+    parser.add_argument("--concurrency", type=int, default=async_engine.ASYNC_CONCURRENCY)
+    args = parser.parse_args()
+
+    dataset = build_dataset(args.loans)
+    print(f"📊 {args.loans} préstamos, {len(dataset['user'])} usuarios, {len(dataset['payment'])} pagos")
+    print(f"   • Concurrencia del motor asíncrono: {args.concurrency}")
+    print("=" * 60)
+
+    for rtt_ms in [float(value) for value in args.rtt_ms.split(",")]:
+        rtt = rtt_ms / 1000
+        sync_seconds = timed(run_sync, dataset, rtt)
+        async_seconds = timed(run_async, dataset, rtt, args.concurrency)
+        print(f"RTT {rtt_ms:.0f} ms")
+        print(f"   • Síncrono: {sync_seconds:.2f}s")
+        print(f"   • Asíncrono: {async_seconds:.2f}s ({sync_seconds / async_seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    main_benchmark()
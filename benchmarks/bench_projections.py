@@ -0,0 +1,90 @@
+"""
+Benchmark de proyecciones: bytes BSON y tiempo de decodificación por etapa.
+
+Compara el documento completo contra la proyección que declara cada etapa,
+usando préstamos sintéticos codificados en BSON tal como llegarían del servidor.
+
+Uso:
+    python -m benchmarks.bench_projections [--loans 5000] [--terms 24]
+"""
+import argparse
+import time
+
+import bson
+
+from benchmarks.synthetic import build_loans
+from projections import (
+    LOAN_ARREARS_PROJECTION,
+    LOAN_PAYMENT_INFO_PROJECTION,
+    TODAYS_PAYMENTS_PROJECTION,
+    ZERO_BALANCE_PROJECTION,
+)
+
+STAGES = {
+    "get_loan_documents": LOAN_ARREARS_PROJECTION,
+    "get_unapplied_transactions (loan)": LOAN_PAYMENT_INFO_PROJECTION,
+    "get_todays_payments_regex_approach": TODAYS_PAYMENTS_PROJECTION,
+    "mora_saldo_cero": ZERO_BALANCE_PROJECTION,
+}
+
+
+def _projection_tree(projection):
+    tree = {}
+    for path in projection:
+        node = tree
+        *parents, leaf = path.split(".")
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = True
+    return tree
+
+
+def _apply_tree(value, tree):
+    if isinstance(value, list):
+        return [_apply_tree(item, tree) for item in value if isinstance(item, dict)]
+
+    projected = {}
+    for key, subtree in tree.items():
+        if key in value:
+            projected[key] = value[key] if subtree is True else _apply_tree(value[key], subtree)
+    return projected
+
+
+def apply_projection(document, projection):
+    """Aplica una proyección de inclusión como lo haría el servidor (incluye _id)"""
+    projected = {"_id": document["_id"]}
+    projected.update(_apply_tree(document, _projection_tree(projection)))
+    return projected
+
+
+def measure(payloads):
+    """Retorna (bytes totales, segundos de decodificación) de una lista de BSON"""
+    start = time.perf_counter()
+    for payload in payloads:
+        bson.decode(payload)
+    return sum(len(payload) for payload in payloads), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=5000)
+    parser.add_argument("--terms", type=int, default=24)
+    args = parser.parse_args()
+
+    loans = build_loans(args.loans, terms=args.terms)
+    full_bytes, full_seconds = measure([bson.encode(loan) for loan in loans])
+
+    print(f"📊 {args.loans} préstamos de {args.terms} cuotas")
+    print(f"   • Documento completo: {full_bytes / 1_048_576:.1f} MiB, decodificación {full_seconds * 1000:.0f} ms")
+    print("=" * 60)
+
+    for stage, projection in STAGES.items():
+        payloads = [bson.encode(apply_projection(loan, projection)) for loan in loans]
+        stage_bytes, stage_seconds = measure(payloads)
+        print(f"{stage}")
+        print(f"   • Bytes: {stage_bytes / 1_048_576:.2f} MiB ({full_bytes / stage_bytes:.1f}x menos)")
+        print(f"   • Decodificación: {stage_seconds * 1000:.0f} ms ({full_seconds / stage_seconds:.1f}x más rápido)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark de serialización: reportes JSON y backups NDJSON por backend.
+
+Compara el json.dump(indent=2) anterior contra cada backend de serializers.py
+sobre un volcado sintético de préstamos con ObjectId y fechas nativas.
+
+Uso:
+    python -m benchmarks.bench_serializers [--loans 5000] [--terms 24] [--repeat 3]
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+import serializers
+from benchmarks.synthetic import build_loans
+
+
+def as_mongo_document(loan):
+    """Agrega los tipos BSON que trae un documento real de la colección loan"""
+    return dict(
+        loan,
+        _id=ObjectId(),
+        payment_date_normalized=datetime(2025, 6, 1, 5, tzinfo=timezone.utc),
+    )
+
+
+def legacy_report(loans):
+    return json.dumps(loans, indent=2, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def best_time(function, repeat):
+    """Retorna (bytes producidos, mejor tiempo en segundos) de `repeat` ejecuciones"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(output), best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loans", type=int, default=5000)
+    parser.add_argument("--terms", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    loans = [as_mongo_document(loan) for loan in build_loans(args.loans, terms=args.terms)]
+    backends = ["json"] + (["orjson"] if serializers.orjson is not None else [])
+
+    cases = {"reporte json.dump(indent=2) anterior": lambda: legacy_report(loans)}
+    for backend in backends:
+        cases[f"reporte {backend} indentado"] = lambda b=backend: serializers.dumps(loans, pretty=True, backend=b)
+        cases[f"reporte {backend} compacto"] = lambda b=backend: serializers.dumps(loans, backend=b)
+        cases[f"backup NDJSON {backend}"] = lambda b=backend: b"\n".join(
+            serializers.dumps_extended(loan, backend=b) for loan in loans
+        )
+
+    print(f"📊 {args.loans} préstamos de {args.terms} cuotas (mejor de {args.repeat})")
+    if serializers.orjson is None:
+        print("⚠️  orjson no está instalado; solo se mide la librería estándar")
+    print("=" * 60)
+
+    baseline = None
+    for name, function in cases.items():
+        size, seconds = best_time(function, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name}")
+        print(
+            f"   • {size / 1_048_576:.1f} MiB en {seconds * 1000:.0f} ms "
+            f"({size / 1_048_576 / seconds:.0f} MiB/s, {args.loans / seconds:,.0f} docs/s, "
+            f"{baseline / seconds:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Benchmark por etapa del checker contra un mongod local con datos sintéticos.
+
+Cada etapa se ejecuta en un proceso propio (así el pico de RSS es el de la
+etapa) sobre el conjunto de datos de benchmarks.load_dataset. Las etapas que
+escriben trabajan sobre una copia de la base de datos hecha con $out antes de
+medir, de modo que todas parten de los mismos datos.
+
+Por etapa se reporta (con instrumentation, como en las ejecuciones reales):
+    seconds, docs, docs_per_sec   tiempo y documentos procesados por la etapa
+    round_trips                   comandos enviados al servidor
+    mongo_seconds                 duración de esos comandos medida por el driver
+    bytes_sent, bytes_received    tamaño BSON de los comandos y de las respuestas
+    peak_rss_mb                   pico de memoria residente del proceso de la etapa
+
+Los resultados se guardan en JSON (benchmarks/results/) y --compare los compara
+contra un resultado anterior: termina con código 1 si alguna métrica empeora
+más que --tolerance.
+
+Uso:
+    python -m benchmarks.load_dataset --scale 100k
+    python -m benchmarks.bench_stages --scale 100k [--stages get_loan_documents,mora_saldo_cero]
+    python -m benchmarks.bench_stages --scale 100k --compare benchmarks/results/100k_20250101_070000.json
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+from datetime import datetime
+
+import pymongo
+from pymongo import MongoClient
+
+from benchmarks.load_dataset import BENCH_MONGODB_URI, SCALES, connect, database_name, load_dataset
+
+import indexes  # noqa: E402  (después de load_dataset, que define los ids de entidad)
+from instrumentation import COMMAND_LISTENER, Instrumentation  # noqa: E402
+import main  # noqa: E402
+import mora_saldo_cero  # noqa: E402
+import pagos_no_aplicados  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Todo el rango de fechas de los pagos sintéticos
+PAYMENTS_DATE_RANGE = ("2025-01-01", "2027-01-01")
+
+# Métricas donde un valor mayor es una regresión
+COMPARED_METRICS = ["seconds", "round_trips", "mongo_seconds", "bytes_sent", "bytes_received", "peak_rss_mb"]
+
+
+def _loan_refs(db):
+    return [{"_id": loan["_id"], "user_id": loan.get("user_id")} for loan in main.get_loan_documents(db, {"user_id": 1})]
+
+
+def _update_amortization_arrears(db, _):
+    loan_refs = []
+    main.update_amortization_arrears(db, main.collect_loan_refs(main.get_loan_documents(db), loan_refs))
+    return len(loan_refs)
+
+
+def _validate_user_status(db, loan_refs):
+    main.validate_user_status(db, loan_refs)
+    return len(loan_refs)
+
+
+# Cada etapa: si escribe, cómo preparar su entrada (sin medir) y cómo ejecutarla.
+# `run` retorna la cantidad de documentos que procesó la etapa.
+STAGES = {
+    "get_loan_documents": {
+        "writes": False,
+        "run": lambda db, _: sum(1 for _ in main.get_loan_documents(db)),
+    },
+    "update_amortization_arrears": {
+        "writes": True,
+        "run": _update_amortization_arrears,
+    },
+    "validate_user_status": {
+        "writes": True,
+        "setup": _loan_refs,
+        "run": _validate_user_status,
+    },
+    "get_unapplied_transactions": {
+        "writes": False,
+        "run": lambda db, _: pagos_no_aplicados.get_unapplied_transactions(db, PAYMENTS_DATE_RANGE)[2],
+    },
+    "mora_saldo_cero": {
+        "writes": True,
+        "run": lambda db, _: mora_saldo_cero.run(db)["documents_found"],
+    },
+}
+
+
+def clone_database(client, source, target):
+    """Copia loan, user y payment de `source` a `target` con $out y crea los índices recomendados"""
+    for collection_name in ("loan", "user", "payment"):
+        client[source][collection_name].aggregate([{"$out": {"db": target, "coll": collection_name}}])
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        indexes.ensure_indexes(client[target])
+
+
+def run_stage(uri, db_name, stage_name):
+    """Ejecuta una etapa y retorna sus métricas (se llama en un proceso nuevo)"""
+    stage = STAGES[stage_name]
+    stages = Instrumentation()
+    client = MongoClient(uri, event_listeners=[COMMAND_LISTENER])
+    try:
+        db = client[db_name]
+        stage_input = stage["setup"](db) if "setup" in stage else None
+
+        # La salida por consola de las etapas no se mide ni se guarda en memoria
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), stages.stage(stage_name):
+            docs = stage["run"](db, stage_input)
+    finally:
+        client.close()
+
+    metrics = stages.breakdown()[stage_name]
+    return {
+        "seconds": metrics["seconds"],
+        "docs": docs,
+        "docs_per_sec": round(docs / metrics["seconds"], 1) if metrics["seconds"] else None,
+        "round_trips": metrics["commands"],
+        "mongo_seconds": metrics["mongo_seconds"],
+        "bytes_sent": metrics["bytes_sent"],
+        "bytes_received": metrics["bytes_received"],
+        # ru_maxrss está en KiB en Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_benchmark(client, uri, db_name, stage_names):
+    """Ejecuta las etapas en orden, cada una en un proceso nuevo, y retorna sus métricas"""
+    work_db_name = f"{db_name}_work"
+    context = multiprocessing.get_context("spawn")
+    results = {}
+
+    for stage_name in stage_names:
+        target = db_name
+        if STAGES[stage_name]["writes"]:
+            clone_database(client, db_name, work_db_name)
+            target = work_db_name
+
+        with context.Pool(1) as pool:
+            results[stage_name] = pool.apply(run_stage, (uri, target, stage_name))
+        print_stage(stage_name, results[stage_name])
+
+    client.drop_database(work_db_name)
+    return results
+
+
+def print_stage(stage_name, metrics):
+    print(f"{stage_name}")
+    print(
+        f"   • {metrics['seconds']:.2f}s, {metrics['docs']} docs ({metrics['docs_per_sec'] or 0:,.0f} docs/s), "
+        f"{metrics['round_trips']} round trips, {metrics['bytes_received'] / 1_048_576:.1f} MiB recibidos, "
+        f"pico RSS {metrics['peak_rss_mb']:.0f} MiB"
+    )
+
+
+def compare(current, baseline, tolerance):
+    """Compara las métricas de cada etapa contra `baseline` y retorna las regresiones"""
+    regressions = []
+    print(f"\n📈 Comparación contra {baseline['timestamp']} (tolerancia {tolerance:.0%})")
+    for stage_name, metrics in current["stages"].items():
+        previous = baseline["stages"].get(stage_name)
+        if not previous:
+            print(f"   • {stage_name}: sin resultado anterior")
+            continue
+
+        changes = []
+        for metric in COMPARED_METRICS:
+            if not previous.get(metric):
+                continue
+            ratio = metrics[metric] / previous[metric]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = " ⚠️"
+                regressions.append((stage_name, metric, previous[metric], metrics[metric]))
+            changes.append(f"{metric} {ratio:.2f}x{flag}")
+        print(f"   • {stage_name}: {', '.join(changes)}")
+
+    return regressions
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--terms", type=int, default=24)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Etapas separadas por coma ({', '.join(STAGES)})")
+    parser.add_argument("--uri", default=BENCH_MONGODB_URI)
+    parser.add_argument("--allow-remote", action="store_true")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto benchmarks/results/)")
+    parser.add_argument("--compare", help="Resultado anterior contra el cual comparar")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Empeoramiento permitido (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    stage_names = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = [name for name in stage_names if name not in STAGES]
+    if unknown:
+        parser.error(f"Etapas desconocidas: {', '.join(unknown)}")
+
+    client = connect(args.uri, args.allow_remote)
+    try:
+        db_name = database_name(args.scale, args.seed, args.terms)
+        if client[db_name].loan.estimated_document_count() != SCALES[args.scale]:
+            print(f"📦 {db_name} no tiene el conjunto de datos; cargándolo...")
+            load_dataset(client[db_name], SCALES[args.scale], args.seed, args.terms)
+
+        print(f"📊 {SCALES[args.scale]} préstamos de {args.terms} cuotas ({db_name})")
+        print("=" * 60)
+        results = {
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "scale": args.scale,
+            "loans": SCALES[args.scale],
+            "seed": args.seed,
+            "terms": args.terms,
+            "python": platform.python_version(),
+            "pymongo": pymongo.version,
+            "server": client.server_info()["version"],
+            "stages": run_benchmark(client, args.uri, db_name, stage_names),
+        }
+    finally:
+        client.close()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.scale}_{results['timestamp']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n📄 Resultados guardados en {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} métricas empeoraron más de {args.tolerance:.0%}")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main_benchmark()
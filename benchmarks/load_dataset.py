@@ -0,0 +1,97 @@
+"""
+Carga un conjunto de datos sintético (loan, user y payment) en un mongod local.
+
+Los documentos salen de benchmarks.synthetic.iter_dataset con una semilla fija,
+por lo que la misma escala y semilla producen siempre los mismos datos. Se
+insertan con insert_many en lotes y al final se crean los índices recomendados
+de indexes.py, como en producción.
+
+Uso:
+    python -m benchmarks.load_dataset --scale 10k [--seed 42] [--terms 24]
+"""
+import argparse
+import os
+import time
+from urllib.parse import urlparse
+
+from pymongo import MongoClient
+
+# Los ids de entidad de los datos sintéticos
+os.environ.setdefault("STOP_ID", "stop-entity")
+os.environ.setdefault("YOYO_ID", "yoyo-entity")
+
+import indexes  # noqa: E402
+from benchmarks.synthetic import iter_dataset  # noqa: E402
+
+# El generador y el benchmark escriben: por defecto solo contra un mongod local
+BENCH_MONGODB_URI = os.getenv("BENCH_MONGODB_URI", "mongodb://localhost:27017")
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+INSERT_BATCH_SIZE = 5000
+
+
+def database_name(scale, seed, terms):
+    """Base de datos del conjunto de datos; cada escala, semilla y número de cuotas tiene la suya"""
+    return f"checker_bench_{scale}_s{seed}_t{terms}"
+
+
+def connect(uri=BENCH_MONGODB_URI, allow_remote=False):
+    """Cliente del benchmark; rechaza hosts remotos salvo que se pida explícitamente"""
+    host = urlparse(uri).hostname
+    if host not in LOCAL_HOSTS and not allow_remote:
+        raise SystemExit(f"❌ {host} no es un mongod local; usa --allow-remote si es intencional")
+    return MongoClient(uri)
+
+
+def load_dataset(db, loan_count, seed=42, terms=24):
+    """Inserta el conjunto de datos en `db` (vaciando sus colecciones) y retorna los documentos por colección"""
+    for collection_name in ("loan", "user", "payment"):
+        db[collection_name].drop()
+
+    counts = {"loan": 0, "user": 0, "payment": 0}
+    pending = {"loan": [], "user": [], "payment": []}
+    start = time.monotonic()
+
+    def flush(collection_name):
+        db[collection_name].insert_many(pending[collection_name], ordered=False)
+        counts[collection_name] += len(pending[collection_name])
+        pending[collection_name] = []
+
+    for collection_name, document in iter_dataset(loan_count, seed, terms):
+        pending[collection_name].append(document)
+        if len(pending[collection_name]) >= INSERT_BATCH_SIZE:
+            flush(collection_name)
+            if collection_name == "loan" and counts["loan"] % 100_000 == 0:
+                print(f"   • {counts['loan']} préstamos insertados ({time.monotonic() - start:.0f}s)")
+
+    for collection_name in pending:
+        if pending[collection_name]:
+            flush(collection_name)
+
+    indexes.ensure_indexes(db)
+    print(f"✅ Datos cargados en {time.monotonic() - start:.0f}s: {counts}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--terms", type=int, default=24)
+    parser.add_argument("--uri", default=BENCH_MONGODB_URI)
+    parser.add_argument("--allow-remote", action="store_true")
+    args = parser.parse_args()
+
+    client = connect(args.uri, args.allow_remote)
+    try:
+        name = database_name(args.scale, args.seed, args.terms)
+        print(f"📦 Cargando {SCALES[args.scale]} préstamos en {name}...")
+        load_dataset(client[name], SCALES[args.scale], args.seed, args.terms)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
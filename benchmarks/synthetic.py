@@ -0,0 +1,94 @@
+"""
+Generador de documentos sintéticos con la forma de las colecciones del checker.
+"""
+import random
+import uuid
+from datetime import date, timedelta
+
+from projections import int_keys
+
+FINANCIAL_ENTITY_IDS = ["stop-entity", "yoyo-entity"]
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def build_amortization_period(rng, term, start_date, arrear_probability=0.1):
+    """Construye una cuota de la tabla de amortización con todos los campos de int_keys"""
+    due_date = start_date + timedelta(days=30 * term)
+    period = {key: rng.randint(0, 500_000) for key in int_keys}
+    period.update(
+        {
+            "id": _uuid(rng),
+            "term": term,
+            "payment_date": f"{due_date.isoformat()}T00:00:00-05:00",
+            "status": rng.choice(["paid", "pending", "arrear"]),
+            "days_in_arrear": rng.randint(1, 90) if rng.random() < arrear_probability else 0,
+            "pending_payment": rng.choice([0, 0, rng.randint(1, 200_000)]),
+            "period_days": 30,
+            "payment_info": [_uuid(rng) for _ in range(rng.randint(0, 2))],
+        }
+    )
+    return period
+
+
+def build_loan(rng, terms=24, status=None, user_id=None):
+    """Construye un documento de la colección loan"""
+    start_date = date(2025, 1, 1) + timedelta(days=rng.randint(0, 300))
+    payment_date = start_date + timedelta(days=rng.randint(1, 365))
+    return {
+        "_id": _uuid(rng),
+        "user_id": user_id or _uuid(rng),
+        "financial_entity_id": rng.choice(FINANCIAL_ENTITY_IDS),
+        "status": status or rng.choice(["paid", "active", "arrear"]),
+        "principal": rng.randint(100_000, 5_000_000),
+        "interest_rate": round(rng.uniform(0.01, 0.05), 4),
+        "payment_date": f"{payment_date.isoformat()}T00:00:00-05:00",
+        "limit_payment_date": f"{(payment_date + timedelta(days=5)).isoformat()}T00:00:00-05:00",
+        "created_at": f"{start_date.isoformat()}T10:00:00.000Z",
+        "amortization": [build_amortization_period(rng, term, start_date) for term in range(1, terms + 1)],
+    }
+
+
+def build_loans(count, seed=42, terms=24):
+    """Genera `count` préstamos de forma determinística a partir de `seed`"""
+    rng = random.Random(seed)
+    return [build_loan(rng, terms) for _ in range(count)]
+
+
+def build_payment(rng, loan):
+    """Construye un documento de la colección payment con transacciones sobre cuotas del préstamo"""
+    terms = rng.sample(range(1, len(loan["amortization"]) + 1), k=min(2, len(loan["amortization"])))
+    return {
+        "_id": _uuid(rng),
+        "loan_id": loan["_id"],
+        "financial_entity_id": loan["financial_entity_id"],
+        "date": loan["created_at"],
+        "transactions": [{"id": _uuid(rng), "details": {"term": term}} for term in terms],
+    }
+
+
+def build_user(rng, user_id):
+    """Construye un documento de la colección user"""
+    return {"_id": user_id, "status": rng.choice(["active", "active", "arrear"])}
+
+
+def iter_dataset(loan_count, seed=42, terms=24, loans_per_user=2, payments_per_loan=2):
+    """Genera (colección, documento) para loan, user y payment de forma determinística.
+
+    Los usuarios tienen en promedio `loans_per_user` préstamos, para que la
+    validación de usuarios encuentre usuarios con varios préstamos. Los documentos
+    se generan de a uno para poder insertar millones sin tenerlos en memoria.
+    """
+    rng = random.Random(seed)
+    user_ids = [_uuid(rng) for _ in range(max(1, loan_count // loans_per_user))]
+
+    for user_id in user_ids:
+        yield "user", build_user(rng, user_id)
+
+    for _ in range(loan_count):
+        loan = build_loan(rng, terms, user_id=rng.choice(user_ids))
+        yield "loan", loan
+        for _ in range(payments_per_loan):
+            yield "payment", build_payment(rng, loan)
@@ -0,0 +1,24 @@
+"""
+Configuración compartida por los scripts del checker.
+
+Solo lee las variables de entorno (y el .env): no valida que estén definidas, no
+crea directorios ni se conecta a MongoDB, así que los scripts auxiliares pueden
+importarla sin los efectos de importar main.py.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configuración de la URI de MongoDB
+MONGODB_URI = os.getenv("MONGODB_URI")
+DATABASE_NAME = os.getenv("DATABASE_NAME")
+
+# IDs de entidades financieras
+STOP_ID = os.getenv("STOP_ID")
+YOYO_ID = os.getenv("YOYO_ID")
+
+# Copia de payment_date como datetime UTC, presente solo mientras payment_date
+# está en UTC-5; permite buscar los pagos del día con un rango indexado
+PAYMENT_DATE_NORMALIZED_FIELD = "payment_date_normalized"
@@ -0,0 +1,149 @@
+"""
+Modo incremental: solo se reevalúan los préstamos modificados desde la última ejecución.
+
+Cada job guarda en INCREMENTAL_STATE_FILE un punto de control al terminar bien:
+
+- change_stream (por defecto): el resume token de un change stream sobre loan.
+  Al empezar se leen los eventos posteriores al token guardado y se restringe la
+  consulta a los _id modificados. Requiere replica set (Atlas siempre lo es).
+- watermark: la fecha de inicio de la ejecución anterior, comparada contra el
+  campo INCREMENTAL_UPDATED_AT_FIELD de loan (fecha BSON o texto ISO 8601 UTC),
+  menos INCREMENTAL_OVERLAP_SECONDS para cubrir diferencias de reloj.
+
+El punto de control se toma antes del recorrido, así lo que cambie durante la
+ejecución se vuelve a evaluar en la siguiente. Si no hay punto de control, el
+historial del change stream ya no lo incluye o hay más de
+INCREMENTAL_MAX_CHANGED_IDS préstamos modificados, se hace el recorrido completo.
+--full-rescan fuerza el recorrido completo y deja guardado el punto de control.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import OperationFailure
+
+INCREMENTAL_STATE_FILE = os.getenv("INCREMENTAL_STATE_FILE", "checker_state.json")
+INCREMENTAL_STRATEGY = os.getenv("INCREMENTAL_STRATEGY", "change_stream")
+INCREMENTAL_UPDATED_AT_FIELD = os.getenv("INCREMENTAL_UPDATED_AT_FIELD", "updated_at")
+INCREMENTAL_OVERLAP_SECONDS = int(os.getenv("INCREMENTAL_OVERLAP_SECONDS", "300"))
+# Por encima de este número de préstamos modificados, el $in deja de convenir
+INCREMENTAL_MAX_CHANGED_IDS = int(os.getenv("INCREMENTAL_MAX_CHANGED_IDS", "50000"))
+
+STRATEGIES = ["change_stream", "watermark"]
+
+# Códigos del servidor cuando el resume token ya no está en el oplog
+CHANGE_STREAM_HISTORY_LOST_CODES = {280, 286}
+
+# El runner puede terminar dos jobs a la vez; el archivo se reescribe completo
+_state_lock = threading.Lock()
+
+
+def load_state(state_file=INCREMENTAL_STATE_FILE):
+    """Retorna el estado guardado por job, o un estado vacío si no existe el archivo"""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(job, checkpoint, state_file=INCREMENTAL_STATE_FILE):
+    """Guarda el punto de control de un job sin tocar los de los demás"""
+    with _state_lock:
+        state = load_state(state_file)
+        state[job] = checkpoint
+        temporary_file = f"{state_file}.tmp"
+        with open(temporary_file, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(temporary_file, state_file)
+
+
+def restrict_query(query, loan_filter):
+    """Agrega el filtro incremental a una consulta de loan (None = recorrido completo)"""
+    if not loan_filter:
+        return query
+    if set(query) & set(loan_filter):
+        return {"$and": [query, loan_filter]}
+    return {**query, **loan_filter}
+
+
+def changed_loan_ids(db, resume_token, max_changed_ids=None):
+    """Lee los eventos de loan desde `resume_token`.
+
+    Retorna (ids modificados, nuevo resume token). Sin token solo se obtiene el
+    token actual y los ids son None. Con `max_changed_ids` la lectura se detiene
+    al superarlo: se retornan max_changed_ids + 1 ids y el token actual, ya que el
+    recorrido completo cubre los eventos que quedaron sin leer.
+    """
+    changed_ids = set()
+    exceeded = False
+    pipeline = [{"$project": {"documentKey": 1}}]
+    with db.loan.watch(pipeline, resume_after=resume_token, max_await_time_ms=1000) as stream:
+        while stream.alive:
+            change = stream.try_next()
+            if change is None:
+                break
+            changed_ids.add(change["documentKey"]["_id"])
+            if max_changed_ids is not None and len(changed_ids) > max_changed_ids:
+                exceeded = True
+                break
+        new_token = stream.resume_token
+
+    if exceeded:
+        _, new_token = changed_loan_ids(db, None)
+    return (changed_ids if resume_token else None), new_token
+
+
+def watermark_filter(watermark):
+    """Préstamos con el campo de actualización posterior a la marca (fecha BSON o texto ISO)"""
+    since = datetime.fromisoformat(watermark) - timedelta(seconds=INCREMENTAL_OVERLAP_SECONDS)
+    return {
+        "$or": [
+            {INCREMENTAL_UPDATED_AT_FIELD: {"$gte": since}},
+            {INCREMENTAL_UPDATED_AT_FIELD: {"$gte": since.strftime("%Y-%m-%dT%H:%M:%S")}},
+        ]
+    }
+
+
+def begin(db, job, strategy=INCREMENTAL_STRATEGY, full_rescan=False, state_file=INCREMENTAL_STATE_FILE):
+    """Calcula el filtro de loan para el job y el punto de control de esta ejecución.
+
+    Retorna (filtro o None para el recorrido completo, punto de control, descripción).
+    """
+    previous = load_state(state_file).get(job, {})
+    if previous.get("strategy") != strategy:
+        previous = {}
+
+    if strategy == "watermark":
+        checkpoint = {"strategy": strategy, "watermark": datetime.now(timezone.utc).isoformat()}
+        if full_rescan or not previous:
+            return None, checkpoint, "recorrido completo"
+        return watermark_filter(previous["watermark"]), checkpoint, f"modificados desde {previous['watermark']}"
+
+    resume_token = None if full_rescan else previous.get("resume_token")
+    try:
+        changed_ids, new_token = changed_loan_ids(db, resume_token, INCREMENTAL_MAX_CHANGED_IDS)
+    except OperationFailure as e:
+        if e.code not in CHANGE_STREAM_HISTORY_LOST_CODES:
+            raise
+        print(f"⚠️  El resume token de {job} ya no está en el oplog; se hace el recorrido completo")
+        changed_ids, new_token = changed_loan_ids(db, None)
+
+    checkpoint = {"strategy": strategy, "resume_token": new_token}
+    if changed_ids is None:
+        return None, checkpoint, "recorrido completo"
+    if len(changed_ids) > INCREMENTAL_MAX_CHANGED_IDS:
+        return None, checkpoint, f"recorrido completo (más de {INCREMENTAL_MAX_CHANGED_IDS} préstamos modificados)"
+    return {"_id": {"$in": list(changed_ids)}}, checkpoint, f"{len(changed_ids)} préstamos modificados"
+
+
+def run_incremental(db, job, run, strategy=INCREMENTAL_STRATEGY, full_rescan=False,
+                    state_file=INCREMENTAL_STATE_FILE):
+    """Ejecuta `run(loan_filter)` en modo incremental y guarda el punto de control si no falla"""
+    loan_filter, checkpoint, description = begin(db, job, strategy, full_rescan, state_file)
+    print(f"🔁 Modo incremental ({strategy}) para {job}: {description}")
+
+    summary = run(loan_filter)
+    save_checkpoint(job, checkpoint, state_file)
+    summary["incremental"] = description
+    return summary
@@ -0,0 +1,203 @@
+"""
+Asesor de índices para las consultas del checker.
+
+Ejecuta explain() sobre cada consulta find y cada agregación que emiten main.py,
+pagos_no_aplicados.py, mora_saldo_cero.py, loan_rules.py e int_keys_audit.py, marca
+las que terminan en un recorrido completo de la colección (COLLSCAN) y puede crear
+los índices recomendados.
+
+Uso:
+    python indexes.py advise    # reporta el plan de cada consulta
+    python indexes.py ensure    # crea los índices recomendados y vuelve a evaluar
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, IndexModel
+
+import int_keys_audit
+import loan_rules
+import main
+import mora_saldo_cero
+import pagos_no_aplicados
+from backfill_payment_date import NORMALIZED_INDEX
+from mongo_utils import create_client
+
+# Valor de ejemplo para las consultas $in; explain() solo necesita la forma de la consulta
+SAMPLE_ID = "__sample_id__"
+
+RECOMMENDED_INDEXES = {
+    "loan": [
+        # main.get_loan_documents
+        IndexModel(
+            [("financial_entity_id", ASCENDING), ("status", ASCENDING), ("amortization.days_in_arrear", ASCENDING)],
+            name="checker_entity_status_days_in_arrear",
+        ),
+        # mora_saldo_cero.query ($elemMatch sobre dos campos del mismo arreglo)
+        IndexModel(
+            [
+                ("financial_entity_id", ASCENDING),
+                ("amortization.days_in_arrear", ASCENDING),
+                ("amortization.pending_payment", ASCENDING),
+            ],
+            name="checker_entity_days_in_arrear_pending_payment",
+        ),
+        # main.count_user_loans
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="checker_user_status"),
+        # main.get_todays_payments_regex_approach (el regex solo usa el prefijo anclado)
+        IndexModel([("payment_date", ASCENDING)], name="checker_payment_date"),
+        # main.get_todays_payments_regex_approach con --payment-date-mode range
+        NORMALIZED_INDEX,
+    ],
+    "payment": [
+        # pagos_no_aplicados: august / september
+        IndexModel([("financial_entity_id", ASCENDING), ("date", ASCENDING)], name="checker_entity_date"),
+        # pagos_no_aplicados: recent / october (sin filtro de entidad)
+        IndexModel([("date", ASCENDING)], name="checker_date"),
+    ],
+}
+
+
+def checker_queries():
+    """Retorna (origen, colección, filtro) de cada consulta que emiten los scripts"""
+    today = datetime.now(timezone(timedelta(hours=-5))).date()
+
+    queries = [
+        ("main.get_loan_documents", "loan", main.build_loan_documents_query()),
+        ("main.get_todays_payments_regex_approach", "loan", main.build_todays_payments_query(today)),
+        ("main.get_todays_payments_regex_approach (range)", "loan", main.build_todays_payments_query(today, "range")),
+        ("main.validate_user_status (user $in)", "user", {"_id": {"$in": [SAMPLE_ID]}}),
+        ("main.count_user_loans", "loan", {"user_id": {"$in": [SAMPLE_ID]}}),
+        ("pagos_no_aplicados (loan $in)", "loan", {"_id": {"$in": [SAMPLE_ID]}}),
+        ("mora_saldo_cero.main", "loan", mora_saldo_cero.query),
+        ("loan_rules.scan_loans", "loan", loan_rules.build_scan_query(loan_rules.default_rule_names())),
+    ]
+    for date_range in ["recent", "august", "september", "october"]:
+        query, _ = pagos_no_aplicados.build_payment_query(date_range)
+        queries.append((f"pagos_no_aplicados.get_unapplied_transactions ({date_range})", "payment", query))
+    query, _ = pagos_no_aplicados.build_payment_query((today.isoformat(), (today + timedelta(days=1)).isoformat()))
+    queries.append(("pagos_no_aplicados.scan_partition (--from/--to)", "payment", query))
+
+    return queries
+
+
+def checker_pipelines():
+    """Retorna (origen, colección, pipeline) de cada agregación que emiten los scripts"""
+    pipelines = [
+        ("main.count_user_loans (aggregate)", "loan", main.build_user_loans_pipeline([SAMPLE_ID])),
+        ("int_keys_audit.audit_rows", "loan", int_keys_audit.build_audit_pipeline([main.STOP_ID, main.YOYO_ID])),
+    ]
+    for date_range in ["recent", "august", "september", "october"]:
+        query, _ = pagos_no_aplicados.build_payment_query(date_range)
+        pipelines.append(
+            (
+                f"pagos_no_aplicados --engine aggregation ({date_range})",
+                "payment",
+                pagos_no_aplicados.build_unapplied_transactions_pipeline(query),
+            )
+        )
+    return pipelines
+
+
+def plan_stages(plan):
+    """Recorre un plan de explain() y retorna todas sus etapas"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def winning_plan_stages(explanation):
+    """Retorna las etapas de los planes ganadores de un explain().
+
+    En una agregación el plan de la consulta inicial puede estar en la raíz o
+    dentro de la etapa $cursor, según cuánto del pipeline se resuelva en la capa
+    de consultas.
+    """
+    stages = []
+    if isinstance(explanation, dict):
+        for key, value in explanation.items():
+            stages.extend(plan_stages(value) if key == "winningPlan" else winning_plan_stages(value))
+    elif isinstance(explanation, list):
+        for item in explanation:
+            stages.extend(winning_plan_stages(item))
+    return stages
+
+
+def explain_query(db, collection_name, query):
+    """Retorna las etapas del plan ganador de una consulta find"""
+    explanation = db.command("explain", {"find": collection_name, "filter": query}, verbosity="queryPlanner")
+    return winning_plan_stages(explanation)
+
+
+def explain_pipeline(db, collection_name, pipeline):
+    """Retorna las etapas de los planes ganadores de una agregación"""
+    explanation = db.command(
+        "explain", {"aggregate": collection_name, "pipeline": pipeline, "cursor": {}}, verbosity="queryPlanner"
+    )
+    return winning_plan_stages(explanation)
+
+
+def advise(db):
+    """Evalúa el plan de cada consulta y agregación del checker y retorna las que recorren la colección completa"""
+    collection_scans = []
+    explanations = [
+        (source, collection_name, explain_query, query) for source, collection_name, query in checker_queries()
+    ] + [
+        (source, collection_name, explain_pipeline, pipeline)
+        for source, collection_name, pipeline in checker_pipelines()
+    ]
+
+    print("🔍 Evaluando planes de consulta...")
+    print("=" * 60)
+    for source, collection_name, explain, command in explanations:
+        stages = explain(db, collection_name, command)
+
+        if "COLLSCAN" in stages:
+            collection_scans.append(source)
+            print(f"❌ {source} [{collection_name}]: COLLSCAN")
+        else:
+            print(f"✅ {source} [{collection_name}]: {' → '.join(reversed(stages))}")
+
+    print("=" * 60)
+    if collection_scans:
+        print(f"⚠️  {len(collection_scans)} consultas recorren la colección completa")
+        print("   Ejecuta `python indexes.py ensure` para crear los índices recomendados")
+    else:
+        print("✅ Todas las consultas usan índices")
+
+    return collection_scans
+
+
+def ensure_indexes(db):
+    """Crea los índices recomendados (create_indexes es idempotente para índices existentes)"""
+    for collection_name, indexes in RECOMMENDED_INDEXES.items():
+        created = db[collection_name].create_indexes(indexes)
+        print(f"📇 {collection_name}: {', '.join(created)}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Asesor de índices del checker")
+    parser.add_argument("command", choices=["advise", "ensure"], help="advise: reporta planes; ensure: crea índices")
+    args = parser.parse_args()
+
+    client = create_client(os.getenv("MONGODB_URI"))
+    db = client[os.getenv("DATABASE_NAME")]
+
+    try:
+        if args.command == "ensure":
+            ensure_indexes(db)
+        collection_scans = advise(db)
+    finally:
+        client.close()
+
+    sys.exit(1 if collection_scans else 0)
@@ -0,0 +1,240 @@
+"""
+Tiempo y round trips por etapa de una ejecución del checker.
+
+COMMAND_LISTENER es un CommandListener de PyMongo que todos los clientes del
+checker registran (mongo_utils.client_options). Cada comando se atribuye a la
+etapa activa en el hilo o tarea que lo envía (la más interna de cada
+Instrumentation, así un benchmark puede medir un job que tiene sus propias
+etapas), y por etapa se acumula:
+
+    seconds          tiempo real de la etapa, sin contar sus etapas anidadas
+    commands         comandos enviados (round trips)
+    mongo_seconds    duración de los comandos medida por el driver (ida y vuelta)
+    bytes_sent       tamaño BSON de los comandos enviados
+    bytes_received   tamaño BSON de las respuestas
+    failed_commands  comandos que terminaron con error
+
+Además, COMMAND_LISTENER acumula un histograma de latencia por tipo de comando
+(find, getMore, update, ...) de todo el proceso, que exporta metrics.py.
+
+Uso:
+    stages = Instrumentation()
+    with stages.stage("backup"):
+        backup_query(...)
+    documents = stages.iterate(get_loan_documents(db), "fetch")
+    summary["stages"] = stages.breakdown()
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import bson
+from pymongo import monitoring
+
+# Medir bytes re-codifica cada comando y respuesta; se puede desactivar con "0"
+INSTRUMENTATION_COUNT_BYTES = os.getenv("INSTRUMENTATION_COUNT_BYTES", "1") == "1"
+
+# Límites en segundos de los histogramas de latencia por comando
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_FIELDS = ["seconds", "commands", "mongo_seconds", "bytes_sent", "bytes_received", "failed_commands"]
+
+# Etapas activas en el hilo o tarea actual: tupla de (Instrumentation, nombre), de la más externa a la más interna
+_active_stages = contextvars.ContextVar("instrumentation_stages", default=())
+
+
+def _bson_size(document):
+    try:
+        return len(bson.encode(document))
+    except Exception:
+        return 0
+
+
+class Instrumentation:
+    """Acumula las métricas de las etapas de una ejecución"""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, **values):
+        with self._lock:
+            stage = self.stages.setdefault(name, dict.fromkeys(STAGE_FIELDS, 0))
+            for field, value in values.items():
+                stage[field] += value
+
+    @contextmanager
+    def stage(self, name):
+        """Atribuye a `name` el tiempo y los comandos del bloque"""
+        active = _active_stages.get()
+        parents = [stage_name for instrumentation, stage_name in active if instrumentation is self]
+        token = _active_stages.set(active + ((self, name),))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _active_stages.reset(token)
+            self.add(name, seconds=elapsed)
+            # El tiempo de una etapa anidada no se cuenta también en la etapa que la contiene
+            if parents:
+                self.add(parents[-1], seconds=-elapsed)
+
+    def iterate(self, iterable, name):
+        """Recorre `iterable` atribuyendo a `name` el tiempo de obtener cada elemento.
+
+        Sirve para los generadores que leen de un cursor mientras otra etapa
+        procesa sus documentos (p. ej. la lectura de loan durante la actualización).
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def breakdown(self):
+        """Métricas por etapa, en el orden en que empezaron"""
+        with self._lock:
+            return {
+                name: {
+                    **stage,
+                    "seconds": round(stage["seconds"], 3),
+                    "mongo_seconds": round(stage["mongo_seconds"], 3),
+                }
+                for name, stage in self.stages.items()
+            }
+
+
+def in_current_stage(function):
+    """Envuelve `function` para que los hilos de un pool atribuyan sus comandos a la etapa actual"""
+    active = _active_stages.get()
+
+    def wrapper(*args, **kwargs):
+        token = _active_stages.set(active)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _active_stages.reset(token)
+
+    return wrapper
+
+
+class StageCommandListener(monitoring.CommandListener):
+    """Atribuye cada comando de MongoDB a la etapa activa al enviarlo y acumula su latencia por tipo"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.latencies = {}
+
+    def started(self, event):
+        # La etapa más interna de cada Instrumentation activa
+        targets = dict(_active_stages.get())
+        size = _bson_size(event.command) if targets and INSTRUMENTATION_COUNT_BYTES else 0
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (targets, size)
+
+    def _finish(self, event, reply=None):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        self._observe(event.command_name, event.duration_micros / 1_000_000)
+        targets, bytes_sent = pending
+        if not targets:
+            return
+        bytes_received = _bson_size(reply) if reply is not None and INSTRUMENTATION_COUNT_BYTES else 0
+        for instrumentation, name in targets.items():
+            instrumentation.add(
+                name,
+                commands=1,
+                mongo_seconds=event.duration_micros / 1_000_000,
+                bytes_sent=bytes_sent,
+                bytes_received=bytes_received,
+                failed_commands=0 if reply is not None else 1,
+            )
+
+    def _observe(self, command_name, seconds):
+        with self._lock:
+            histogram = self.latencies.setdefault(
+                command_name, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            )
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def latency_snapshot(self):
+        """Histogramas por comando: {comando: {"buckets": acumulados por LATENCY_BUCKETS, "sum", "count"}}"""
+        with self._lock:
+            return {
+                name: {**histogram, "buckets": list(histogram["buckets"])}
+                for name, histogram in self.latencies.items()
+            }
+
+    def succeeded(self, event):
+        self._finish(event, event.reply)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+COMMAND_LISTENER = StageCommandListener()
+
+
+def format_stage(stage):
+    """Una línea legible con las métricas de una etapa"""
+    text = (
+        f"{stage['seconds']:.1f}s, {stage['commands']} comandos, "
+        f"{stage['mongo_seconds']:.1f}s en MongoDB, "
+        f"{stage['bytes_sent'] / 1_048_576:.1f} MiB enviados, {stage['bytes_received'] / 1_048_576:.1f} MiB recibidos"
+    )
+    if stage["failed_commands"]:
+        text += f", {stage['failed_commands']} con error"
+    return text
+
+
+def stage_metrics(stages):
+    """Pares (etiqueta, valor) de cada etapa para los correos"""
+    return [(f"Etapa {name}", format_stage(stage)) for name, stage in stages.items()]
+
+
+def stages_html(stages):
+    """Sección "Tiempo por Etapa" del correo HTML de un script (vacía si no hay etapas)"""
+    if not stages:
+        return ""
+    metrics = "".join(
+        f"""
+                <div class="metric">
+                    <span class="metric-label">{label}:</span>
+                    <span class="metric-value">{value}</span>
+                </div>"""
+        for label, value in stage_metrics(stages)
+    )
+    return f"""
+            <div class="section">
+                <h3>⏱️ Tiempo por Etapa</h3>{metrics}
+            </div>
+    """
+
+
+def stages_text(stages):
+    """Sección "Tiempo por etapa" del correo en texto plano (vacía si no hay etapas)"""
+    if not stages:
+        return ""
+    return "⏱️ TIEMPO POR ETAPA:\n" + "".join(f"• {label}: {value}\n" for label, value in stage_metrics(stages))
+
+
+def print_breakdown(stages):
+    """Imprime el tiempo por etapa, de la que más tardó a la que menos"""
+    if not stages:
+        return
+    print("⏱️  Tiempo por etapa:")
+    for name, stage in sorted(stages.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        print(f"   • {name}: {format_stage(stage)}")
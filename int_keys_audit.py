@@ -0,0 +1,149 @@
+"""
+Auditoría en el servidor de los campos enteros (int_keys) de amortization.
+
+Una sola agregación sobre todos los préstamos de las entidades (no solo los que
+selecciona main.get_loan_documents) busca las cuotas con algún campo de
+int_keys guardado como double y retorna únicamente el loan_id, el id y la
+posición de cada cuota y los campos afectados. El filtro inicial descarta en el
+servidor los préstamos sin ningún double, así que por la red solo viajan las
+cuotas con problemas.
+
+Uso:
+    python int_keys_audit.py                       # entidades STOP_ID y YOYO_ID
+    python int_keys_audit.py --entities <id>       # solo las entidades indicadas
+    python run_checks.py --jobs int_keys_audit
+"""
+import csv
+from collections import Counter
+from datetime import datetime
+
+import config
+from instrumentation import Instrumentation, print_breakdown
+from mongo_utils import CURSOR_BATCH_SIZE, create_client
+from projections import int_keys
+
+output_dir = "backups"
+
+CSV_FIELDS = ["loan_id", "installment_id", "index", "fields"]
+
+
+def build_audit_pipeline(entity_ids, keys=int_keys):
+    """Agregación que retorna una fila por cuota con campos de `keys` guardados como double"""
+    return [
+        {
+            "$match": {
+                "financial_entity_id": {"$in": entity_ids},
+                "$or": [{f"amortization.{key}": {"$type": "double"}} for key in keys],
+            }
+        },
+        {"$project": {"amortization.id": 1, **{f"amortization.{key}": 1 for key in keys}}},
+        {"$unwind": {"path": "$amortization", "includeArrayIndex": "index"}},
+        {
+            "$project": {
+                "_id": 0,
+                "loan_id": "$_id",
+                "installment_id": "$amortization.id",
+                "index": 1,
+                # Campos de la cuota (ya proyectada a id + int_keys) cuyo valor es double
+                "fields": {
+                    "$map": {
+                        "input": {
+                            "$filter": {
+                                "input": {"$objectToArray": "$amortization"},
+                                "cond": {
+                                    "$and": [
+                                        {"$in": ["$$this.k", list(keys)]},
+                                        {"$eq": [{"$type": "$$this.v"}, "double"]},
+                                    ]
+                                },
+                            }
+                        },
+                        "in": "$$this.k",
+                    }
+                },
+            }
+        },
+        {"$match": {"fields.0": {"$exists": True}}},
+    ]
+
+
+def audit_rows(db, entity_ids):
+    """Itera las cuotas con campos double de las entidades, directo del cursor"""
+    cursor = db.loan.aggregate(build_audit_pipeline(entity_ids), allowDiskUse=True, batchSize=CURSOR_BATCH_SIZE)
+    with cursor:
+        yield from cursor
+
+
+def run(db, entity_ids=None):
+    """Ejecuta la auditoría, exporta las cuotas a CSV y retorna el resumen de la ejecución"""
+    entity_ids = entity_ids or [config.STOP_ID, config.YOYO_ID]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    csv_file = f"{output_dir}/int_keys_audit_{timestamp}.csv"
+
+    print("🚀 Iniciando auditoría de int_keys en amortization")
+    print(f"   • Entidades: {', '.join(entity_ids)}")
+    print("=" * 60)
+
+    stages = Instrumentation()
+    loans = set()
+    installments = 0
+    fields = Counter()
+
+    with stages.stage("export"), open(csv_file, mode="w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in stages.iterate(audit_rows(db, entity_ids), "aggregation"):
+            loans.add(row["loan_id"])
+            installments += 1
+            fields.update(row["fields"])
+            writer.writerow(
+                {
+                    "loan_id": str(row["loan_id"]),
+                    "installment_id": str(row.get("installment_id", "")),
+                    "index": row["index"],
+                    "fields": ",".join(row["fields"]),
+                }
+            )
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN FINAL:")
+    print(f"   • Préstamos con campos double: {len(loans)}")
+    print(f"   • Cuotas con campos double: {installments}")
+    for key, count in fields.most_common():
+        print(f"   • {key}: {count}")
+    print(f"   • Archivo CSV: {csv_file}")
+    stage_breakdown = stages.breakdown()
+    print_breakdown(stage_breakdown)
+    print("=" * 60)
+
+    return {
+        "timestamp": timestamp,
+        "execution_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "entities": entity_ids,
+        "loans_with_doubles": len(loans),
+        "installments_with_doubles": installments,
+        "fields": dict(fields.most_common()),
+        "csv_file": csv_file,
+        "stages": stage_breakdown,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Busca en el servidor cuotas con campos de int_keys guardados como double")
+    parser.add_argument(
+        "--entities",
+        default=",".join(entity for entity in (config.STOP_ID, config.YOYO_ID) if entity),
+        help="IDs de financial_entity_id separados por coma (por defecto STOP_ID y YOYO_ID)",
+    )
+    args = parser.parse_args()
+    entity_ids = [entity.strip() for entity in args.entities.split(",") if entity.strip()]
+    if not entity_ids:
+        parser.error("Indica --entities o configura STOP_ID y YOYO_ID en las variables de entorno")
+
+    client = create_client(config.MONGODB_URI)
+    try:
+        run(client[config.DATABASE_NAME], entity_ids)
+    finally:
+        client.close()
@@ -0,0 +1,404 @@
+"""
+Motor de reglas sobre la colección loan con un solo recorrido.
+
+Las verificaciones a nivel de préstamo (préstamos pagados con cuotas en mora de
+main.py, cuotas en mora con saldo cero de mora_saldo_cero.py y la validación de
+payment_info que main.py tiene desactivada) leían cada una su propio subconjunto
+de loan para las mismas entidades. Aquí cada verificación se registra en RULES
+con:
+
+    query      fragmento de filtro que selecciona sus candidatos en el servidor
+    projection campos de loan que necesita
+    predicate  (préstamo, contexto) -> índices de amortization a corregir
+    fix        (préstamo, cuota, contexto) -> {campo: valor nuevo} de la cuota
+    context    opcional, (db, préstamos del lote) -> datos externos del lote
+    after      opcional, (db, referencias de préstamos corregidos) -> métricas
+
+Un único cursor con el $or de los filtros de las reglas activas alimenta todas
+las reglas y el backup: cada documento completo se guarda en el backup antes de
+evaluarlo, así loan se recorre una sola vez. Las correcciones de un préstamo se
+combinan en un solo UpdateOne con $set por índice. El filtro de cada UpdateOne
+exige que los campos corregidos conserven el valor leído, así un préstamo que
+cambió durante el recorrido no se sobrescribe: se relee por _id y, si no tiene
+los valores corregidos, se reporta como conflicto. Los préstamos con datos que una regla no puede evaluar se cuentan y
+se reportan por regla.
+
+Uso:
+    python loan_rules.py                                  # reglas activas por defecto
+    python loan_rules.py --rules zero_balance_arrears     # solo las reglas indicadas
+    python run_checks.py --jobs loan_rules,pagos_no_aplicados
+"""
+import os
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+import main
+import mora_saldo_cero
+from backups import BackupWriter, backup_filename
+from instrumentation import Instrumentation, print_breakdown
+from mongo_utils import CURSOR_BATCH_SIZE, chunked, confirmed_operations, create_client, execute_bulk, fetch_by_ids, stream_find
+from projections import LOAN_ARREARS_PROJECTION, ZERO_BALANCE_PROJECTION
+
+# Préstamos por lote: cada lote comparte las consultas de contexto y un bulk_write
+LOAN_RULES_BATCH_SIZE = int(os.getenv("LOAN_RULES_BATCH_SIZE", "500"))
+
+output_dir = "backups"
+
+
+def _validate_rule_users(db, loan_refs):
+    """Paso 4 de main.run sobre los préstamos pagados corregidos"""
+    validation_results, updated_users = main.validate_user_status(db, loan_refs)
+    return {"users_validated": len(validation_results), "users_updated": len(updated_users)}
+
+
+def _paid_loan_arrears(loan, context):
+    if loan.get("status") != "paid" or not loan.get("amortization"):
+        return []
+    elements = main.find_arrear_elements(loan["amortization"])
+    return [element["index"] for element in elements]
+
+
+def _existing_transactions(db, loans):
+    """Pares (loan_id, id de transacción) existentes en payment para los préstamos del lote"""
+    loan_ids = [loan["_id"] for loan in loans]
+    cursor = db.payment.find({"loan_id": {"$in": loan_ids}}, {"loan_id": 1, "transactions.id": 1})
+    return {
+        (payment["loan_id"], transaction.get("id"))
+        for payment in cursor
+        for transaction in payment.get("transactions", [])
+    }
+
+
+def _invalid_payment_info(loan, context):
+    return [
+        index
+        for index, element in enumerate(loan.get("amortization", []))
+        if any((loan["_id"], payment_id) not in context for payment_id in element.get("payment_info") or [])
+    ]
+
+
+def _clean_payment_info(loan, element, context):
+    return {
+        "payment_info": [
+            payment_id for payment_id in element["payment_info"] if (loan["_id"], payment_id) in context
+        ]
+    }
+
+
+# Reglas en orden de prioridad: si dos reglas corrigen el mismo campo de una
+# cuota con valores distintos, se conserva el de la primera
+RULES = {
+    "paid_loan_arrears": {
+        "description": "Préstamos pagados con cuotas en mora (main.py, paso 3)",
+        "enabled": True,
+        "query": {"status": "paid", "amortization": {"$elemMatch": {"days_in_arrear": {"$gt": 0}}}},
+        "projection": {"status": 1, **LOAN_ARREARS_PROJECTION},
+        "predicate": _paid_loan_arrears,
+        "fix": lambda loan, element, context: {"days_in_arrear": 0},
+        "after": _validate_rule_users,
+    },
+    "zero_balance_arrears": {
+        "description": "Cuotas en mora con saldo pendiente cero (mora_saldo_cero.py)",
+        "enabled": True,
+        "query": {"amortization": {"$elemMatch": {"days_in_arrear": {"$gt": 0}, "pending_payment": 0}}},
+        "projection": ZERO_BALANCE_PROJECTION,
+        "predicate": lambda loan, context: mora_saldo_cero.find_zero_balance_installments(loan),
+        "fix": lambda loan, element, context: {"days_in_arrear": 0},
+    },
+    # Desactivada como validate_payment_info_consistency en main.py; se activa con --rules
+    "payment_info_consistency": {
+        "description": "IDs de payment_info que no existen en la colección payment",
+        "enabled": False,
+        "query": {"amortization.payment_info.0": {"$exists": True}},
+        "projection": {"amortization.payment_info": 1},
+        "context": _existing_transactions,
+        "predicate": _invalid_payment_info,
+        "fix": _clean_payment_info,
+    },
+}
+
+
+def default_rule_names():
+    """Reglas que se aplican si no se indican otras"""
+    return [name for name, rule in RULES.items() if rule["enabled"]]
+
+
+def build_scan_query(rule_names):
+    """Préstamos de las entidades que cumplen el filtro de al menos una regla"""
+    return {
+        "financial_entity_id": {"$in": [main.STOP_ID, main.YOYO_ID]},
+        "$or": [RULES[name]["query"] for name in rule_names],
+    }
+
+
+def build_scan_projection(rule_names):
+    """Unión de los campos que leen las reglas"""
+    projection = {"_id": 1, "user_id": 1}
+    for name in rule_names:
+        projection.update(RULES[name]["projection"])
+    return projection
+
+
+def evaluate_loan(loan, rule_names, contexts):
+    """Aplica las reglas a un préstamo.
+
+    Retorna (cuotas por regla, $set combinado, filtro de guarda, reglas que no se
+    pudieron evaluar). El $set y el filtro quedan vacíos si ninguna regla encontró
+    algo que corregir.
+    """
+    findings = {}
+    to_set = {}
+    guard = {}
+    failed_rules = []
+    amortization = loan.get("amortization", [])
+
+    for name in rule_names:
+        rule = RULES[name]
+        context = contexts.get(name)
+        try:
+            indexes = rule["predicate"](loan, context)
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"❌ Préstamo {loan['_id']}: Error al evaluar {name}: {e!r}")
+            failed_rules.append(name)
+            continue
+        if not indexes:
+            continue
+
+        findings[name] = indexes
+        for index in indexes:
+            element = amortization[index]
+            for field, value in rule["fix"](loan, element, context).items():
+                path = f"amortization.{index}.{field}"
+                if path in to_set:
+                    if to_set[path] != value:
+                        print(f"⚠️  Préstamo {loan['_id']}: {name} ignorada en {path}, ya la corrige otra regla")
+                    continue
+                to_set[path] = value
+                guard[path] = element.get(field)
+
+    return findings, to_set, guard, failed_rules
+
+
+def value_at(document, path):
+    """Valor de `path` ("amortization.3.days_in_arrear") en el documento, o None si no existe"""
+    value = document
+    for part in path.split("."):
+        if isinstance(value, list):
+            index = int(part)
+            value = value[index] if index < len(value) else None
+        elif isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return None
+    return value
+
+
+def verify_rule_updates(loan_collection, pending_updates, indexes):
+    """Relee por _id los préstamos de `indexes` y retorna los que tienen todos los valores corregidos"""
+    projection = {path.split(".", 1)[0]: 1 for index in indexes for path in pending_updates[index][1]}
+    current_loans = fetch_by_ids(loan_collection, [pending_updates[index][0]["_id"] for index in indexes], projection)
+    return {
+        index
+        for index in indexes
+        if pending_updates[index][0]["_id"] in current_loans
+        and all(
+            value_at(current_loans[pending_updates[index][0]["_id"]], path) == value
+            for path, value in pending_updates[index][1].items()
+        )
+    }
+
+
+def flush_rule_updates(loan_collection, pending_updates):
+    """Envía las correcciones combinadas de un lote y retorna (registros aplicados, registros en conflicto).
+
+    Si el lote modificó menos préstamos que operaciones, se releen por _id y solo
+    se dan por aplicados los que tienen los valores corregidos; el resto cambió
+    durante el recorrido y se reporta como conflicto.
+    """
+    operations = [
+        UpdateOne({"_id": record["_id"], **guard}, {"$set": to_set})
+        for record, to_set, guard in pending_updates
+    ]
+
+    try:
+        details, errors = execute_bulk(loan_collection, operations)
+    except Exception as e:
+        print(f"❌ Error al actualizar lote de {len(operations)} préstamos: {e}")
+        return [], []
+
+    print(
+        f"📦 Lote de {len(operations)} préstamos enviado "
+        f"(matched: {details['nMatched']}, modified: {details['nModified']}, errores: {len(errors)})"
+    )
+    confirmed = confirmed_operations(
+        details, errors, len(operations), lambda indexes: verify_rule_updates(loan_collection, pending_updates, indexes)
+    )
+
+    applied = []
+    conflicts = []
+    for index, (record, _, _) in enumerate(pending_updates):
+        if index in errors:
+            print(f"❌ Préstamo {record['_id']}: Error al aplicar {', '.join(record['rules'])}: {errors[index]}")
+        elif index not in confirmed:
+            print(f"⚠️  Préstamo {record['_id']}: Conflicto, cambió durante el recorrido y no se aplicó {', '.join(record['rules'])}")
+            conflicts.append(record)
+        else:
+            applied.append(record)
+    return applied, conflicts
+
+
+def write_backup(documents, writer, stages):
+    """Guarda cada documento en el backup antes de pasarlo a las reglas"""
+    for document in documents:
+        with stages.stage("backup"):
+            writer.write(document)
+        yield document
+
+
+def scan_loans(db, rule_names, batch_size=LOAN_RULES_BATCH_SIZE, stages=None, backup_writer=None):
+    """Recorre una sola vez los candidatos de todas las reglas y aplica sus correcciones.
+
+    Con `backup_writer` se leen los documentos completos y cada uno se guarda en
+    el backup antes de corregirlo. Retorna (préstamos recorridos, registros de los
+    préstamos corregidos, préstamos que alguna regla no pudo evaluar, {regla:
+    préstamos que no pudo evaluar}, préstamos en conflicto).
+    """
+    stages = stages or Instrumentation()
+    loans_scanned = 0
+    loans_malformed = 0
+    loans_conflicted = 0
+    malformed_by_rule = dict.fromkeys(rule_names, 0)
+    applied = []
+    projection = None if backup_writer else build_scan_projection(rule_names)
+    documents = stages.iterate(
+        stream_find(db.loan, build_scan_query(rule_names), projection, batch_size=CURSOR_BATCH_SIZE),
+        "fetch",
+    )
+    if backup_writer:
+        documents = write_backup(documents, backup_writer, stages)
+
+    for loans in chunked(documents, batch_size):
+        loans_scanned += len(loans)
+        contexts = {name: RULES[name]["context"](db, loans) for name in rule_names if "context" in RULES[name]}
+
+        pending_updates = []
+        for loan in loans:
+            findings, to_set, guard, failed_rules = evaluate_loan(loan, rule_names, contexts)
+            if failed_rules:
+                loans_malformed += 1
+                for name in failed_rules:
+                    malformed_by_rule[name] += 1
+            if not to_set:
+                continue
+            record = {"_id": loan["_id"], "user_id": loan.get("user_id"), "rules": findings}
+            pending_updates.append((record, to_set, guard))
+
+        if pending_updates:
+            with stages.stage("amortization_update"):
+                batch_applied, batch_conflicts = flush_rule_updates(db.loan, pending_updates)
+            applied.extend(batch_applied)
+            loans_conflicted += len(batch_conflicts)
+
+    return loans_scanned, applied, loans_malformed, malformed_by_rule, loans_conflicted
+
+
+def run(db, rule_names=None):
+    """Ejecuta las reglas indicadas (por defecto las activas) y retorna el resumen de la ejecución"""
+    rule_names = rule_names or default_rule_names()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    print("🚀 Iniciando reglas sobre la colección loan")
+    for name in rule_names:
+        print(f"   • {name}: {RULES[name]['description']}")
+    print("=" * 60)
+
+    # El backup de los documentos completos se escribe durante el mismo recorrido,
+    # cada documento antes de su corrección
+    stages = Instrumentation()
+    backup_file = backup_filename(f"{output_dir}/loan_rules_documents_{timestamp}")
+    with BackupWriter(backup_file) as backup_writer, stages.stage("rules"):
+        loans_scanned, applied, loans_malformed, malformed_by_rule, loans_conflicted = scan_loans(
+            db, rule_names, stages=stages, backup_writer=backup_writer
+        )
+    print(f"📄 Backup de {backup_writer.count} documentos guardado en {backup_file}")
+
+    rules_summary = {}
+    for name in rule_names:
+        loans = [record for record in applied if name in record["rules"]]
+        rules_summary[name] = {
+            "loans_updated": len(loans),
+            "installments_updated": sum(len(record["rules"][name]) for record in loans),
+            "loans_malformed": malformed_by_rule[name],
+        }
+        if "after" in RULES[name]:
+            loan_refs = [{"_id": record["_id"], "user_id": record["user_id"]} for record in loans]
+            with stages.stage(f"{name}.after"):
+                rules_summary[name].update(RULES[name]["after"](db, loan_refs))
+
+    files_generated = [backup_file]
+    if applied:
+        updates_file = f"{output_dir}/loan_rules_updates_{timestamp}.json"
+        records = [{"loan_id": str(record["_id"]), "rules": record["rules"]} for record in applied]
+        if main.save_to_json(records, updates_file):
+            print(f"📄 Correcciones guardadas en: {updates_file}")
+            files_generated.append(updates_file)
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN FINAL:")
+    print(f"   • Préstamos recorridos: {loans_scanned}")
+    print(f"   • Préstamos corregidos: {len(applied)}")
+    print(f"   • Préstamos con datos que no se pudieron evaluar: {loans_malformed}")
+    print(f"   • Préstamos en conflicto (cambiaron durante el recorrido): {loans_conflicted}")
+    for name, rule_summary in rules_summary.items():
+        details = ", ".join(f"{key}={value}" for key, value in rule_summary.items())
+        print(f"   • {name}: {details}")
+    print(f"   • Archivos generados: {', '.join(files_generated)}")
+    stage_breakdown = stages.breakdown()
+    print_breakdown(stage_breakdown)
+    print("=" * 60)
+
+    return {
+        "timestamp": timestamp,
+        "execution_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "rules": rule_names,
+        "loans_scanned": loans_scanned,
+        "loans_updated": len(applied),
+        "loans_malformed": loans_malformed,
+        "loans_conflicted": loans_conflicted,
+        "rules_summary": rules_summary,
+        "files_generated": files_generated,
+        "stages": stage_breakdown,
+    }
+
+
+def parse_rule_names(value):
+    """Convierte "a,b" en la lista de reglas, validando que existan"""
+    rule_names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in rule_names if name not in RULES]
+    if unknown:
+        raise ValueError(f"Reglas desconocidas: {', '.join(unknown)}")
+    return rule_names
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Aplica las reglas de préstamos con un solo recorrido de loan")
+    parser.add_argument(
+        "--rules",
+        default=",".join(default_rule_names()),
+        help=f"Reglas a aplicar separadas por coma ({', '.join(RULES)})",
+    )
+    args = parser.parse_args()
+
+    try:
+        selected_rules = parse_rule_names(args.rules)
+    except ValueError as e:
+        parser.error(str(e))
+
+    client = create_client(main.MONGODB_URI)
+    try:
+        run(client[main.DATABASE_NAME], selected_rules)
+    finally:
+        client.close()
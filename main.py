@@ -1,20 +1,23 @@
 import os
-import json
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from datetime import datetime, timedelta, timezone
-from dotenv import load_dotenv
 import resend
 
-load_dotenv()
+from amortization_schema import IntKeysReport, validate_int_keys
+from backups import backup_filename, backup_query
+from config import DATABASE_NAME, MONGODB_URI, PAYMENT_DATE_NORMALIZED_FIELD, STOP_ID, YOYO_ID
+from incremental import restrict_query, run_incremental
+from instrumentation import Instrumentation, print_breakdown, stages_html, stages_text
+from mongo_utils import chunked, confirmed_operations, create_client, execute_bulk, fetch_by_ids, stream_find
+from projections import (
+    LOAN_ARREARS_PROJECTION,
+    TODAYS_PAYMENTS_PROJECTION,
+    USER_STATUS_PROJECTION,
+)
+from serializers import JSON_PRETTY, dump_to_file
 
-# Configuración de la URI de MongoDB (puedes cambiar esto por una variable de entorno o input)
-MONGODB_URI = os.getenv("MONGODB_URI")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
 COLLECTION_NAME = "loan"
 
-STOP_ID = os.getenv("STOP_ID")
-YOYO_ID = os.getenv("YOYO_ID")
-
 # Configuración de email
 RESEND_API_KEY = os.getenv("RESEND_API_KEY")
 EMAIL_FROM = os.getenv("EMAIL_FROM")
@@ -26,41 +29,24 @@ if not STOP_ID or not YOYO_ID:
 if not RESEND_API_KEY or not EMAIL_FROM or not EMAIL_TO:
     print("⚠️  Variables de email no configuradas. Las notificaciones por correo estarán deshabilitadas.")
 
+# Cantidad de préstamos por cada bulk_write de amortization
+AMORTIZATION_BULK_BATCH_SIZE = int(os.getenv("AMORTIZATION_BULK_BATCH_SIZE", "500"))
+
+# Cantidad máxima de user_ids por consulta $in
+USER_LOOKUP_CHUNK_SIZE = 1000
+
+# Cantidad de préstamos por cada bulk_write de conversión de fechas
+PAYMENT_DATE_BULK_BATCH_SIZE = int(os.getenv("PAYMENT_DATE_BULK_BATCH_SIZE", "500"))
+
 # Directorio y archivo de backup
 output_dir = "backups"
 os.makedirs(output_dir, exist_ok=True)
 
-int_keys = [
-    "principal",
-    "total_amount",
-    "principal_payment_amount",
-    "interest_amount",
-    "taxes",
-    "days_in_arrear",
-    "pending_payment",
-    "arrear_interest_amount",
-    "pending_principal_payment_amount",
-    "pending_interest_amount",
-    "pending_interest_taxes_amount",
-    "pending_arrear_interest_amount",
-    "pending_guarantee_amount",
-    "pending_guarantee_taxes_amount",
-    "pending_other_expenses_amount",
-    "period_days",
-    "interest_taxes_amount",
-    "guarantee_amount",
-    "guarantee_taxes_amount",
-    "other_expenses_amount",
-    "arrear_interest_paid",
-    "arrear_interest_taxes_amount",
-    "pending_arrear_interest_taxes_amount",
-]
-
 
 def connect_to_mongodb(uri):
     """Conecta a MongoDB Atlas usando la URI proporcionada"""
     try:
-        client = MongoClient(uri)
+        client = create_client(uri)
         # Verificar la conexión
         client.admin.command("ping")
         print("✅ Conexión exitosa a MongoDB Atlas")
@@ -70,32 +56,46 @@ def connect_to_mongodb(uri):
         return None
 
 
-def get_loan_documents(db):
-    """Obtiene los documentos de la colección loan según los criterios especificados"""
-    try:
-        # Consulta equivalente a la del mongo shell
-        query = {
-            "financial_entity_id": {"$in": [STOP_ID, YOYO_ID]},
-            "status": "paid",
-            "amortization": {"$elemMatch": {"days_in_arrear": {"$gt": 0}}},
-        }
+def build_loan_documents_query(loan_filter=None):
+    """Consulta de préstamos pagados con elementos de amortization en mora.
 
-        loan_collection = db.loan
-        results = list(loan_collection.find(query))
+    `loan_filter` restringe la consulta a los préstamos modificados (ver incremental.py).
+    """
+    # Consulta equivalente a la del mongo shell
+    query = {
+        "financial_entity_id": {"$in": [STOP_ID, YOYO_ID]},
+        "status": "paid",
+        "amortization": {"$elemMatch": {"days_in_arrear": {"$gt": 0}}},
+    }
+    return restrict_query(query, loan_filter)
+
+
+def get_loan_documents(db, projection=LOAN_ARREARS_PROJECTION, loan_filter=None):
+    """Itera los documentos de la colección loan según los criterios especificados.
 
-        return results
+    Un error del cursor a mitad del recorrido se propaga: la ejecución no debe
+    reportarse como exitosa con solo una parte de los préstamos.
+    """
+    try:
+        # Se recorre el cursor en lugar de cargar todos los documentos en memoria
+        yield from stream_find(db.loan, build_loan_documents_query(loan_filter), projection)
 
     except Exception as e:
         print(f"❌ Error al consultar la colección loan: {e}")
-        return []
+        raise
 
 
-def save_to_json(data, filename):
-    """Guarda los datos en un archivo JSON"""
-    try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+def collect_loan_refs(documents, loan_refs):
+    """Registra el _id y user_id de cada préstamo que pasa por el pipeline"""
+    for document in documents:
+        loan_refs.append({"_id": document.get("_id"), "user_id": document.get("user_id")})
+        yield document
 
+
+def save_to_json(data, filename, pretty=JSON_PRETTY):
+    """Guarda los datos en un archivo JSON (ver serializers.py para el backend)"""
+    try:
+        dump_to_file(data, filename, pretty=pretty)
         return True
 
     except Exception as e:
@@ -103,94 +103,388 @@ def save_to_json(data, filename):
         return False
 
 
-def update_amortization_arrears(db, loan_documents):
+def find_arrear_elements(amortization):
+    """Retorna los elementos de amortization con days_in_arrear mayor a cero.
+
+    Los tipos de int_keys se validan aparte, por lotes (amortization_schema.py).
+    """
+    arrear_elements = []
+    for j, element in enumerate(amortization):
+        days_in_arrear = int(element.get("days_in_arrear", 0))
+        if days_in_arrear > 0:
+            arrear_elements.append(
+                {"index": j, "days_in_arrear": days_in_arrear}
+            )
+    return arrear_elements
+
+
+def build_amortization_update(i, loan_doc):
+    """Construye la actualización de un préstamo, o None si no tiene elementos en mora.
+
+    Retorna la tupla (operación, número de préstamo, registro de la actualización,
+    _id del préstamo) que se acumula en el lote de bulk_write.
+    """
+    loan_id = loan_doc.get("_id")
+    print(f"🔍 Préstamo {i}: ID={loan_id}")
+
+    amortization = loan_doc.get("amortization", [])
+
+    if not amortization:
+        print(f"⚠️  Préstamo {i}: No tiene amortization")
+        return None
+
+    # Contar elementos con days_in_arrear > 0
+    arrear_elements = find_arrear_elements(amortization)
+
+    if not arrear_elements:
+        print(f"ℹ️  Préstamo {i}: No tiene elementos con days_in_arrear > 0")
+        return None
+
+    print(
+        f"📋 Préstamo {i}: Encontrados {len(arrear_elements)} elementos con days_in_arrear > 0"
+    )
+
+    # Solo se modifican los elementos en mora mediante arrayFilters,
+    # sin reenviar el arreglo amortization completo
+    operation = UpdateOne(
+        {"_id": loan_id, "amortization.days_in_arrear": {"$gt": 0}},
+        {"$set": {"amortization.$[e].days_in_arrear": 0}},
+        array_filters=[{"e.days_in_arrear": {"$gt": 0}}],
+    )
+    return (
+        operation,
+        i,
+        {
+            "loan_id": str(loan_id),
+            "elements_updated": len(arrear_elements),
+            "arrear_elements": arrear_elements,
+        },
+        loan_id,
+    )
+
+
+def print_amortization_summary(updated_loans):
+    """Imprime el resumen de las actualizaciones de amortization"""
+    if updated_loans:
+        print(f"\n📊 RESUMEN DE ACTUALIZACIONES DE AMORTIZATION:")
+        print(f"   • Préstamos actualizados: {len(updated_loans)}")
+        total_elements = sum(loan["elements_updated"] for loan in updated_loans)
+        print(f"   • Elementos de amortization actualizados: {total_elements}")
+    else:
+        print(f"\n📊 No se realizaron actualizaciones de amortization")
+
+
+def update_amortization_arrears(db, loan_documents, batch_size=AMORTIZATION_BULK_BATCH_SIZE):
     """Actualiza los elementos de amortization que tengan days_in_arrear mayor a cero"""
     try:
         loan_collection = db.loan
         updated_loans = []
+        pending_updates = []
 
-        print(f"\n🔄 Actualizando amortization para {len(loan_documents)} préstamos...")
+        print(f"\n🔄 Actualizando amortization de los préstamos encontrados...")
 
         for i, loan_doc in enumerate(loan_documents, 1):
-            loan_id = loan_doc.get("_id")
-            print(f"🔍 Préstamo {i}: ID={loan_id}")
+            pending_update = build_amortization_update(i, loan_doc)
+            if pending_update is None:
+                continue
+            pending_updates.append(pending_update)
 
-            amortization = loan_doc.get("amortization", [])
+            if len(pending_updates) >= batch_size:
+                updated_loans.extend(flush_amortization_updates(loan_collection, pending_updates))
+                pending_updates = []
 
-            if not amortization:
-                print(f"⚠️  Préstamo {i}: No tiene amortization")
-                continue
+        if pending_updates:
+            updated_loans.extend(flush_amortization_updates(loan_collection, pending_updates))
 
-            # Contar elementos con days_in_arrear > 0
-            arrear_elements = []
-            update_array = []
-            for j, element in enumerate(amortization):
-                print("element", element)
-                days_in_arrear = element.get("days_in_arrear", 0)
-                days_in_arrear = int(days_in_arrear)
-                print(f"🔍 Préstamo {i}: Elemento {j}: days_in_arrear={days_in_arrear}")
-                print("type(days_in_arrear)", type(days_in_arrear))
-                if days_in_arrear > 0:
-                    arrear_elements.append(
-                        {"index": j, "days_in_arrear": days_in_arrear}
-                    )
-                    updated_element = element.copy()
-                    updated_element["days_in_arrear"] = 0
-                    update_array.append(updated_element)
-                else:
-                    update_array.append(element)
-
-                type_check = all([isinstance(element[key], int) for key in int_keys])
-                if not type_check:
-                    print(
-                        f"Crédito con id {loan_id} tiene campos flotantes en la tabla de amortización {element.get('id')}"
-                    )
+        # Resumen de actualizaciones
+        print_amortization_summary(updated_loans)
 
-            if not arrear_elements:
-                print(f"ℹ️  Préstamo {i}: No tiene elementos con days_in_arrear > 0")
-                continue
+        return updated_loans
+
+    except Exception as e:
+        # Los errores de escritura se reportan por lote; lo que llega aquí (p. ej.
+        # el cursor de loan) interrumpe la ejecución
+        print(f"❌ Error al actualizar amortization: {e}")
+        raise
 
+
+def flush_amortization_updates(loan_collection, pending_updates):
+    """Envía un lote de actualizaciones de amortization con bulk_write.
+
+    Retorna los registros de los préstamos cuya actualización se confirmó.
+    """
+    operations = [operation for operation, _, _, _ in pending_updates]
+
+    try:
+        details, errors = execute_bulk(loan_collection, operations)
+    except Exception as update_error:
+        print(f"❌ Error al actualizar lote de {len(operations)} préstamos: {update_error}")
+        return []
+
+    def verify(indexes):
+        loan_ids = [pending_updates[index][3] for index in indexes]
+        current_loans = fetch_by_ids(loan_collection, loan_ids, LOAN_ARREARS_PROJECTION)
+        return confirmed_amortization_updates(pending_updates, indexes, current_loans)
+
+    confirmed = confirmed_operations(details, errors, len(operations), verify)
+    return report_amortization_batch(pending_updates, details, errors, confirmed)
+
+
+def confirmed_amortization_updates(pending_updates, indexes, current_loans):
+    """Índices de `indexes` cuyo préstamo, releído por _id en `current_loans`, ya no tiene elementos en mora"""
+    return {
+        index
+        for index in indexes
+        if pending_updates[index][3] in current_loans
+        and not find_arrear_elements(current_loans[pending_updates[index][3]].get("amortization") or [])
+    }
+
+
+def report_amortization_batch(pending_updates, details, errors, confirmed):
+    """Reporta el resultado de un lote de amortization y retorna los préstamos de `confirmed`.
+
+    El filtro de cada operación exige que el préstamo siga en mora, así que una
+    operación sin modificaciones corresponde a un préstamo que cambió después de
+    leerlo. Como bulk_write no dice cuáles fueron, en ese caso los préstamos del
+    lote se releen por _id (mongo_utils.confirmed_operations) y se confirman los
+    que ya no tienen elementos en mora, incluido uno que otro proceso corrigió
+    primero.
+    """
+    operations_count = len(pending_updates)
+    print(
+        f"📦 Lote de {operations_count} préstamos enviado "
+        f"(matched: {details['nMatched']}, modified: {details['nModified']}, errores: {len(errors)})"
+    )
+    if details["nModified"] < operations_count - len(errors):
+        print(
+            f"⚠️  {operations_count - len(errors) - details['nModified']} préstamos del lote "
+            f"cambiaron antes de actualizarlos; se releyeron para confirmar cada uno"
+        )
+
+    updated_loans = []
+    for index, (_, i, loan_update, _) in enumerate(pending_updates):
+        if index in errors:
+            print(f"❌ Error al actualizar préstamo {i}: {errors[index]}")
+        elif index not in confirmed:
+            print(f"⚠️  Préstamo {i}: No se pudo actualizar (sigue en mora o ya no existe)")
+        else:
             print(
-                f"📋 Préstamo {i}: Encontrados {len(arrear_elements)} elementos con days_in_arrear > 0"
+                f"✅ Préstamo {i}: Actualizados {loan_update['elements_updated']} elementos de amortization"
             )
+            updated_loans.append(loan_update)
 
-            # Actualizar en MongoDB
-            try:
-                update_result = loan_collection.update_one(
-                    {"_id": loan_id}, {"$set": {"amortization": update_array}}
-                )
+    return updated_loans
 
-                if update_result.modified_count > 0:
-                    print(
-                        f"✅ Préstamo {i}: Actualizados {len(arrear_elements)} elementos de amortization"
-                    )
-                    updated_loans.append(
-                        {
-                            "loan_id": str(loan_id),
-                            "elements_updated": len(arrear_elements),
-                            "arrear_elements": arrear_elements,
-                        }
-                    )
-                else:
-                    print(f"⚠️  Préstamo {i}: No se pudo actualizar")
 
-            except Exception as update_error:
-                print(f"❌ Error al actualizar préstamo {i}: {update_error}")
+def build_user_loans_pipeline(user_ids):
+    """Agregación que cuenta los préstamos totales y en arrear de cada usuario"""
+    return [
+        {"$match": {"user_id": {"$in": list(user_ids)}}},
+        {
+            "$group": {
+                "_id": "$user_id",
+                "loans": {"$sum": 1},
+                "arrear_loans": {"$sum": {"$cond": [{"$eq": ["$status", "arrear"]}, 1, 0]}},
+            }
+        },
+    ]
+
+
+def count_user_loans(loan_collection, user_ids):
+    """Cuenta, con una sola agregación, los préstamos totales y en arrear de cada usuario"""
+    if not user_ids:
+        return {}
+
+    pipeline = build_user_loans_pipeline(user_ids)
+    return {row["_id"]: row for row in loan_collection.aggregate(pipeline)}
+
+
+def decide_user_reactivation(loans_count, arrear_loans_count):
+    """Decide si un usuario en arrear debe pasar a active según sus préstamos"""
+    if loans_count == 1:
+        # Solo tiene un préstamo
+        print(
+            f"✅ Usuario tiene solo un préstamo - marcado para actualización"
+        )
+        return True, "Usuario tiene solo un préstamo"
+
+    if arrear_loans_count == 0:
+        # No tiene préstamos en arrear
+        print(
+            f"✅ Usuario no tiene préstamos en arrear - marcado para actualización"
+        )
+        return True, "Usuario no tiene préstamos en arrear"
+
+    print(
+        f"⚠️  Usuario tiene {arrear_loans_count} préstamos en arrear - no se actualiza"
+    )
+    return False, "Usuario tiene múltiples préstamos y algunos están en arrear"
+
+
+def collect_user_ids(loan_documents):
+    """Retorna los user_id únicos de los préstamos"""
+    # Crear un set de user_ids únicos para evitar procesar el mismo usuario múltiples veces
+    unique_user_ids = set()
+    for loan_doc in loan_documents:
+        user_id = loan_doc.get("user_id")
+        if user_id:
+            unique_user_ids.add(user_id)
+    return unique_user_ids
+
+
+def arrear_user_ids_of(unique_user_ids, users_by_id):
+    """Retorna los usuarios con status arrear, cuyos préstamos hay que contar"""
+    return [
+        user_id
+        for user_id in unique_user_ids
+        if users_by_id.get(user_id, {}).get("status") == "arrear"
+    ]
+
+
+def evaluate_users(unique_user_ids, users_by_id, loan_counts):
+    """Decide qué usuarios se reactivan a partir de los datos ya consultados.
+
+    Retorna los resultados de validación y la lista (user_id, motivo) de los
+    usuarios que deben pasar a active.
+    """
+    validation_results = []
+    pending_updates = []
+
+    for user_id in unique_user_ids:
+        user_doc = users_by_id.get(user_id)
+
+        if not user_doc:
+            print(f"❌ Usuario ID={user_id} - No encontrado en la colección user")
+            validation_results.append(
+                {
+                    "user_id": str(user_id),
+                    "user_status": "No encontrado",
+                    "user_found": False,
+                    "loans_found": 0,
+                    "status_updated": False,
+                }
+            )
+            continue
+
+        user_status = user_doc.get("status", "No especificado")
+        print(f"\n👤 Procesando usuario: ID={user_id}, Status actual={user_status}")
+
+        # Si el usuario tiene status "arrear", revisar todos sus préstamos
+        if user_status == "arrear":
+            counts = loan_counts.get(user_id, {})
+            loans_count = counts.get("loans", 0)
+            arrear_loans_count = counts.get("arrear_loans", 0)
+            other_loans_count = loans_count - arrear_loans_count
+
+            print(f"📋 Encontrados {loans_count} préstamos para el usuario")
+            print(f"   • Préstamos en arrear: {arrear_loans_count}")
+            print(f"   • Otros préstamos: {other_loans_count}")
+
+            should_update, update_reason = decide_user_reactivation(
+                loans_count, arrear_loans_count
+            )
+
+            # Las actualizaciones se envían juntas al final en un solo bulk_write
+            if should_update:
+                pending_updates.append((user_id, update_reason))
+
+            validation_results.append(
+                {
+                    "user_id": str(user_id),
+                    "user_status": user_status,
+                    "user_found": True,
+                    "loans_found": loans_count,
+                    "arrear_loans": arrear_loans_count,
+                    "other_loans": other_loans_count,
+                    "status_updated": should_update,
+                    "update_reason": update_reason,
+                }
+            )
 
-        # Resumen de actualizaciones
-        if updated_loans:
-            print(f"\n📊 RESUMEN DE ACTUALIZACIONES DE AMORTIZATION:")
-            print(f"   • Préstamos actualizados: {len(updated_loans)}")
-            total_elements = sum(loan["elements_updated"] for loan in updated_loans)
-            print(f"   • Elementos de amortization actualizados: {total_elements}")
         else:
-            print(f"\n📊 No se realizaron actualizaciones de amortization")
+            # Usuario no está en arrear, solo registrar
+            print(f"ℹ️  Usuario no está en arrear (status: {user_status})")
+            validation_results.append(
+                {
+                    "user_id": str(user_id),
+                    "user_status": user_status,
+                    "user_found": True,
+                    "loans_found": 0,
+                    "status_updated": False,
+                }
+            )
 
-        return updated_loans
+    return validation_results, pending_updates
+
+
+def build_user_status_updates(pending_updates):
+    """Operaciones que pasan a active a los usuarios que siguen en arrear"""
+    return [
+        UpdateOne({"_id": user_id, "status": "arrear"}, {"$set": {"status": "active"}})
+        for user_id, _ in pending_updates
+    ]
+
+
+def confirmed_user_updates(pending_updates, indexes, current_users):
+    """Índices de `indexes` cuyo usuario, releído por _id en `current_users`, quedó en active"""
+    return {
+        index
+        for index in indexes
+        if current_users.get(pending_updates[index][0], {}).get("status") == "active"
+    }
+
+
+def verify_user_updates(user_collection, pending_updates, indexes):
+    """Relee por _id los usuarios de `indexes` y retorna los que quedaron en active"""
+    current_users = {}
+    for user_ids_chunk in chunked([pending_updates[index][0] for index in indexes], USER_LOOKUP_CHUNK_SIZE):
+        current_users.update(fetch_by_ids(user_collection, user_ids_chunk, USER_STATUS_PROJECTION))
+    return confirmed_user_updates(pending_updates, indexes, current_users)
+
+
+def report_user_updates(pending_updates, details, errors, confirmed):
+    """Reporta el bulk_write de usuarios y retorna los usuarios de `confirmed`.
+
+    Si el lote modificó menos usuarios que operaciones, `confirmed` sale de releer
+    el status de cada usuario por _id (ver mongo_utils.confirmed_operations).
+    """
+    print(
+        f"\n📦 Actualización de {len(pending_updates)} usuarios enviada "
+        f"(matched: {details['nMatched']}, modified: {details['nModified']}, errores: {len(errors)})"
+    )
+
+    updated_users = []
+    for index, (user_id, update_reason) in enumerate(pending_updates):
+        if index in errors:
+            print(f"❌ Error al actualizar status de {user_id}: {errors[index]}")
+            continue
+        if index not in confirmed:
+            print(f"⚠️  {user_id}: No se pudo actualizar el status (ya no está en arrear)")
+            continue
+
+        print(f"🔄 {user_id}: Status actualizado de 'arrear' a 'active'")
+        updated_users.append(
+            {
+                "user_id": str(user_id),
+                "old_status": "arrear",
+                "new_status": "active",
+                "reason": update_reason,
+            }
+        )
+    return updated_users
 
-    except Exception as e:
-        print(f"❌ Error al actualizar amortization: {e}")
-        return []
+
+def print_user_updates_summary(updated_users):
+    """Imprime el resumen de las actualizaciones de status de usuarios"""
+    if updated_users:
+        print(f"\n📊 RESUMEN DE ACTUALIZACIONES:")
+        print(f"   • Usuarios actualizados: {len(updated_users)}")
+        for user in updated_users:
+            print(
+                f"   • {user['user_id']}: {user['old_status']} → {user['new_status']} ({user['reason']})"
+            )
+    else:
+        print(f"\n📊 No se realizaron actualizaciones de status")
 
 
 def validate_user_status(db, loan_documents):
@@ -198,147 +492,41 @@ def validate_user_status(db, loan_documents):
     try:
         user_collection = db.user
         loan_collection = db.loan
-        validation_results = []
         updated_users = []
 
         print(f"\n🔍 Validando status de {len(loan_documents)} usuarios...")
 
-        # Crear un set de user_ids únicos para evitar procesar el mismo usuario múltiples veces
-        unique_user_ids = set()
-        for loan_doc in loan_documents:
-            user_id = loan_doc.get("user_id")
-            if user_id:
-                unique_user_ids.add(user_id)
+        unique_user_ids = collect_user_ids(loan_documents)
 
         print(f"📊 Procesando {len(unique_user_ids)} usuarios únicos...")
 
-        for user_id in unique_user_ids:
-            # Buscar el usuario por _id
-            user_query = {"_id": user_id}
-            user_doc = user_collection.find_one(user_query)
-
-            if not user_doc:
-                print(f"❌ Usuario ID={user_id} - No encontrado en la colección user")
-                validation_results.append(
-                    {
-                        "user_id": str(user_id),
-                        "user_status": "No encontrado",
-                        "user_found": False,
-                        "loans_found": 0,
-                        "status_updated": False,
-                    }
-                )
-                continue
-
-            user_status = user_doc.get("status", "No especificado")
-            print(f"\n👤 Procesando usuario: ID={user_id}, Status actual={user_status}")
-
-            # Si el usuario tiene status "arrear", buscar todos sus préstamos
-            if user_status == "arrear":
-                print(f"🔍 Usuario en arrear - buscando todos sus préstamos...")
-
-                # Buscar todos los préstamos del usuario
-                user_loans_query = {"user_id": user_id}
-                user_loans = list(loan_collection.find(user_loans_query))
-
-                print(f"📋 Encontrados {len(user_loans)} préstamos para el usuario")
+        # Todos los usuarios en una consulta $in y los conteos de préstamos de los
+        # usuarios en arrear en una sola agregación
+        users_by_id = {}
+        for user_ids_chunk in chunked(unique_user_ids, USER_LOOKUP_CHUNK_SIZE):
+            users_by_id.update(fetch_by_ids(user_collection, user_ids_chunk, USER_STATUS_PROJECTION))
 
-                # Contar préstamos con status "arrear"
-                arrear_loans = [
-                    loan for loan in user_loans if loan.get("status") == "arrear"
-                ]
-                other_loans = [
-                    loan for loan in user_loans if loan.get("status") != "arrear"
-                ]
+        loan_counts = count_user_loans(loan_collection, arrear_user_ids_of(unique_user_ids, users_by_id))
 
-                print(f"   • Préstamos en arrear: {len(arrear_loans)}")
-                print(f"   • Otros préstamos: {len(other_loans)}")
-
-                should_update = False
-                update_reason = ""
-
-                # Lógica de actualización
-                if len(user_loans) == 1:
-                    # Solo tiene un préstamo
-                    should_update = True
-                    update_reason = "Usuario tiene solo un préstamo"
-                    print(
-                        f"✅ Usuario tiene solo un préstamo - marcado para actualización"
-                    )
-                elif len(arrear_loans) == 0:
-                    # No tiene préstamos en arrear
-                    should_update = True
-                    update_reason = "Usuario no tiene préstamos en arrear"
-                    print(
-                        f"✅ Usuario no tiene préstamos en arrear - marcado para actualización"
-                    )
-                else:
-                    update_reason = (
-                        "Usuario tiene múltiples préstamos y algunos están en arrear"
-                    )
-                    print(
-                        f"⚠️  Usuario tiene {len(arrear_loans)} préstamos en arrear - no se actualiza"
-                    )
+        validation_results, pending_updates = evaluate_users(unique_user_ids, users_by_id, loan_counts)
 
-                # Actualizar status si corresponde
-                if should_update:
-                    try:
-                        update_result = user_collection.update_one(
-                            {"_id": user_id}, {"$set": {"status": "active"}}
-                        )
-
-                        if update_result.modified_count > 0:
-                            print(f"🔄 Status actualizado de 'arrear' a 'active'")
-                            updated_users.append(
-                                {
-                                    "user_id": str(user_id),
-                                    "old_status": "arrear",
-                                    "new_status": "active",
-                                    "reason": update_reason,
-                                }
-                            )
-                        else:
-                            print(f"⚠️  No se pudo actualizar el status")
-
-                    except Exception as update_error:
-                        print(f"❌ Error al actualizar status: {update_error}")
-
-                validation_results.append(
-                    {
-                        "user_id": str(user_id),
-                        "user_status": user_status,
-                        "user_found": True,
-                        "loans_found": len(user_loans),
-                        "arrear_loans": len(arrear_loans),
-                        "other_loans": len(other_loans),
-                        "status_updated": should_update,
-                        "update_reason": update_reason,
-                    }
+        # Actualizar status de los usuarios marcados
+        if pending_updates:
+            try:
+                details, errors = execute_bulk(user_collection, build_user_status_updates(pending_updates))
+                confirmed = confirmed_operations(
+                    details,
+                    errors,
+                    len(pending_updates),
+                    lambda indexes: verify_user_updates(user_collection, pending_updates, indexes),
                 )
+                updated_users = report_user_updates(pending_updates, details, errors, confirmed)
 
-            else:
-                # Usuario no está en arrear, solo registrar
-                print(f"ℹ️  Usuario no está en arrear (status: {user_status})")
-                validation_results.append(
-                    {
-                        "user_id": str(user_id),
-                        "user_status": user_status,
-                        "user_found": True,
-                        "loans_found": 0,
-                        "status_updated": False,
-                    }
-                )
+            except Exception as update_error:
+                print(f"❌ Error al actualizar status: {update_error}")
 
         # Resumen de actualizaciones
-        if updated_users:
-            print(f"\n📊 RESUMEN DE ACTUALIZACIONES:")
-            print(f"   • Usuarios actualizados: {len(updated_users)}")
-            for user in updated_users:
-                print(
-                    f"   • {user['user_id']}: {user['old_status']} → {user['new_status']} ({user['reason']})"
-                )
-        else:
-            print(f"\n📊 No se realizaron actualizaciones de status")
+        print_user_updates_summary(updated_users)
 
         return validation_results, updated_users
 
@@ -628,6 +816,10 @@ def send_email_notification(execution_summary):
                     <span class="metric-label">Usuarios actualizados:</span>
                     <span class="metric-value success">{execution_summary['users_updated_count']}</span>
                 </div>
+                <div class="metric">
+                    <span class="metric-label">Cuotas con campos no enteros (int_keys):</span>
+                    <span class="metric-value warning">{execution_summary.get('int_keys_invalid_installments', 0)}</span>
+                </div>
             </div>
 
             <div class="section">
@@ -643,6 +835,9 @@ def send_email_notification(execution_summary):
                     </ul>
                 </div>
             </div>
+        """
+        html_content += stages_html(execution_summary.get('stages'))
+        html_content += """
 
             <div class="section">
                 <h3>⏱️ Información de Ejecución</h3>
@@ -676,10 +871,12 @@ Fecha de ejecución: {execution_summary['execution_date']}
 • Préstamos con amortization actualizada: {execution_summary['amortization_updates_count']}
 • Usuarios validados: {execution_summary['users_validated_count']}
 • Usuarios actualizados: {execution_summary['users_updated_count']}
+• Cuotas con campos no enteros (int_keys): {execution_summary.get('int_keys_invalid_installments', 0)}
 
 📁 ARCHIVOS GENERADOS:
 {chr(10).join(f"• {file}" for file in execution_summary['files_generated'])}
 
+{stages_text(execution_summary.get('stages'))}
 Estado: ✅ Completado exitosamente
 
 ---
@@ -723,75 +920,342 @@ Para más información, revisa los archivos JSON generados en el directorio de b
         return False
 
 
-def get_todays_payments_regex_approach(db):
-    """Alternativa usando regex para fechas en formato string"""
+def build_todays_payments_query(today, mode="regex"):
+    """Consulta de préstamos con payment_date en UTC-5 para el día indicado
+
+    Args:
+        today: Fecha (date) en UTC-5
+        mode: "regex" compara el string de payment_date; "range" usa un rango
+              $gte/$lt sobre PAYMENT_DATE_NORMALIZED_FIELD, cubierto por índice,
+              y el regex para los préstamos que aún no tienen el campo (creados
+              después de backfill_payment_date.py)
+    """
+    today_str = today.strftime("%Y-%m-%d")
+
+    # Consulta usando regex para coincidir con la fecha
+    # Este regex coincide con fechas que empiecen con YYYY-MM-DD
+    regex_query = {"payment_date": {"$regex": f"^{today_str}T.*-05:00$"}}
+
+    if mode == "range":
+        utc_minus_5 = timezone(timedelta(hours=-5))
+        day_start = datetime(today.year, today.month, today.day, tzinfo=utc_minus_5)
+        return {
+            "$or": [
+                {
+                    PAYMENT_DATE_NORMALIZED_FIELD: {
+                        "$gte": day_start.astimezone(timezone.utc),
+                        "$lt": (day_start + timedelta(days=1)).astimezone(timezone.utc),
+                    }
+                },
+                {PAYMENT_DATE_NORMALIZED_FIELD: {"$exists": False}, **regex_query},
+            ]
+        }
+
+    return regex_query
+
+
+def get_todays_payments_regex_approach(db, mode="regex"):
+    """Alternativa usando regex para fechas en formato string
+
+    Con mode="range" la búsqueda usa el campo normalizado PAYMENT_DATE_NORMALIZED_FIELD
+    (ver backfill_payment_date.py) en lugar del regex.
+    """
     try:
         # Obtener la fecha de hoy en UTC-5
         utc_minus_5 = timezone(timedelta(hours=-5))
         today_utc_minus_5 = datetime.now(utc_minus_5).date()
-        today_str = today_utc_minus_5.strftime("%Y-%m-%d")
 
-        print(f"📅 Buscando pagos para: {today_str}")
+        print(f"📅 Buscando pagos para: {today_utc_minus_5.strftime('%Y-%m-%d')} (modo: {mode})")
 
-        # Consulta usando regex para coincidir con la fecha
-        # Este regex coincide con fechas que empiecen con YYYY-MM-DD
-        query = {"payment_date": {"$regex": f"^{today_str}T.*-05:00$"}}
+        query = build_todays_payments_query(today_utc_minus_5, mode)
 
         loan_collection = db.loan
-        results = list(loan_collection.find(query))
-
-        print(
-            f"✅ Encontrados {len(results)} créditos con pago programado para hoy (UTC-5)"
-        )
 
-        # Guardar resultados en archivo JSON
-        print("\n📋 Guardando resultados en archivo JSON...")
+        # Guardar los documentos completos en el backup
+        print("\n📋 Guardando resultados en backup...")
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{output_dir}/payment_loan_documents_{timestamp}.json"
+        filename = backup_filename(f"{output_dir}/payment_loan_documents_{timestamp}")
+
+        backup_query(loan_collection, query, filename)
+        print(f"📄 Archivo creado: {filename}")
+
+        # La conversión solo necesita las dos fechas
+        results = stream_find(loan_collection, query, TODAYS_PAYMENTS_PROJECTION)
 
-        if save_to_json(results, filename):
-            print(f"📄 Archivo creado: {filename}")
+        loans_found = 0
+        loans_updated = 0
+        conversion_errors = []
+        pending_updates = []
 
-        # Convertir fechas de UTC-5 a UTC
+        # Convertir fechas de UTC-5 a UTC: un solo $set por préstamo con ambas fechas
         for result in results:
+            loans_found += 1
+            loan_id = result.get("_id")
             original_date = result.get("payment_date")
             original_limit_date = result.get("limit_payment_date")
             print(
-                f"   • Crédito ID: {result.get('_id')}, Payment Date Original: {original_date}, Limit Payment Date Original: {original_limit_date}"
+                f"   • Crédito ID: {loan_id}, Payment Date Original: {original_date}, Limit Payment Date Original: {original_limit_date}"
             )
 
-            if original_date:
-                try:
-                    # Convertir la fecha de UTC-5 a UTC
-                    utc_payment_date = convert_utc_minus_5_to_utc(original_date)
-                    # Actualizar payment_date en la base de datos
-                    loan_collection.update_one(
-                        {"_id": result.get("_id")},
-                        {"$set": {"payment_date": utc_payment_date}},
-                    )
-                except Exception as e:
-                    print(f"     ❌ Error convirtiendo fecha: {e}")
-
-            if original_limit_date:
-                try:
-                    # Convertir la fecha de límite de pago de UTC-5 a UTC
-                    utc_limit_date = convert_utc_minus_5_to_utc(original_limit_date)
-                    # Actualizar limit_payment_date en la base de datos
-                    loan_collection.update_one(
-                        {"_id": result.get("_id")},
-                        {"$set": {"limit_payment_date": utc_limit_date}},
+            converted_fields = {}
+            for field, original_value in (
+                ("payment_date", original_date),
+                ("limit_payment_date", original_limit_date),
+            ):
+                if not original_value:
+                    continue
+
+                converted_value = convert_utc_minus_5_to_utc(original_value)
+                if converted_value != original_value:
+                    converted_fields[field] = converted_value
+                elif not original_value.endswith("Z"):
+                    # convert_utc_minus_5_to_utc retorna la fecha original cuando no puede convertirla
+                    conversion_errors.append(
+                        {
+                            "loan_id": str(loan_id),
+                            "field": field,
+                            "value": original_value,
+                            "error": "No se pudo convertir la fecha",
+                        }
                     )
-                except Exception as e:
-                    print(f"     ❌ Error convirtiendo fecha: {e}")
 
-        return results
+            if not converted_fields:
+                continue
+
+            update = {"$set": converted_fields}
+            if "payment_date" in converted_fields:
+                # El campo normalizado solo existe mientras payment_date está en UTC-5
+                update["$unset"] = {PAYMENT_DATE_NORMALIZED_FIELD: ""}
+            pending_updates.append((loan_id, converted_fields, UpdateOne({"_id": loan_id}, update)))
+
+            if len(pending_updates) >= PAYMENT_DATE_BULK_BATCH_SIZE:
+                loans_updated += flush_payment_date_updates(loan_collection, pending_updates, conversion_errors)
+                pending_updates = []
+
+        if pending_updates:
+            loans_updated += flush_payment_date_updates(loan_collection, pending_updates, conversion_errors)
+
+        print(
+            f"✅ Encontrados {loans_found} créditos con pago programado para hoy (UTC-5), {loans_updated} actualizados"
+        )
+
+        errors_filename = None
+        if conversion_errors:
+            print(f"⚠️  {len(conversion_errors)} errores al convertir o actualizar fechas:")
+            for error in conversion_errors:
+                print(f"     ❌ Crédito {error['loan_id']} ({error['field']}): {error['error']}")
+
+            errors_filename = f"{output_dir}/payment_date_errors_{timestamp}.json"
+            if save_to_json(conversion_errors, errors_filename):
+                print(f"📄 Errores guardados en: {errors_filename}")
+
+        return {
+            "loans_found": loans_found,
+            "loans_updated": loans_updated,
+            "errors": conversion_errors,
+            "errors_file": errors_filename,
+        }
 
     except Exception as e:
         print(f"❌ Error al consultar pagos de hoy: {e}")
-        return []
+        return {"loans_found": 0, "loans_updated": 0, "errors": [], "errors_file": None}
+
+
+def flush_payment_date_updates(loan_collection, pending_updates, conversion_errors):
+    """Envía un lote de conversiones de fecha con bulk_write no ordenado.
+
+    Los errores de escritura se agregan a `conversion_errors` por préstamo.
+    Retorna la cantidad de préstamos actualizados sin error.
+    """
+    operations = [operation for _, _, operation in pending_updates]
+
+    try:
+        details, errors = execute_bulk(loan_collection, operations)
+    except Exception as update_error:
+        print(f"❌ Error al actualizar lote de {len(operations)} fechas: {update_error}")
+        errors = {index: str(update_error) for index in range(len(operations))}
+        details = {"nModified": 0}
+
+    for index, message in errors.items():
+        loan_id, converted_fields, _ = pending_updates[index]
+        conversion_errors.append(
+            {
+                "loan_id": str(loan_id),
+                "field": ",".join(converted_fields),
+                "value": None,
+                "error": message,
+            }
+        )
 
+    print(f"📦 Lote de {len(operations)} conversiones enviado (modified: {details['nModified']}, errores: {len(errors)})")
+    return len(operations) - len(errors)
+
+
+def run(db, payment_date_mode="regex", engine="sync", loan_filter=None):
+    """Ejecuta las verificaciones sobre `db` y retorna el resumen de la ejecución.
+
+    No abre ni cierra la conexión ni envía el correo, para que el runner pueda
+    ejecutarla junto a los demás scripts con un solo cliente. Con engine="async"
+    los pasos 3 y 4 se ejecutan con async_engine, sobre un cliente asíncrono propio
+    conectado a la misma base de datos que `db`.
+    `loan_filter` restringe los pasos 1 a 4 a los préstamos modificados; la
+    conversión de payment_date depende de la fecha del día y siempre es completa.
+    El resumen incluye en "stages" el tiempo y los comandos de cada etapa.
+    """
+    stages = Instrumentation()
+    with stages.stage("date_conversion"):
+        payment_date_report = get_todays_payments_regex_approach(db, payment_date_mode)
+
+    # Pasos 1 y 2: los documentos completos de la colección loan van directo
+    # del cursor al backup, sin materializarse en memoria
+    print("\n📋 Paso 1: Consultando colección loan...")
+    print("\n📋 Paso 2: Guardando resultados en backup...")
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = backup_filename(f"{output_dir}/loan_documents_{timestamp}")
+
+    payment_date_files = [payment_date_report["errors_file"]] if payment_date_report["errors_file"] else []
+
+    execution_summary = {
+        'timestamp': timestamp,
+        'execution_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'loan_documents_count': 0,
+        'amortization_updates_count': 0,
+        'users_validated_count': 0,
+        'users_updated_count': 0,
+        'int_keys_invalid_installments': 0,
+        'files_generated': payment_date_files
+    }
+
+    with stages.stage("backup"):
+        backed_up_count = backup_query(db.loan, build_loan_documents_query(loan_filter), filename)
+    if not backed_up_count:
+        os.remove(filename)
+        print("⚠️  No se encontraron documentos que cumplan los criterios")
+        execution_summary['stages'] = stages.breakdown()
+        return execution_summary
+    print(f"📄 Archivo creado: {filename}")
+
+    # Los tipos de int_keys se validan por lotes mientras los préstamos pasan hacia la actualización
+    int_keys_report = IntKeysReport()
+
+    if engine == "async":
+        # Importación diferida: async_engine reutiliza las funciones de este módulo
+        import async_engine
+
+        print("\n📋 Pasos 3 y 4: Actualizando amortization y validando usuarios (motor asíncrono)...")
+        with stages.stage("amortization_update_user_validation"):
+            amortization_updates, loan_refs, validation_results, updated_users = async_engine.run_with_client(
+                db, async_engine.fix_arrears_and_users, loan_filter, int_keys_report
+            )
+    else:
+        # Paso 3: la actualización solo lee los campos proyectados de amortization
+        print("\n📋 Paso 3: Actualizando amortization...")
+        loan_refs = []
+        loan_documents = stages.iterate(get_loan_documents(db, loan_filter=loan_filter), "fetch")
+        loan_documents = stages.iterate(validate_int_keys(loan_documents, int_keys_report), "int_keys_validation")
+        loan_documents = collect_loan_refs(loan_documents, loan_refs)
+        with stages.stage("amortization_update"):
+            amortization_updates = update_amortization_arrears(db, loan_documents)
+
+        # Paso 4: Validar status de usuarios
+        print("\n📋 Paso 4: Validando status de usuarios...")
+        with stages.stage("user_validation"):
+            validation_results, updated_users = validate_user_status(db, loan_refs)
+
+    # Guardar resultados de validación
+    validation_filename = f"{output_dir}/user_validation_{timestamp}.json"
+    if save_to_json(validation_results, validation_filename):
+        print(f"📄 Resultados de validación guardados en: {validation_filename}")
+
+    # Guardar resultados de actualizaciones de usuarios
+    if updated_users:
+        user_updates_filename = f"{output_dir}/user_updates_{timestamp}.json"
+        if save_to_json(updated_users, user_updates_filename):
+            print(
+                f"📄 Resultados de actualizaciones de usuarios guardados en: {user_updates_filename}"
+            )
+
+    # Paso 5: Validar consistencia de payment_info (TEMPORALMENTE DESACTIVADO)
+    # print("\n📋 Paso 5: Validando consistencia de payment_info...")
+    # payment_info_validation_results, payment_info_updates = validate_payment_info_consistency(db, loan_documents)
+
+    # Guardar resultados de validación de payment_info
+    # payment_info_validation_filename = f"{output_dir}/payment_info_validation_{timestamp}.json"
+    # if save_to_json(payment_info_validation_results, payment_info_validation_filename):
+    #     print(f"📄 Resultados de validación de payment_info guardados en: {payment_info_validation_filename}")
+
+    # Guardar resultados de actualizaciones de payment_info
+    # if payment_info_updates:
+    #     payment_info_updates_filename = f"{output_dir}/payment_info_updates_{timestamp}.json"
+    #     if save_to_json(payment_info_updates, payment_info_updates_filename):
+    #         print(
+    #             f"📄 Resultados de actualizaciones de payment_info guardados en: {payment_info_updates_filename}"
+    #         )
+
+    # Resumen de los tipos de int_keys; el detalle por columna solo si hay valores no enteros
+    int_keys_report.print_summary()
+    int_keys_summary = int_keys_report.summary()
+    int_keys_filename = f"{output_dir}/int_keys_validation_{timestamp}.json"
+    int_keys_saved = bool(int_keys_summary["columns"]) and save_to_json(int_keys_summary, int_keys_filename)
+    if int_keys_saved:
+        print(f"📄 Validación de int_keys guardada en: {int_keys_filename}")
+
+    # Guardar resultados de actualizaciones de amortization
+    if amortization_updates:
+        amortization_updates_filename = f"amortization_updates_{timestamp}.json"
+        if save_to_json(amortization_updates, amortization_updates_filename):
+            print(
+                f"📄 Resultados de actualizaciones de amortization guardados en: {amortization_updates_filename}"
+            )
+
+    # Resumen final
+    print("\n" + "=" * 50)
+    print("📊 RESUMEN FINAL:")
+    print(f"   • Documentos de loan encontrados: {len(loan_refs)}")
+    print(
+        f"   • Préstamos con amortization actualizada: {len(amortization_updates)}"
+    )
+    print(f"   • Usuarios validados: {len(validation_results)}")
+    print(f"   • Usuarios actualizados: {len(updated_users)}")
+    # print(f"   • Préstamos con payment_info validados: {len(payment_info_validation_results)}")
+    # print(f"   • Préstamos con payment_info actualizado: {len(payment_info_updates)}")
+
+    files_generated = [filename, validation_filename]  # , payment_info_validation_filename]
+    if updated_users:
+        files_generated.append(user_updates_filename)
+    if amortization_updates:
+        files_generated.append(amortization_updates_filename)
+    if int_keys_saved:
+        files_generated.append(int_keys_filename)
+    files_generated.extend(payment_date_files)
+    # if payment_info_updates:
+    #     files_generated.append(payment_info_updates_filename)
+
+    # Tiempo y comandos de cada etapa, para ver cuál domina una ejecución lenta
+    stage_breakdown = stages.breakdown()
+    stages_filename = f"{output_dir}/stages_{timestamp}.json"
+    if save_to_json(stage_breakdown, stages_filename):
+        files_generated.append(stages_filename)
+
+    print(f"   • Archivos generados: {', '.join(files_generated)}")
+    print_breakdown(stage_breakdown)
+    print("=" * 50)
 
-def main():
+    execution_summary.update(
+        {
+            'loan_documents_count': len(loan_refs),
+            'amortization_updates_count': len(amortization_updates),
+            'users_validated_count': len(validation_results),
+            'users_updated_count': len(updated_users),
+            'int_keys_invalid_installments': int_keys_summary['invalid_installments'],
+            'files_generated': files_generated,
+            'stages': stage_breakdown,
+        }
+    )
+    return execution_summary
+
+
+def main(payment_date_mode="regex", engine="sync", incremental=False, full_rescan=False):
     """Función principal del script"""
     print("🚀 Iniciando script de consulta MongoDB Atlas")
     print("=" * 50)
@@ -809,106 +1273,24 @@ def main():
         db = client[DATABASE_NAME]
         print(f"📂 Conectado a la base de datos: middleware")
 
-        get_todays_payments_regex_approach(db)
-
-        # Paso 1: Obtener documentos de la colección loan
-        print("\n📋 Paso 1: Consultando colección loan...")
-        loan_documents = get_loan_documents(db)
-
-        if not loan_documents:
-            print("⚠️  No se encontraron documentos que cumplan los criterios")
+        if incremental:
+            execution_summary = run_incremental(
+                db,
+                "main",
+                lambda loan_filter: run(db, payment_date_mode, engine, loan_filter),
+                full_rescan=full_rescan,
+            )
+        else:
+            execution_summary = run(db, payment_date_mode, engine)
+        if not execution_summary['loan_documents_count']:
             return
 
-        # Paso 2: Guardar resultados en archivo JSON
-        print("\n📋 Paso 2: Guardando resultados en archivo JSON...")
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{output_dir}/loan_documents_{timestamp}.json"
-
-        if save_to_json(loan_documents, filename):
-            print(f"📄 Archivo creado: {filename}")
-
-        # Paso 3: Actualizar amortization
-        print("\n📋 Paso 3: Actualizando amortization...")
-        amortization_updates = update_amortization_arrears(db, loan_documents)
-
-        # Paso 4: Validar status de usuarios
-        print("\n📋 Paso 4: Validando status de usuarios...")
-        validation_results, updated_users = validate_user_status(db, loan_documents)
-
-        # Guardar resultados de validación
-        validation_filename = f"{output_dir}/user_validation_{timestamp}.json"
-        if save_to_json(validation_results, validation_filename):
-            print(f"📄 Resultados de validación guardados en: {validation_filename}")
-
-        # Guardar resultados de actualizaciones de usuarios
-        if updated_users:
-            user_updates_filename = f"{output_dir}/user_updates_{timestamp}.json"
-            if save_to_json(updated_users, user_updates_filename):
-                print(
-                    f"📄 Resultados de actualizaciones de usuarios guardados en: {user_updates_filename}"
-                )
-
-        # Paso 5: Validar consistencia de payment_info (TEMPORALMENTE DESACTIVADO)
-        # print("\n📋 Paso 5: Validando consistencia de payment_info...")
-        # payment_info_validation_results, payment_info_updates = validate_payment_info_consistency(db, loan_documents)
-
-        # Guardar resultados de validación de payment_info
-        # payment_info_validation_filename = f"{output_dir}/payment_info_validation_{timestamp}.json"
-        # if save_to_json(payment_info_validation_results, payment_info_validation_filename):
-        #     print(f"📄 Resultados de validación de payment_info guardados en: {payment_info_validation_filename}")
-
-        # Guardar resultados de actualizaciones de payment_info
-        # if payment_info_updates:
-        #     payment_info_updates_filename = f"{output_dir}/payment_info_updates_{timestamp}.json"
-        #     if save_to_json(payment_info_updates, payment_info_updates_filename):
-        #         print(
-        #             f"📄 Resultados de actualizaciones de payment_info guardados en: {payment_info_updates_filename}"
-        #         )
-
-        # Guardar resultados de actualizaciones de amortization
-        if amortization_updates:
-            amortization_updates_filename = f"amortization_updates_{timestamp}.json"
-            if save_to_json(amortization_updates, amortization_updates_filename):
-                print(
-                    f"📄 Resultados de actualizaciones de amortization guardados en: {amortization_updates_filename}"
-                )
-
-        # Resumen final
-        print("\n" + "=" * 50)
-        print("📊 RESUMEN FINAL:")
-        print(f"   • Documentos de loan encontrados: {len(loan_documents)}")
-        print(
-            f"   • Préstamos con amortization actualizada: {len(amortization_updates)}"
-        )
-        print(f"   • Usuarios validados: {len(validation_results)}")
-        print(f"   • Usuarios actualizados: {len(updated_users)}")
-        # print(f"   • Préstamos con payment_info validados: {len(payment_info_validation_results)}")
-        # print(f"   • Préstamos con payment_info actualizado: {len(payment_info_updates)}")
-
-        files_generated = [filename, validation_filename]  # , payment_info_validation_filename]
-        if updated_users:
-            files_generated.append(user_updates_filename)
-        if amortization_updates:
-            files_generated.append(amortization_updates_filename)
-        # if payment_info_updates:
-        #     files_generated.append(payment_info_updates_filename)
-
-        print(f"   • Archivos generados: {', '.join(files_generated)}")
-        print("=" * 50)
-
         # Enviar notificación por correo
         print("\n📧 Enviando notificación por correo...")
-        execution_summary = {
-            'timestamp': timestamp,
-            'execution_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'loan_documents_count': len(loan_documents),
-            'amortization_updates_count': len(amortization_updates),
-            'users_validated_count': len(validation_results),
-            'users_updated_count': len(updated_users),
-            'files_generated': files_generated
-        }
-        
-        email_sent = send_email_notification(execution_summary)
+        email_stages = Instrumentation()
+        with email_stages.stage("email"):
+            email_sent = send_email_notification(execution_summary)
+        print_breakdown(email_stages.breakdown())
         if email_sent:
             print("✅ Notificación por correo enviada exitosamente")
         else:
@@ -924,4 +1306,31 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LeanCore Consistency Checker")
+    parser.add_argument(
+        "--payment-date-mode",
+        choices=["regex", "range"],
+        default="regex",
+        help=f"regex: busca payment_date por regex; range: rango sobre {PAYMENT_DATE_NORMALIZED_FIELD}",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["sync", "async"],
+        default="sync",
+        help="sync: PyMongo síncrono; async: actualización y validación con concurrencia acotada (async_engine)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Solo reevalúa los préstamos modificados desde la última ejecución (ver incremental.py)",
+    )
+    parser.add_argument(
+        "--full-rescan",
+        action="store_true",
+        help="Con --incremental, recorre todos los préstamos y guarda el punto de control",
+    )
+    args = parser.parse_args()
+
+    main(args.payment_date_mode, args.engine, args.incremental, args.full_rescan)
@@ -0,0 +1,183 @@
+"""
+Exporta las métricas de una ejecución del runner en formato OpenMetrics.
+
+Por job se exportan los contadores del resumen (documentos encontrados, cuotas
+corregidas, usuarios reactivados, transacciones no aplicadas, ...), la duración,
+si terminó bien y el tiempo y los comandos de cada etapa (instrumentation.py);
+para toda la ejecución, la duración total y un histograma de latencia por tipo
+de comando de MongoDB.
+
+Los valores de un job son los de su última ejecución (gauges), así una alerta
+puede comparar la serie entre ejecuciones. El texto se escribe en un archivo
+para el textfile collector de node_exporter (METRICS_TEXTFILE) y/o se envía a
+un Pushgateway (METRICS_PUSHGATEWAY_URL). Solo usa gauges e histogramas, que se
+escriben igual en OpenMetrics y en el formato de texto de Prometheus.
+
+Uso:
+    python run_checks.py --metrics-textfile /var/lib/node_exporter/textfile/checker.prom
+    python run_checks.py --metrics-pushgateway http://pushgateway:9091
+"""
+import os
+import time
+
+import requests
+
+from instrumentation import COMMAND_LISTENER, LATENCY_BUCKETS
+
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE")
+METRICS_PUSHGATEWAY_URL = os.getenv("METRICS_PUSHGATEWAY_URL")
+METRICS_JOB_NAME = os.getenv("METRICS_JOB_NAME", "leancore_consistency_checker")
+METRICS_PUSH_TIMEOUT_SECONDS = int(os.getenv("METRICS_PUSH_TIMEOUT_SECONDS", "10"))
+
+PREFIX = "checker"
+
+# Campos numéricos de los resúmenes de los jobs que se exportan: (nombre de la métrica, descripción).
+# Los nombres evitan los sufijos que OpenMetrics reserva (_count, _total, ...)
+SUMMARY_METRICS = {
+    "loan_documents_count": ("loan_documents_found", "Documentos de loan encontrados"),
+    "amortization_updates_count": ("loans_amortization_updated", "Préstamos con amortization actualizada"),
+    "users_validated_count": ("users_validated", "Usuarios validados"),
+    "users_updated_count": ("users_reactivated", "Usuarios reactivados"),
+    "int_keys_invalid_installments": ("int_keys_invalid_installments", "Cuotas con campos de int_keys no enteros"),
+    "payments_processed": ("payments_processed", "Pagos procesados"),
+    "unapplied_transactions": ("unapplied_transactions", "Transacciones no aplicadas"),
+    "inconsistent_loans": ("inconsistent_loans", "Préstamos con inconsistencias en payment_info"),
+    "documents_found": ("zero_balance_loans_found", "Préstamos con mora y saldo cero encontrados"),
+    "installments_found": ("zero_balance_installments_found", "Cuotas con mora y saldo cero encontradas"),
+    "loans_modified": ("zero_balance_loans_fixed", "Préstamos con cuotas en mora y saldo cero corregidos"),
+    "amortizations_updated": ("zero_balance_installments_fixed", "Cuotas con mora y saldo cero corregidas"),
+    "loans_scanned": ("loan_rules_loans_scanned", "Préstamos recorridos por loan_rules"),
+    "loans_updated": ("loan_rules_loans_updated", "Préstamos corregidos por loan_rules"),
+    "loans_malformed": ("loan_rules_loans_malformed", "Préstamos que alguna regla de loan_rules no pudo evaluar"),
+    "loans_conflicted": ("loan_rules_loans_conflicted", "Préstamos que cambiaron durante el recorrido de loan_rules"),
+    "loans_with_doubles": ("int_keys_audit_loans", "Préstamos con campos de int_keys guardados como double"),
+    "installments_with_doubles": ("int_keys_audit_installments", "Cuotas con campos de int_keys guardados como double"),
+}
+
+# Métricas por etapa: (campo de instrumentation, nombre, descripción)
+STAGE_METRICS = [
+    ("seconds", "stage_duration_seconds", "Tiempo real de la etapa"),
+    ("commands", "stage_commands", "Comandos enviados a MongoDB en la etapa"),
+    ("mongo_seconds", "stage_mongo_seconds", "Duración de los comandos de la etapa medida por el driver"),
+    ("bytes_sent", "stage_sent_bytes", "Tamaño BSON de los comandos de la etapa"),
+    ("bytes_received", "stage_received_bytes", "Tamaño BSON de las respuestas de la etapa"),
+]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricFamily:
+    """Una métrica con sus muestras, en el orden en que se agregan"""
+
+    def __init__(self, name, metric_type, description):
+        self.name = f"{PREFIX}_{name}"
+        self.metric_type = metric_type
+        self.description = description
+        self.samples = []
+
+    def add(self, value, suffix="", **labels):
+        self.samples.append((f"{self.name}{suffix}", labels, value))
+
+    def render(self):
+        lines = [f"# TYPE {self.name} {self.metric_type}", f"# HELP {self.name} {_escape(self.description)}"]
+        lines += [f"{name}{_labels(labels)} {_number(value)}" for name, labels, value in self.samples]
+        return "\n".join(lines)
+
+
+def build_families(results, wall_seconds, latencies=None):
+    """Construye las métricas de una ejecución del runner a partir de los resultados de run_jobs"""
+    latencies = COMMAND_LISTENER.latency_snapshot() if latencies is None else latencies
+    families = {}
+
+    def family(name, description, metric_type="gauge"):
+        return families.setdefault(name, MetricFamily(name, metric_type, description))
+
+    family("run_duration_seconds", "Duración total de la ejecución del runner").add(round(wall_seconds, 3))
+    family("run_timestamp_seconds", "Momento en que terminó la ejecución del runner").add(round(time.time(), 3))
+
+    # La etiqueta es "check" y no "job", que el Pushgateway usa para agrupar
+    for result in results:
+        check = result["job"]
+        family("job_success", "1 si el job terminó bien, 0 si falló").add(int(result["status"] == "ok"), check=check)
+        family("job_duration_seconds", "Duración del job").add(round(result["seconds"], 3), check=check)
+        summary = result["summary"] or {}
+
+        for key, (name, description) in SUMMARY_METRICS.items():
+            value = summary.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                family(name, description).add(value, check=check)
+
+        for stage, stage_values in summary.get("stages", {}).items():
+            for field, name, description in STAGE_METRICS:
+                family(name, description).add(stage_values[field], check=check, stage=stage)
+
+    histogram = family("mongo_command_duration_seconds", "Latencia de los comandos de MongoDB", "histogram")
+    for command, values in sorted(latencies.items()):
+        for bound, count in zip(LATENCY_BUCKETS, values["buckets"]):
+            histogram.add(count, "_bucket", command=command, le=_number(float(bound)))
+        histogram.add(values["count"], "_bucket", command=command, le="+Inf")
+        histogram.add(round(values["sum"], 6), "_sum", command=command)
+        histogram.add(values["count"], "_count", command=command)
+
+    return list(families.values())
+
+
+def render(families):
+    """Texto OpenMetrics de las métricas"""
+    return "\n".join(family.render() for family in families) + "\n# EOF\n"
+
+
+def write_textfile(text, path):
+    """Escribe el archivo para el textfile collector; se reemplaza completo para no exponerlo a medio escribir"""
+    temporary_file = f"{path}.tmp"
+    with open(temporary_file, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temporary_file, path)
+
+
+def push(text, url, job=METRICS_JOB_NAME):
+    """Reemplaza en el Pushgateway las métricas del grupo `job`"""
+    response = requests.put(
+        f"{url.rstrip('/')}/metrics/job/{job}",
+        data=text.encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        timeout=METRICS_PUSH_TIMEOUT_SECONDS,
+    )
+    response.raise_for_status()
+
+
+def export(results, wall_seconds, textfile=METRICS_TEXTFILE, pushgateway_url=METRICS_PUSHGATEWAY_URL):
+    """Exporta las métricas de la ejecución a los destinos configurados.
+
+    Un error al exportar se informa y no hace fallar la ejecución.
+    """
+    if not textfile and not pushgateway_url:
+        return
+
+    text = render(build_families(results, wall_seconds))
+    if textfile:
+        try:
+            write_textfile(text, textfile)
+            print(f"📈 Métricas escritas en {textfile}")
+        except OSError as e:
+            print(f"❌ Error al escribir las métricas en {textfile}: {e}")
+    if pushgateway_url:
+        try:
+            push(text, pushgateway_url)
+            print(f"📈 Métricas enviadas a {pushgateway_url}")
+        except requests.RequestException as e:
+            print(f"❌ Error al enviar las métricas al Pushgateway: {e}")
@@ -0,0 +1,192 @@
+"""
+Utilidades compartidas para el acceso a MongoDB desde los scripts del checker.
+"""
+import os
+import threading
+import time
+from itertools import islice
+
+from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
+
+from instrumentation import COMMAND_LISTENER
+
+# Configuración del cliente compartido por los scripts y el runner
+MONGO_APP_NAME = "leancore-consistency-checker"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+# 0 = sin límite; los recorridos largos usan cursores sin timeout
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+
+# Documentos por lote que el servidor devuelve en cada getMore
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "1000"))
+
+# Las sesiones del servidor expiran tras 30 minutos sin uso; se refrescan antes
+SESSION_REFRESH_SECONDS = 5 * 60
+
+
+def client_options():
+    """Opciones de pool, compresión y timeouts comunes a los clientes síncrono y asíncrono.
+
+    La compresión solo se usa si el servidor la soporta; zlib no requiere
+    dependencias adicionales (zstd y snappy necesitan sus paquetes). Los comandos
+    se atribuyen a la etapa activa de instrumentation.
+    """
+    return {
+        "appname": MONGO_APP_NAME,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "compressors": MONGO_COMPRESSORS or None,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+        "retryWrites": True,
+        "event_listeners": [COMMAND_LISTENER],
+    }
+
+
+def create_client(uri):
+    """Crea un MongoClient con el pool, la compresión y los timeouts configurados"""
+    return MongoClient(uri, **client_options())
+
+
+def chunked(iterable, size):
+    """Agrupa un iterable en listas de como máximo `size` elementos"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch_by_ids(collection, ids, projection=None):
+    """Obtiene en una sola consulta $in los documentos cuyos _id están en `ids`.
+
+    Retorna un diccionario {_id: documento}. Los ids que no existen en la
+    colección simplemente no aparecen en el diccionario.
+    """
+    unique_ids = list({_id for _id in ids if _id is not None})
+    if not unique_ids:
+        return {}
+
+    cursor = collection.find({"_id": {"$in": unique_ids}}, projection)
+    return {doc["_id"]: doc for doc in cursor}
+
+
+class LookupCache:
+    """Caché de documentos por _id para consultas $in repetidas dentro de una ejecución.
+
+    Es seguro entre hilos. Las entradas se separan por colección y proyección, y
+    también recuerda los ids que no existen. El runner invalida una colección
+    cuando termina un job que escribe en ella.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, collection, ids, projection=None):
+        """Retorna ({_id: documento} de los ids en caché, ids que hay que consultar)"""
+        key = (collection.full_name, repr(projection))
+        wanted = {_id for _id in ids if _id is not None}
+
+        with self._lock:
+            entries = self._entries.setdefault(key, {})
+            missing = [_id for _id in wanted if _id not in entries]
+            self.hits += len(wanted) - len(missing)
+            self.misses += len(missing)
+            found = {_id: entries[_id] for _id in wanted if entries.get(_id) is not None}
+        return found, missing
+
+    def store(self, collection, projection, ids, found):
+        """Guarda el resultado de consultar `ids`; los que no están en `found` se recuerdan como inexistentes"""
+        key = (collection.full_name, repr(projection))
+        with self._lock:
+            entries = self._entries.setdefault(key, {})
+            for _id in ids:
+                entries[_id] = found.get(_id)
+
+    def fetch_by_ids(self, collection, ids, projection=None):
+        """Igual que fetch_by_ids, consultando solo los ids que no están en caché"""
+        found, missing = self.cached(collection, ids, projection)
+        if missing:
+            fetched = fetch_by_ids(collection, missing, projection)
+            self.store(collection, projection, missing, fetched)
+            found.update(fetched)
+        return found
+
+    def invalidate(self, collection_name):
+        """Descarta las entradas de la colección indicada"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0].split(".", 1)[1] == collection_name]:
+                del self._entries[key]
+
+
+def stream_find(collection, query, projection=None, limit=None, batch_size=CURSOR_BATCH_SIZE, sort=None):
+    """Itera los documentos de una consulta sin materializarlos en memoria.
+
+    El cursor se abre con no_cursor_timeout dentro de una sesión explícita, que se
+    refresca periódicamente para que recorridos largos no pierdan el cursor. El
+    cursor se cierra siempre, incluso si el consumidor abandona la iteración.
+    Con `sort` el servidor puede usar disco si el orden no sale de un índice.
+    """
+    client = collection.database.client
+    with client.start_session() as session:
+        cursor = collection.find(
+            query,
+            projection,
+            batch_size=batch_size,
+            no_cursor_timeout=True,
+            session=session,
+        )
+        if sort:
+            cursor = cursor.sort(sort).allow_disk_use(True)
+        if limit:
+            cursor = cursor.limit(limit)
+
+        last_refresh = time.monotonic()
+        try:
+            for document in cursor:
+                yield document
+
+                if time.monotonic() - last_refresh > SESSION_REFRESH_SECONDS:
+                    client.admin.command("refreshSessions", [session.session_id], session=session)
+                    last_refresh = time.monotonic()
+        finally:
+            cursor.close()
+
+
+def execute_bulk(collection, operations, ordered=False):
+    """Ejecuta un bulk_write y retorna el resumen del servidor y los errores por operación.
+
+    Los errores de escritura individuales no interrumpen el lote: se retornan en un
+    diccionario {índice de la operación: mensaje} para reportarlos por documento.
+    """
+    try:
+        result = collection.bulk_write(operations, ordered=ordered)
+        details = result.bulk_api_result
+    except BulkWriteError as bulk_error:
+        details = bulk_error.details
+
+    errors = {error["index"]: error.get("errmsg", "") for error in details.get("writeErrors", [])}
+    return details, errors
+
+
+def confirmed_operations(details, errors, operations_count, verify=None):
+    """Índices de las operaciones de un bulk_write cuyo cambio está aplicado.
+
+    El servidor solo informa el total de documentos modificados del lote. Si
+    alcanza para todas las operaciones sin error, todas modificaron su documento.
+    Si no, `verify(índices)` relee esos documentos por _id y retorna los índices
+    cuyo cambio está aplicado; sin `verify` no se confirma ninguna.
+    """
+    succeeded = {index for index in range(operations_count) if index not in errors}
+    if details["nModified"] >= len(succeeded):
+        return succeeded
+    return verify(succeeded) if verify else set()
@@ -1,10 +1,15 @@
 import os
-import json
 import datetime
-from pymongo import MongoClient
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 import resend
 
+from backups import backup_filename, backup_query
+from incremental import restrict_query, run_incremental
+from instrumentation import Instrumentation, print_breakdown, stages_html, stages_text
+from mongo_utils import chunked, confirmed_operations, create_client, execute_bulk, fetch_by_ids, stream_find
+from projections import ZERO_BALANCE_PROJECTION
+
 load_dotenv()
 
 # Configuración de la URI de MongoDB (puedes cambiar esto por una variable de entorno o input)
@@ -33,10 +38,8 @@ FINANCIAL_ENTITY_IDS = [
 ]
 
 # Conexión a MongoDB
-def get_mongo_collection():
-    client = MongoClient(MONGODB_URI)
-    db = client[DATABASE_NAME]
-    return db[COLLECTION_NAME]
+def get_mongo_client():
+    return create_client(MONGODB_URI)
 
 # Consulta de documentos
 query = {
@@ -49,6 +52,19 @@ query = {
     }
 }
 
+def build_zero_balance_query(loan_filter=None):
+    """`query` restringida a los préstamos modificados (ver incremental.py)"""
+    return restrict_query(query, loan_filter)
+
+# Corrección de las cuotas en mora con saldo pendiente cero; el filtro de cada
+# UpdateOne exige que el préstamo aún tenga alguna, así que solo coinciden los que se modifican
+ZERO_BALANCE_ELEMENT = query["amortization"]
+ZERO_BALANCE_UPDATE = {"$set": {"amortization.$[e].days_in_arrear": 0}}
+ZERO_BALANCE_ARRAY_FILTERS = [{"e.days_in_arrear": {"$gt": 0}, "e.pending_payment": 0}]
+
+# Cantidad de préstamos por cada bulk_write en modo "bulk"
+MORA_BULK_BATCH_SIZE = int(os.getenv("MORA_BULK_BATCH_SIZE", "500"))
+
 # Directorio y archivo de backup
 output_dir = "backups"
 os.makedirs(output_dir, exist_ok=True)
@@ -103,6 +119,14 @@ def send_email_notification(execution_summary):
                     <span class="metric-label">Documentos encontrados:</span>
                     <span class="metric-value">{execution_summary['documents_found']}</span>
                 </div>
+                <div class="metric">
+                    <span class="metric-label">Cuotas encontradas:</span>
+                    <span class="metric-value">{execution_summary['installments_found']}</span>
+                </div>
+                <div class="metric">
+                    <span class="metric-label">Préstamos actualizados:</span>
+                    <span class="metric-value success">{execution_summary['loans_modified']}</span>
+                </div>
                 <div class="metric">
                     <span class="metric-label">Cuotas actualizadas:</span>
                     <span class="metric-value success">{execution_summary['amortizations_updated']}</span>
@@ -117,7 +141,7 @@ def send_email_notification(execution_summary):
                     </ul>
                 </div>
             </div>
-
+            {stages_html(execution_summary.get('stages'))}
             <div class="section">
                 <h3>⏱️ Información de Ejecución</h3>
                 <div class="metric">
@@ -132,7 +156,7 @@ def send_email_notification(execution_summary):
 
             <div class="footer">
                 <p>Este es un mensaje automático generado por el script de corrección de mora con saldo cero.</p>
-                <p>Para más información, revisa el archivo JSON generado en el directorio de backups.</p>
+                <p>Para más información, revisa el archivo de backup generado en el directorio de backups.</p>
             </div>
         </body>
         </html>
@@ -147,16 +171,19 @@ Fecha de ejecución: {execution_summary['execution_date']}
 
 📊 RESUMEN GENERAL:
 • Documentos encontrados: {execution_summary['documents_found']}
+• Cuotas encontradas: {execution_summary['installments_found']}
+• Préstamos actualizados: {execution_summary['loans_modified']}
 • Cuotas actualizadas: {execution_summary['amortizations_updated']}
 
 📁 ARCHIVOS GENERADOS:
 • {execution_summary['backup_file']}
 
+{stages_text(execution_summary.get('stages'))}
 Estado: ✅ Completado exitosamente
 
 ---
 Este es un mensaje automático generado por el script de corrección de mora con saldo cero.
-Para más información, revisa el archivo JSON generado en el directorio de backups.
+Para más información, revisa el archivo de backup generado en el directorio de backups.
         """
 
         # Enviar el email usando la sintaxis correcta de Resend v0.8.0
@@ -192,71 +219,216 @@ Para más información, revisa el archivo JSON generado en el directorio de back
         traceback.print_exc()
         return False
 
-def main():
+def find_zero_balance_installments(doc):
+    """Retorna los índices de amortization en mora con saldo pendiente cero"""
+    updates = []
+
+    for idx, amort in enumerate(doc.get("amortization", [])):
+        try:
+            if amort["days_in_arrear"] > 0 and amort["pending_payment"] == 0:
+                updates.append(idx)
+        except KeyError:
+            print(f"[KeyError] Crédito con id {doc['_id']}, amortización: {amort.get('_id')}")
+        except TypeError:
+            print(f"[TypeError] Crédito con id {doc['_id']}, amortización: {amort.get('id')}")
+
+    return updates
+
+
+def verify_zero_balance_updates(collection, pending_updates, indexes):
+    """Relee por _id los préstamos de `indexes` y retorna los que ya no tienen cuotas en mora con saldo cero"""
+    current_loans = {}
+    for chunk in chunked([pending_updates[index][0] for index in indexes], MORA_BULK_BATCH_SIZE):
+        current_loans.update(fetch_by_ids(collection, chunk, ZERO_BALANCE_PROJECTION))
+
+    return {
+        index
+        for index in indexes
+        if pending_updates[index][0] in current_loans
+        and not find_zero_balance_installments(current_loans[pending_updates[index][0]])
+    }
+
+
+def count_zero_balance_updates(pending_updates, confirmed):
+    """(préstamos, cuotas) de `pending_updates` cuya corrección está confirmada"""
+    loans_modified = 0
+    amortizations_updated = 0
+    for index, (_, updates) in enumerate(pending_updates):
+        if index in confirmed:
+            loans_modified += 1
+            amortizations_updated += len(updates)
+    return loans_modified, amortizations_updated
+
+
+def flush_zero_balance_updates(collection, pending_updates):
+    """Envía un lote de correcciones con bulk_write y retorna (préstamos, cuotas) actualizados.
+
+    Cada préstamo genera un único UpdateOne con arrayFilters; el registro por
+    préstamo conserva los índices corregidos para auditoría. Si el lote modificó
+    menos préstamos que operaciones, se releen por _id y solo se cuentan los que
+    ya no tienen cuotas en mora con saldo cero (ver mongo_utils.confirmed_operations).
+    """
+    operations = [
+        UpdateOne(
+            {"_id": loan_id, "amortization": ZERO_BALANCE_ELEMENT},
+            ZERO_BALANCE_UPDATE,
+            array_filters=ZERO_BALANCE_ARRAY_FILTERS,
+        )
+        for loan_id, _ in pending_updates
+    ]
+
+    try:
+        details, errors = execute_bulk(collection, operations)
+    except Exception as e:
+        print(f"❌ Error al actualizar lote de {len(operations)} préstamos: {e}")
+        return 0, 0
+
+    print(f"📦 Lote de {len(operations)} préstamos enviado (matched: {details['nMatched']}, modified: {details['nModified']}, errores: {len(errors)})")
+    confirmed = confirmed_operations(
+        details, errors, len(operations), lambda indexes: verify_zero_balance_updates(collection, pending_updates, indexes)
+    )
+    if details["nModified"] < len(operations) - len(errors):
+        print(
+            f"⚠️  {len(operations) - len(errors) - details['nModified']} préstamos del lote cambiaron "
+            f"antes de actualizarlos; se releyeron para confirmar cada uno"
+        )
+
+    for index, (loan_id, updates) in enumerate(pending_updates):
+        if index in errors:
+            print(f"❌ Loan {loan_id}: Error al actualizar índices {updates}: {errors[index]}")
+        elif index not in confirmed:
+            print(f"⚠️  Loan {loan_id}: No se pudo actualizar los índices {updates} (ya no existe o siguen en mora)")
+        else:
+            print(f"Loan {loan_id}: Amortization índices {updates} actualizados")
+
+    return count_zero_balance_updates(pending_updates, confirmed)
+
+
+def run(db, mode="bulk", loan_filter=None):
+    """
+    Corrige las cuotas en mora con saldo pendiente cero y retorna el resumen de la ejecución.
+
+    Args:
+        db: base de datos sobre la que se ejecuta la corrección.
+        mode: "bulk" envía un UpdateOne por préstamo en lotes bulk_write y registra
+              los índices corregidos de cada préstamo; "update_many" aplica la
+              corrección completa con un único update_many sobre `query`.
+        loan_filter: restringe la corrección a los préstamos modificados (modo incremental).
+    """
     print("🚀 Iniciando corrección de mora con saldo cero")
+    print(f"   • Modo de actualización: {mode}")
     print("=" * 60)
-    
-    collection = get_mongo_collection()
-    
-    # Obtener documentos que cumplen la condición
-    docs = list(collection.find(query))
-    print(f"📊 Documentos encontrados: {len(docs)}")
 
-    # Backup de los documentos
+    collection = db[COLLECTION_NAME]
+    loan_query = build_zero_balance_query(loan_filter)
+
     timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    backup_filename = f"{output_dir}/loan_saldo_cero_documents_{timestamp}.json"
-    
-    # Convertir ObjectId a string para serializar
-    for doc in docs:
-        doc["_id"] = str(doc["_id"])
-    
-    with open(backup_filename, 'w', encoding='utf-8') as f:
-        json.dump(docs, f, ensure_ascii=False, indent=2)
-    print(f"📄 Backup guardado en {backup_filename}")
+    backup_file = backup_filename(f"{output_dir}/loan_saldo_cero_documents_{timestamp}")
+
+    # Backup de los documentos completos, directo del cursor al archivo
+    stages = Instrumentation()
+    with stages.stage("backup"):
+        docs_found = backup_query(collection, loan_query, backup_file)
 
-    # Actualizar los documentos
+    # La corrección solo lee los campos proyectados de amortization
+    loans_with_updates = 0
+    installments_found = 0
+    loans_modified = 0
     total_amortizations_updated = 0
-    
-    for doc in docs:
-        loan_id = doc["_id"]
-        amortizations = doc.get("amortization", [])
-        updates = []
-        
-        for idx, amort in enumerate(amortizations):
-            try:
-                if amort["days_in_arrear"] > 0 and amort["pending_payment"] == 0:
-                    updates.append(idx)
-            except KeyError:
-                print(f"[KeyError] Crédito con id {doc['_id']}, amortización: {amort.get('_id')}")
-            except TypeError:
-                print(f"[TypeError] Crédito con id {doc['_id']}, amortización: {amort.get('id')}")
-
-        if updates:
-            for idx in updates:
-                update_action = {"$set": {f"amortization.{idx}.days_in_arrear": 0}}
-                result = collection.update_one({"_id": doc["_id"]}, update_action)
-                print(f"Loan {loan_id}: Amortization index {idx} actualizado (matched: {result.matched_count}, modified: {result.modified_count})")
-                if result.modified_count > 0:
-                    total_amortizations_updated += 1
+    pending_updates = []
+    # En modo update_many se guardan los préstamos del recorrido para confirmar cada uno
+    found_loans = []
+
+    with stages.stage("amortization_update"):
+        for doc in stages.iterate(stream_find(collection, loan_query, ZERO_BALANCE_PROJECTION), "fetch"):
+            updates = find_zero_balance_installments(doc)
+            if not updates:
+                continue
+
+            loans_with_updates += 1
+            installments_found += len(updates)
+
+            if mode == "bulk":
+                pending_updates.append((doc["_id"], updates))
+                if len(pending_updates) >= MORA_BULK_BATCH_SIZE:
+                    batch_loans, batch_amortizations = flush_zero_balance_updates(collection, pending_updates)
+                    loans_modified += batch_loans
+                    total_amortizations_updated += batch_amortizations
+                    pending_updates = []
+            else:
+                found_loans.append((doc["_id"], updates))
+
+        if pending_updates:
+            batch_loans, batch_amortizations = flush_zero_balance_updates(collection, pending_updates)
+            loans_modified += batch_loans
+            total_amortizations_updated += batch_amortizations
+
+    print(f"📊 Documentos encontrados: {docs_found}")
+    print(f"📄 Backup guardado en {backup_file}")
+
+    if mode == "update_many" and loans_with_updates:
+        # Una sola sentencia en el servidor corrige todas las cuotas que cumplen la condición
+        with stages.stage("amortization_update"):
+            result = collection.update_many(
+                loan_query, ZERO_BALANCE_UPDATE, array_filters=ZERO_BALANCE_ARRAY_FILTERS
+            )
+        print(f"🔄 update_many aplicado (matched: {result.matched_count}, modified: {result.modified_count})")
+
+        # update_many solo reporta documentos: si modificó menos préstamos que los del
+        # recorrido previo, se releen por _id y se cuentan las cuotas de los confirmados
+        if result.modified_count < loans_with_updates:
+            print(
+                f"⚠️  Préstamos modificados ({result.modified_count}) menos que los del backup "
+                f"({loans_with_updates}); se releen para confirmar cada uno"
+            )
+        confirmed = confirmed_operations(
+            {"nModified": result.modified_count},
+            {},
+            len(found_loans),
+            lambda indexes: verify_zero_balance_updates(collection, found_loans, indexes),
+        )
+        loans_modified, total_amortizations_updated = count_zero_balance_updates(found_loans, confirmed)
     
     # Resumen final
     print("\n" + "=" * 60)
     print("📊 RESUMEN FINAL:")
-    print(f"   • Documentos encontrados: {len(docs)}")
+    print(f"   • Documentos encontrados: {docs_found}")
+    print(f"   • Cuotas encontradas: {installments_found}")
+    print(f"   • Préstamos actualizados: {loans_modified}")
     print(f"   • Cuotas actualizadas: {total_amortizations_updated}")
-    print(f"   • Archivo de backup: {backup_filename}")
+    print(f"   • Archivo de backup: {backup_file}")
+    stage_breakdown = stages.breakdown()
+    print_breakdown(stage_breakdown)
     print("=" * 60)
-    
-    # Enviar notificación por correo
-    print("\n📧 Enviando notificación por correo...")
-    execution_summary = {
+
+    return {
         'timestamp': timestamp,
         'execution_date': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'documents_found': len(docs),
+        'documents_found': docs_found,
+        'installments_found': installments_found,
+        'loans_modified': loans_modified,
         'amortizations_updated': total_amortizations_updated,
-        'backup_file': backup_filename
+        'backup_file': backup_file,
+        'stages': stage_breakdown,
     }
-    
+
+
+def main(mode="bulk", incremental=False, full_rescan=False):
+    """Corrige las cuotas en mora con saldo pendiente cero y envía el resumen por correo"""
+    client = get_mongo_client()
+    try:
+        db = client[DATABASE_NAME]
+        if incremental:
+            execution_summary = run_incremental(
+                db, "mora_saldo_cero", lambda loan_filter: run(db, mode, loan_filter), full_rescan=full_rescan
+            )
+        else:
+            execution_summary = run(db, mode)
+    finally:
+        client.close()
+
+    # Enviar notificación por correo
+    print("\n📧 Enviando notificación por correo...")
     email_sent = send_email_notification(execution_summary)
     if email_sent:
         print("✅ Notificación por correo enviada exitosamente")
@@ -266,4 +438,25 @@ def main():
     print("\n✅ Script completado")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Corrige cuotas en mora con saldo pendiente cero")
+    parser.add_argument(
+        "--mode",
+        choices=["bulk", "update_many"],
+        default="bulk",
+        help="bulk: un UpdateOne por préstamo con registro por préstamo; update_many: una sola sentencia en el servidor",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Solo revisa los préstamos modificados desde la última ejecución (ver incremental.py)",
+    )
+    parser.add_argument(
+        "--full-rescan",
+        action="store_true",
+        help="Con --incremental, recorre todos los préstamos y guarda el punto de control",
+    )
+    args = parser.parse_args()
+
+    main(args.mode, args.incremental, args.full_rescan)
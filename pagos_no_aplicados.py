@@ -5,10 +5,17 @@ Optimizado para excluir préstamos con status "paid" en la consulta a la BD.
 """
 import csv
 import os
-from pymongo import MongoClient
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 import resend
+from bson import json_util
+
+from instrumentation import Instrumentation, in_current_stage, print_breakdown, stages_html, stages_text
+from mongo_utils import chunked, create_client, fetch_by_ids, stream_find
+from serializers import dumps_extended
+from projections import LOAN_PAYMENT_INFO_PROJECTION, PAYMENT_TRANSACTIONS_PROJECTION
 
 load_dotenv()
 
@@ -20,6 +27,19 @@ EMAIL_TO = os.getenv("EMAIL_TO")
 if not RESEND_API_KEY or not EMAIL_FROM or not EMAIL_TO:
     print("⚠️  Variables de email no configuradas. Las notificaciones por correo estarán deshabilitadas.")
 
+# Cantidad de pagos cuyos préstamos se consultan en una sola consulta $in
+LOAN_LOOKUP_CHUNK_SIZE = 500
+
+# Pagos procesados entre dos puntos de control del motor python
+PAGOS_CHECKPOINT_INTERVAL = int(os.getenv("PAGOS_CHECKPOINT_INTERVAL", "5000"))
+
+# Días por partición y particiones que se recorren a la vez con --from/--to
+PAGOS_PARTITION_DAYS = int(os.getenv("PAGOS_PARTITION_DAYS", "1"))
+PAGOS_PARTITION_WORKERS = int(os.getenv("PAGOS_PARTITION_WORKERS", "4"))
+
+# Columnas del CSV de transacciones no aplicadas
+CSV_FIELDS = ["payment_id", "loan_id", "transaction_ids", "term", "issue"]
+
 
 def connect_to_mongodb():
     """
@@ -34,7 +54,7 @@ def connect_to_mongodb():
         raise ValueError("DATABASE_NAME environment variable is not set")
 
     try:
-        client = MongoClient(mongodb_uri)
+        client = create_client(mongodb_uri)
         db = client[database_name]
         db.command("ping")
         print(f"Successfully connected to MongoDB database: {database_name}")
@@ -44,24 +64,48 @@ def connect_to_mongodb():
         raise
 
 
-def get_unapplied_transactions(db, date_range="recent", limit=None):
+def date_range_from_args(date_from, date_to=None):
+    """Convierte --from/--to (YYYY-MM-DD, ambos inclusive) en el rango (inicio, fin exclusivo)"""
+    first_day = date.fromisoformat(date_from)
+    last_day = date.fromisoformat(date_to) if date_to else datetime.now(timezone.utc).date()
+    if last_day < first_day:
+        raise ValueError(f"--to ({last_day}) es anterior a --from ({first_day})")
+    return first_day.isoformat(), (last_day + timedelta(days=1)).isoformat()
+
+
+def format_date_range(date_range):
+    """Texto del rango para el resumen: el nombre del rango o "inicio a último día" """
+    if not isinstance(date_range, tuple):
+        return date_range
+    date_from, date_to = date_range
+    return f"{date_from} a {date.fromisoformat(date_to) - timedelta(days=1)}"
+
+
+def build_payment_query(date_range="recent"):
     """
-    Obtiene los transaction id de la colección payment que no están aplicados en loan.amortization.payment_info.
-    
-    Args:
-        db: Conexión a la base de datos MongoDB
-        date_range: Rango de fechas a consultar ("recent", "august", "september")
-        limit: Número máximo de pagos a procesar (None = sin límite)
+    Construye la consulta sobre la colección payment para el rango de fechas indicado.
+
+    `date_range` es un rango con nombre o una tupla (inicio, fin exclusivo) en
+    formato YYYY-MM-DD. Retorna la consulta y una descripción del rango para los
+    mensajes de log.
     """
+    # IDs de entidades financieras
+    STOP_ID = os.getenv("STOP_ID")
+    YOYO_ID = os.getenv("YOYO_ID")
+
+    if isinstance(date_range, tuple):
+        date_from, date_to = date_range
+        query = {
+            "date": {"$gte": date_from, "$lt": date_to},
+            "financial_entity_id": {"$in": [STOP_ID, YOYO_ID]},
+        }
+        return query, f"from {date_from} to {date_to} (exclusive, YOYO & STOP only)"
+
     if date_range == "august":
         # Obtener todos los pagos de agosto 2025
         august_start = "2025-08-01"
         august_end = "2025-09-01"  # Incluir todo agosto usando $lt
-        
-        # IDs de entidades financieras
-        STOP_ID = os.getenv("STOP_ID")
-        YOYO_ID = os.getenv("YOYO_ID")
-        
+
         query = {
             "date": {
                 "$gte": august_start,
@@ -71,23 +115,13 @@ def get_unapplied_transactions(db, date_range="recent", limit=None):
                 "$in": [STOP_ID, YOYO_ID]
             }
         }
-        
-        if limit:
-            payments = list(db.payment.find(query).limit(limit))
-            print(f"Payments fetched for August 2025 (YOYO & STOP only) - LIMITED TO {limit}: {len(payments)}")
-        else:
-            payments = list(db.payment.find(query))
-            print(f"Payments fetched for August 2025 (YOYO & STOP only): {len(payments)}")
-        
-    elif date_range == "september":
+        return query, "for August 2025 (YOYO & STOP only)"
+
+    if date_range == "september":
         # Obtener todos los pagos de septiembre 2025
         september_start = "2025-09-01"
         september_end = "2025-10-01"  # Incluir todo septiembre usando $lt
-        
-        # IDs de entidades financieras
-        STOP_ID = os.getenv("STOP_ID")
-        YOYO_ID = os.getenv("YOYO_ID")
-        
+
         query = {
             "date": {
                 "$gte": september_start,
@@ -97,26 +131,9 @@ def get_unapplied_transactions(db, date_range="recent", limit=None):
                 "$in": [STOP_ID, YOYO_ID]
             }
         }
+        return query, "for September 2025 (YOYO & STOP only)"
 
-        if date_range == "october":
-            october_start= "2025-10-01"
-            october_end = "2025-11-01"  # Incluir todo octubre usando $lt
-
-            query = {
-                "date": {
-                    "$gte": october_start,
-                    "$lt": october_end
-                },
-            }
-        
-        if limit:
-            payments = list(db.payment.find(query).limit(limit))
-            print(f"Payments fetched for September 2025 (YOYO & STOP only) - LIMITED TO {limit}: {len(payments)}")
-        else:
-            payments = list(db.payment.find(query))
-            print(f"Payments fetched for September 2025 (YOYO & STOP only): {len(payments)}")
-        
-    elif date_range == "october":
+    if date_range == "october":
         october_start = "2025-10-01"
         october_end = "2025-11-01"  # Incluir todo octubre usando $lt
 
@@ -126,102 +143,496 @@ def get_unapplied_transactions(db, date_range="recent", limit=None):
                 "$lt": october_end
             },
         }
-        
-        if limit:
-            payments = list(db.payment.find(query).limit(limit))
-            print(f"Payments fetched for October 2025 (YOYO & STOP only) - LIMITED TO {limit}: {len(payments)}")
+        return query, "for October 2025 (YOYO & STOP only)"
+
+    # recent (últimos 2 días)
+    yesterday = datetime.now(timezone.utc).date() - timedelta(days=2)
+    yesterday = yesterday.isoformat()
+    return {"date": {"$gte": yesterday}}, f"since {yesterday}"
+
+
+def write_inconsistent_file(loan_ids, inconsistent_file, description, mode="w"):
+    """Escribe el TXT de préstamos con inconsistencias; con mode="a" solo agrega los ids"""
+    with open(inconsistent_file, mode=mode) as f:
+        if mode == "w" or f.tell() == 0:
+            f.write(f"IDs de créditos con inconsistencias encontradas {description}:\n")
+            f.write("=" * 60 + "\n\n")
+        for loan_id in loan_ids:
+            f.write(f"{loan_id}\n")
+        if mode == "w":
+            f.write("\n")  # Línea vacía al final
+
+
+class ScanCheckpoint:
+    """
+    Progreso del recorrido de pagos del motor python, para poder reanudarlo.
+
+    Las filas del CSV y los préstamos del TXT se agregan a sus archivos a medida
+    que se procesa cada bloque de pagos. Cada PAGOS_CHECKPOINT_INTERVAL pagos se
+    guarda en `checkpoint_file` el último _id procesado (los pagos se recorren
+    ordenados por _id), los contadores, los préstamos con inconsistencias, la
+    consulta y el tamaño de los archivos de salida. Al reanudar, los archivos se
+    truncan a ese tamaño, de modo que lo procesado después del último punto de
+    control se repite sin duplicar filas. Al terminar se ordena el TXT y se
+    elimina el punto de control.
+    """
+
+    def __init__(self, checkpoint_file, csv_file, txt_file, description, date_range, limit, resume=False):
+        self.checkpoint_file = checkpoint_file
+        self.csv_file = csv_file
+        self.txt_file = txt_file
+        self.description = description
+        # Los rangos (inicio, fin) vuelven del JSON como listas
+        self.date_range = list(date_range) if isinstance(date_range, tuple) else date_range
+        self.limit = limit
+
+        state = self._load() if resume else None
+        if resume and state is None:
+            print(f"⚠️  No hay un punto de control válido en {checkpoint_file}; se empieza desde el inicio")
+        elif state and (self._size(csv_file) < state["csv_size"] or self._size(txt_file) < state["txt_size"]):
+            # Los archivos se borraron o recortaron después del punto de control
+            print(f"⚠️  Los archivos de salida no coinciden con {checkpoint_file}; se empieza desde el inicio")
+            state = None
+
+        if state:
+            self.query = state["query"]
+            self.last_id = state["last_id"]
+            self.count = state["count"]
+            self.unapplied_count = state["unapplied_count"]
+            self.inconsistent_loans = set(state["inconsistent_loans"])
+            self._truncate(csv_file, state["csv_size"])
+            self._truncate(txt_file, state["txt_size"])
+            print(f"♻️  Reanudando desde el pago {self.count} (último _id: {self.last_id})")
         else:
-            payments = list(db.payment.find(query))
-            print(f"Payments fetched for October 2025 (YOYO & STOP only): {len(payments)}")
-        
-    else:  # recent (últimos 2 días)
-        yesterday = datetime.now(timezone.utc).date() - timedelta(days=2)
-        yesterday = yesterday.isoformat()
-        payments = list(db.payment.find({"date": {"$gte": yesterday}}))
-        print(f"Payments fetched since {yesterday}: {len(payments)}")
+            self.query = None
+            self.last_id = None
+            self.count = 0
+            self.unapplied_count = 0
+            self.inconsistent_loans = set()
+            # Un punto de control anterior no debe sobrevivir a una ejecución que falle antes de guardar el suyo
+            for filename in (csv_file, txt_file, checkpoint_file):
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+        self._saved_count = self.count
 
-    count = 0
+    def _load(self):
+        if not os.path.exists(self.checkpoint_file):
+            return None
+        with open(self.checkpoint_file, "r", encoding="utf-8") as f:
+            state = json_util.loads(f.read())
+        if (state["date_range"], state["limit"]) != (self.date_range, self.limit):
+            print(f"⚠️  El punto de control es de {state['date_range']} (límite {state['limit']})")
+            return None
+        return state
+
+    @classmethod
+    def _truncate(cls, filename, size):
+        """Recorta `filename` a `size` bytes; nunca lo extiende"""
+        current_size = cls._size(filename)
+        if size > current_size:
+            raise ValueError(f"{filename} tiene {current_size} bytes, menos que los {size} del punto de control")
+        if not size:
+            if os.path.exists(filename):
+                os.remove(filename)
+            return
+        with open(filename, "r+b") as f:
+            f.truncate(size)
+
+    @staticmethod
+    def _size(filename):
+        return os.path.getsize(filename) if os.path.exists(filename) else 0
+
+    def record(self, query, last_id, count, new_rows, inconsistent_loans):
+        """Agrega a los archivos lo encontrado en un bloque y guarda el punto de control si corresponde"""
+        if new_rows:
+            with open(self.csv_file, mode="a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                if f.tell() == 0:
+                    writer.writeheader()
+                writer.writerows(new_rows)
+
+        new_loan_ids = sorted(inconsistent_loans - self.inconsistent_loans)
+        if new_loan_ids:
+            write_inconsistent_file(new_loan_ids, self.txt_file, self.description, mode="a")
+
+        self.query = query
+        self.last_id = last_id
+        self.count = count
+        self.unapplied_count += len(new_rows)
+        self.inconsistent_loans.update(new_loan_ids)
+
+        if self.count - self._saved_count >= PAGOS_CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Escribe el punto de control de forma atómica"""
+        state = {
+            "date_range": self.date_range,
+            "limit": self.limit,
+            "query": self.query,
+            "last_id": self.last_id,
+            "count": self.count,
+            "unapplied_count": self.unapplied_count,
+            "inconsistent_loans": sorted(self.inconsistent_loans),
+            "csv_size": self._size(self.csv_file),
+            "txt_size": self._size(self.txt_file),
+        }
+        temporary_file = f"{self.checkpoint_file}.tmp"
+        with open(temporary_file, "wb") as f:
+            f.write(dumps_extended(state))
+        os.replace(temporary_file, self.checkpoint_file)
+        self._saved_count = self.count
+        print(f"💾 Punto de control guardado: {self.count} pagos procesados")
+
+    def finish(self):
+        """Deja el TXT ordenado como en una ejecución completa y elimina el punto de control"""
+        if self.inconsistent_loans:
+            write_inconsistent_file(sorted(self.inconsistent_loans), self.txt_file, self.description)
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+
+def get_unapplied_transactions(db, date_range="recent", limit=None, engine="python", lookup_cache=None,
+                               checkpoint=None):
+    """
+    Obtiene los transaction id de la colección payment que no están aplicados en loan.amortization.payment_info.
+    
+    Args:
+        db: Conexión a la base de datos MongoDB
+        date_range: Rango de fechas a consultar ("recent", "august", "september", "october")
+        limit: Número máximo de pagos a procesar (None = sin límite)
+        engine: "python" compara en Python; "aggregation" resuelve el cruce en MongoDB;
+                "async" consulta los préstamos de varios bloques a la vez (async_engine)
+        lookup_cache: mongo_utils.LookupCache compartido para no repetir la consulta de préstamos ya leídos
+        checkpoint: ScanCheckpoint del motor python; si trae un punto de control, el
+                    recorrido continúa desde él con la misma consulta
+    """
+    if engine == "aggregation":
+        return get_unapplied_transactions_aggregation(db, date_range, limit)
+    if engine == "async":
+        # Importación diferida: async_engine reutiliza las funciones de este módulo
+        import async_engine
+
+        return async_engine.run_with_client(
+            db, async_engine.get_unapplied_transactions, date_range, limit, lookup_cache
+        )
+    if engine != "python":
+        raise ValueError(f"Motor desconocido: {engine}")
+
+    query, range_description = build_payment_query(date_range)
+    if checkpoint and checkpoint.query is not None:
+        # Al reanudar se conserva la consulta original ("recent" depende del día)
+        query = checkpoint.query
+
+    # Los pagos se recorren con un cursor; solo el bloque actual está en memoria
+    if limit:
+        total_payments = db.payment.count_documents(query, limit=limit)
+        print(f"Payments fetched {range_description} - LIMITED TO {limit}: {total_payments}")
+    else:
+        total_payments = db.payment.count_documents(query)
+        print(f"Payments fetched {range_description}: {total_payments}")
+
+    count = checkpoint.count if checkpoint else 0
+    scan_query = query
+    if checkpoint and checkpoint.last_id is not None:
+        scan_query = {**query, "_id": {"$gt": checkpoint.last_id}}
+    remaining = limit - count if limit else None
+
+    # Orden por _id: el último _id procesado basta para reanudar el recorrido
+    payments = []
+    if remaining is None or remaining > 0:
+        payments = stream_find(
+            db.payment, scan_query, PAYMENT_TRANSACTIONS_PROJECTION, limit=remaining, sort=[("_id", 1)]
+        )
+
+    fetch_loans = lookup_cache.fetch_by_ids if lookup_cache else fetch_by_ids
 
     unapplied_payments = []
-    inconsistent_loans = set()  # Para almacenar IDs únicos de préstamos con inconsistencias
-    for payment in payments:
-        print(f"Processing payment {count + 1}/{len(payments)}")
+    # Para almacenar IDs únicos de préstamos con inconsistencias
+    inconsistent_loans = set(checkpoint.inconsistent_loans) if checkpoint else set()
+    for payment_chunk in chunked(payments, LOAN_LOOKUP_CHUNK_SIZE):
+        # Una sola consulta $in por bloque de pagos en lugar de un find_one por pago
+        loans_by_id = fetch_loans(
+            db.loan, [payment.get("loan_id") for payment in payment_chunk], LOAN_PAYMENT_INFO_PROJECTION
+        )
+        chunk_start = len(unapplied_payments)
+        count = process_payment_chunk(
+            payment_chunk, loans_by_id, count, total_payments, unapplied_payments, inconsistent_loans
+        )
+        if checkpoint:
+            checkpoint.record(
+                query, payment_chunk[-1]["_id"], count, unapplied_payments[chunk_start:], inconsistent_loans
+            )
+
+    # Convertir a lista y ordenar para evitar duplicados
+    unique_inconsistent_loans = sorted(list(inconsistent_loans))
+    return unapplied_payments, unique_inconsistent_loans, count
+
+
+def process_payment_chunk(payment_chunk, loans_by_id, count, total_payments, unapplied_payments, inconsistent_loans):
+    """Evalúa un bloque de pagos contra sus préstamos ya consultados y retorna el nuevo conteo de pagos"""
+    for payment in payment_chunk:
+        print(f"Processing payment {count + 1}/{total_payments}")
         count += 1
-        payment_transactions = payment.get("transactions", [])
 
-        loan = db.loan.find_one({
-            "_id": payment.get("loan_id"),
-            "status": {"$ne": "paid"}  # Excluir préstamos con status "paid"
-        })
+        loan = loans_by_id.get(payment.get("loan_id"))
         if not loan:
-            # Si no se encuentra el préstamo o tiene status "paid", omitir
-            loan_exists = db.loan.find_one({"_id": payment.get("loan_id")})
-            if loan_exists and loan_exists.get("status") == "paid":
-                print(f"⏭️  Omitiendo préstamo con status 'paid': {payment.get('loan_id')}")
-                continue
-            else:
-                print(f"⚠️  Préstamo no encontrado: {payment.get('loan_id')}")
-                inconsistent_loans.add(str(payment.get("loan_id")))
-                continue
-            
-        loan_amortization = loan.get("amortization", [])
-        if not loan_amortization:
-            print(f"⚠️  Préstamo {payment.get('loan_id')} no tiene tabla de amortización")
+            print(f"⚠️  Préstamo no encontrado: {payment.get('loan_id')}")
             inconsistent_loans.add(str(payment.get("loan_id")))
             continue
 
-        # Obtener el payment_id para referencia
-        payment_id = str(payment.get("_id"))
-        
-        # Recopilar todos los términos (cuotas) a los que aplica este pago
-        terms_in_payment = set()
-        for transaction in payment_transactions:
-            transaction_details = transaction.get("details", {})
-            term = transaction_details.get("term")
-
-            # Validar que el término sea válido
-            if not term or term < 1 or term > len(loan_amortization):
-                print(f"⚠️  Término inválido {term} para préstamo {payment.get('loan_id')} (amortización tiene {len(loan_amortization)} períodos)")
-                inconsistent_loans.add(str(payment.get("loan_id")))
-                continue
-
-            terms_in_payment.add(term)
-        
-        # Verificar que cada cuota mencionada en el pago tenga al menos un ID en payment_info
-        for term in terms_in_payment:
-            payment_period = loan_amortization[term - 1]
-            payment_info = payment_period.get("payment_info", [])
-
-            # Verificar si payment_info está vacío (no hay pagos aplicados)
-            if not payment_info or len(payment_info) == 0:
-                # La cuota NO tiene ningún pago aplicado
-                transaction_ids = [t.get("id") for t in payment_transactions if t.get("details", {}).get("term") == term]
-                
-                print(
+        if loan.get("status") == "paid":
+            # Excluir préstamos con status "paid"
+            print(f"⏭️  Omitiendo préstamo con status 'paid': {payment.get('loan_id')}")
+            continue
+
+        evaluate_payment(payment, loan, unapplied_payments, inconsistent_loans)
+
+    return count
+
+
+def evaluate_payment(payment, loan, unapplied_payments, inconsistent_loans):
+    """
+    Compara las transacciones de un pago con la tabla de amortización de su préstamo.
+
+    Agrega a `unapplied_payments` las cuotas sin payment_info y a `inconsistent_loans`
+    los IDs de préstamos con inconsistencias.
+    """
+    payment_transactions = payment.get("transactions", [])
+
+    loan_amortization = loan.get("amortization", [])
+    if not loan_amortization:
+        print(f"⚠️  Préstamo {payment.get('loan_id')} no tiene tabla de amortización")
+        inconsistent_loans.add(str(payment.get("loan_id")))
+        return
+
+    # Obtener el payment_id para referencia
+    payment_id = str(payment.get("_id"))
+
+    # Recopilar todos los términos (cuotas) a los que aplica este pago
+    terms_in_payment = set()
+    for transaction in payment_transactions:
+        transaction_details = transaction.get("details", {})
+        term = transaction_details.get("term")
+
+        # Validar que el término sea válido
+        if not term or term < 1 or term > len(loan_amortization):
+            print(f"⚠️  Término inválido {term} para préstamo {payment.get('loan_id')} (amortización tiene {len(loan_amortization)} períodos)")
+            inconsistent_loans.add(str(payment.get("loan_id")))
+            continue
+
+        terms_in_payment.add(term)
+
+    # Verificar que cada cuota mencionada en el pago tenga al menos un ID en payment_info,
+    # en orden de cuota como el motor de agregación
+    for term in sorted(terms_in_payment):
+        payment_period = loan_amortization[term - 1]
+        payment_info = payment_period.get("payment_info", [])
+
+        # Verificar si payment_info está vacío (no hay pagos aplicados)
+        if not payment_info or len(payment_info) == 0:
+            # La cuota NO tiene ningún pago aplicado
+            transaction_ids = [t.get("id") for t in payment_transactions if t.get("details", {}).get("term") == term]
+
+            print(
+                {
+                    "payment_id": payment_id,
+                    "loan_id": str(payment.get("loan_id")),
+                    "transaction_ids": transaction_ids,
+                    "term": term,
+                    "issue": "payment_info is empty",
+                    "payment_info": payment_info
+                }
+            )
+            unapplied_payments.append(
+                {
+                    "payment_id": payment_id,
+                    "loan_id": str(payment.get("loan_id")),
+                    "transaction_ids": join_transaction_ids(transaction_ids),
+                    "term": term,
+                    "issue": "payment_info_empty"
+                }
+            )
+            # Agregar el loan_id a la lista de inconsistencias
+            inconsistent_loans.add(str(payment.get("loan_id")))
+
+
+def join_transaction_ids(transaction_ids):
+    """IDs de transacción para el CSV; una transacción sin id queda como un elemento vacío"""
+    return ",".join("" if transaction_id is None else str(transaction_id) for transaction_id in transaction_ids)
+
+
+def build_unapplied_transactions_pipeline(query, limit=None):
+    """
+    Construye el pipeline de agregación que cruza payment con loan en el servidor.
+
+    Emite una fila por (pago, cuota, problema) solo para los casos que el motor en
+    Python marcaría: préstamo no encontrado, amortización vacía, término inválido o
+    cuota sin payment_info. Los pagos de préstamos con status "paid" se descartan.
+    Las filas salen ordenadas por pago y cuota, igual que en el motor en Python.
+    """
+    pipeline = [{"$match": query}]
+    if limit:
+        # Los mismos pagos que toma el motor en Python, que recorre por _id
+        pipeline += [{"$sort": {"_id": 1}}, {"$limit": limit}]
+    pipeline.append({"$project": PAYMENT_TRANSACTIONS_PROJECTION})
+
+    pipeline += [
+        {
+            "$lookup": {
+                "from": "loan",
+                "localField": "loan_id",
+                "foreignField": "_id",
+                "as": "loan",
+                # Solo se trae el status y el payment_info de cada cuota, conservando el índice
+                "pipeline": [
                     {
-                        "payment_id": payment_id,
-                        "loan_id": str(payment.get("loan_id")),
-                        "transaction_ids": transaction_ids,
-                        "term": term,
-                        "issue": "payment_info is empty",
-                        "payment_info": payment_info
+                        "$project": {
+                            "status": 1,
+                            "payment_info": {
+                                "$map": {
+                                    "input": {"$ifNull": ["$amortization", []]},
+                                    "as": "period",
+                                    "in": {"$ifNull": ["$$period.payment_info", []]},
+                                }
+                            },
+                        }
                     }
-                )
-                unapplied_payments.append(
-                    {
-                        "payment_id": payment_id,
-                        "loan_id": str(payment.get("loan_id")),
-                        "transaction_ids": ",".join(transaction_ids),
-                        "term": term,
-                        "issue": "payment_info_empty"
+                ],
+            }
+        },
+        {
+            "$set": {
+                "loan_found": {"$gt": [{"$size": "$loan"}, 0]},
+                "loan": {"$arrayElemAt": ["$loan", 0]},
+            }
+        },
+        # Excluir préstamos con status "paid" (los préstamos no encontrados se conservan)
+        {"$match": {"loan.status": {"$ne": "paid"}}},
+        {
+            "$set": {
+                "payment_issue": {
+                    "$switch": {
+                        "branches": [
+                            {"case": {"$not": ["$loan_found"]}, "then": "loan_not_found"},
+                            {"case": {"$eq": [{"$size": "$loan.payment_info"}, 0]}, "then": "amortization_empty"},
+                        ],
+                        "default": None,
                     }
-                )
-                # Agregar el loan_id a la lista de inconsistencias
-                inconsistent_loans.add(str(payment.get("loan_id")))
+                }
+            }
+        },
+        {"$unwind": {"path": "$transactions", "preserveNullAndEmptyArrays": True}},
+        {
+            "$set": {
+                "term": "$transactions.details.term",
+                "periods": {"$size": {"$ifNull": ["$loan.payment_info", []]}},
+            }
+        },
+        {
+            "$set": {
+                "issue": {
+                    "$switch": {
+                        "branches": [
+                            {"case": {"$ne": ["$payment_issue", None]}, "then": "$payment_issue"},
+                            # Pago sin transacciones: no hay nada que verificar
+                            {"case": {"$in": [{"$type": "$transactions"}, ["missing", "null"]]}, "then": None},
+                            {
+                                "case": {
+                                    "$not": [
+                                        {"$and": [{"$gte": ["$term", 1]}, {"$lte": ["$term", "$periods"]}]}
+                                    ]
+                                },
+                                "then": "invalid_term",
+                            },
+                            {
+                                "case": {
+                                    "$eq": [
+                                        {
+                                            "$size": {
+                                                "$ifNull": [
+                                                    {
+                                                        "$arrayElemAt": [
+                                                            "$loan.payment_info",
+                                                            {"$subtract": ["$term", 1]},
+                                                        ]
+                                                    },
+                                                    [],
+                                                ]
+                                            }
+                                        },
+                                        0,
+                                    ]
+                                },
+                                "then": "payment_info_empty",
+                            },
+                        ],
+                        "default": None,
+                    }
+                }
+            }
+        },
+        {"$match": {"issue": {"$ne": None}}},
+        {
+            "$group": {
+                "_id": {"payment_id": "$_id", "term": "$term", "issue": "$issue"},
+                "loan_id": {"$first": "$loan_id"},
+                "periods": {"$first": "$periods"},
+                # $push omite los valores faltantes; null conserva las transacciones sin id
+                "transaction_ids": {"$push": {"$ifNull": ["$transactions.id", None]}},
+            }
+        },
+        {"$sort": {"_id.payment_id": 1, "_id.term": 1}},
+    ]
+    return pipeline
+
+
+def get_unapplied_transactions_aggregation(db, date_range="recent", limit=None):
+    """
+    Variante de get_unapplied_transactions que resuelve el cruce payment/loan con
+    una agregación en MongoDB y solo transfiere las filas con problemas.
+
+    Retorna la misma estructura que el motor en Python.
+    """
+    query, range_description = build_payment_query(date_range)
+
+    if limit:
+        total_payments = db.payment.count_documents(query, limit=limit)
+        print(f"Payments matched {range_description} - LIMITED TO {limit}: {total_payments}")
+    else:
+        total_payments = db.payment.count_documents(query)
+        print(f"Payments matched {range_description}: {total_payments}")
+
+    unapplied_payments = []
+    inconsistent_loans = set()
+    pipeline = build_unapplied_transactions_pipeline(query, limit)
+
+    for row in db.payment.aggregate(pipeline, allowDiskUse=True):
+        loan_id = str(row.get("loan_id"))
+        issue = row["_id"]["issue"]
+        term = row["_id"].get("term")
+        inconsistent_loans.add(loan_id)
+
+        if issue == "loan_not_found":
+            print(f"⚠️  Préstamo no encontrado: {loan_id}")
+        elif issue == "amortization_empty":
+            print(f"⚠️  Préstamo {loan_id} no tiene tabla de amortización")
+        elif issue == "invalid_term":
+            print(f"⚠️  Término inválido {term} para préstamo {loan_id} (amortización tiene {row['periods']} períodos)")
+        else:
+            unapplied_payments.append(
+                {
+                    "payment_id": str(row["_id"]["payment_id"]),
+                    "loan_id": loan_id,
+                    "transaction_ids": join_transaction_ids(row["transaction_ids"]),
+                    "term": term,
+                    "issue": "payment_info_empty"
+                }
+            )
 
-    # Convertir a lista y ordenar para evitar duplicados
     unique_inconsistent_loans = sorted(list(inconsistent_loans))
-    return unapplied_payments, unique_inconsistent_loans, len(payments)
+    return unapplied_payments, unique_inconsistent_loans, total_payments
 
 
 def send_email_notification(execution_summary):
@@ -293,7 +704,7 @@ def send_email_notification(execution_summary):
                     </ul>
                 </div>
             </div>
-
+            {stages_html(execution_summary.get('stages'))}
             <div class="section">
                 <h3>⏱️ Información de Ejecución</h3>
                 <div class="metric">
@@ -335,6 +746,7 @@ Rango de fechas: {execution_summary['date_range']}
 • {execution_summary['csv_file']}
 • {execution_summary['txt_file']}
 
+{stages_text(execution_summary.get('stages'))}
 Estado: ✅ Completado exitosamente
 
 ---
@@ -376,40 +788,8 @@ Para más información, revisa los archivos CSV y TXT generados.
         return False
 
 
-if __name__ == "__main__":
-    import sys
-    
-    # Determinar el rango de fechas desde argumentos de línea de comandos
-    date_range = "recent"  # Por defecto: últimos 2 días
-    limit = None  # Por defecto: sin límite
-    
-    if len(sys.argv) > 1:
-        date_range = sys.argv[1].lower()
-        if date_range not in ["recent", "august", "september", "october"]:
-            print("❌ Rango de fechas inválido. Usa: recent, august, september, o october")
-            sys.exit(1)
-    
-    # Segundo argumento opcional: límite de pagos
-    if len(sys.argv) > 2:
-        try:
-            limit = int(sys.argv[2])
-            print(f"🧪 MODO TEST: Limitando a {limit} pagos")
-        except ValueError:
-            print("❌ El límite debe ser un número entero")
-            sys.exit(1)
-    
-    print(f"🔍 Procesando pagos: {date_range}")
-    print("=" * 60)
-    
-    db = connect_to_mongodb()
-    unapplied, inconsistent_loan_ids, total_payments_processed = get_unapplied_transactions(db, date_range, limit)
-    
-    print("\n📊 Resumen:")
-    print(f"   • Pagos procesados: {total_payments_processed}")
-    print(f"   • Unapplied transactions: {len(unapplied)}")
-    print(f"   • Inconsistent loans: {len(inconsistent_loan_ids)}")
-
-    # Determinar nombres de archivos según el rango de fechas
+def output_files(date_range, limit=None):
+    """Retorna (archivo CSV, archivo TXT, descripción del rango) según el rango de fechas"""
     test_suffix = f"_test_{limit}" if limit else ""
     
     if date_range == "august":
@@ -420,36 +800,186 @@ if __name__ == "__main__":
         csv_file = f"unapplied_transactions_september_2025{test_suffix}.csv"
         inconsistent_file = f"inconsistent_loans_september_2025{test_suffix}.txt"
         description = f"en septiembre 2025{' (TEST con ' + str(limit) + ' pagos)' if limit else ''}"
+    elif date_range == "october":
+        csv_file = f"unapplied_transactions_october_2025{test_suffix}.csv"
+        inconsistent_file = f"inconsistent_loans_october_2025{test_suffix}.txt"
+        description = f"en octubre 2025{' (TEST con ' + str(limit) + ' pagos)' if limit else ''}"
+    elif isinstance(date_range, tuple):
+        date_from, date_to = format_date_range(date_range).split(" a ")
+        csv_file = f"unapplied_transactions_{date_from}_{date_to}{test_suffix}.csv"
+        inconsistent_file = f"inconsistent_loans_{date_from}_{date_to}{test_suffix}.txt"
+        description = f"entre {date_from} y {date_to}{' (TEST con ' + str(limit) + ' pagos)' if limit else ''}"
     else:
         csv_file = f"unapplied_transactions_recent{test_suffix}.csv"
         inconsistent_file = f"inconsistent_loans_recent{test_suffix}.txt"
         description = f"en los últimos 2 días{' (TEST con ' + str(limit) + ' pagos)' if limit else ''}"
 
-    # Exportar transacciones no aplicadas a CSV
-    if unapplied:
-        with open(csv_file, mode="w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=unapplied[0].keys())
+    return csv_file, inconsistent_file, description
+
+
+def checkpoint_filename(csv_file):
+    """Archivo del punto de control asociado a un CSV de salida"""
+    return f"{os.path.splitext(csv_file)[0]}.checkpoint.json"
+
+
+def split_date_range(date_range, days=PAGOS_PARTITION_DAYS):
+    """Divide un rango (inicio, fin exclusivo) en particiones consecutivas de `days` días"""
+    start, end = (date.fromisoformat(value) for value in date_range)
+    partitions = []
+    while start < end:
+        partition_end = min(start + timedelta(days=days), end)
+        partitions.append((start.isoformat(), partition_end.isoformat()))
+        start = partition_end
+    return partitions
+
+
+def scan_partition(db, partition, parts_dir, lookup_cache=None, resume=False):
+    """Recorre una partición con el motor python y sus propios archivos y punto de control.
+
+    Al terminar deja `<inicio>.done.json` con su resumen; al reanudar, las
+    particiones terminadas no se vuelven a recorrer.
+    """
+    base = os.path.join(parts_dir, partition[0])
+    done_file = f"{base}.done.json"
+    if resume and os.path.exists(done_file):
+        print(f"⏭️  Partición {partition[0]} ya terminada")
+        with open(done_file, "r", encoding="utf-8") as f:
+            return json_util.loads(f.read())
+
+    csv_file, txt_file = f"{base}.csv", f"{base}.txt"
+    checkpoint = ScanCheckpoint(
+        checkpoint_filename(csv_file), csv_file, txt_file, format_date_range(partition), partition, None, resume
+    )
+    _, inconsistent_loan_ids, count = get_unapplied_transactions(db, partition, None, "python", lookup_cache, checkpoint)
+    checkpoint.finish()
+
+    result = {
+        "csv_file": csv_file,
+        "payments_processed": count,
+        "unapplied_count": checkpoint.unapplied_count,
+        "inconsistent_loans": inconsistent_loan_ids,
+    }
+    with open(done_file, "wb") as f:
+        f.write(dumps_extended(result))
+    return result
+
+
+def scan_partitions(db, date_range, csv_file, inconsistent_file, description, lookup_cache=None, resume=False,
+                    workers=PAGOS_PARTITION_WORKERS):
+    """
+    Recorre un rango largo por particiones de PAGOS_PARTITION_DAYS días, `workers` a la vez.
+
+    Cada partición escribe sus archivos en `<csv>.parts/`; al final se unen en el
+    orden de las particiones (y de _id dentro de cada una), por lo que el CSV es
+    el mismo sin importar cuántas particiones se recorrieron en paralelo.
+    Retorna (transacciones no aplicadas, préstamos con inconsistencias, pagos procesados).
+    """
+    parts_dir = f"{os.path.splitext(csv_file)[0]}.parts"
+    if not resume and os.path.exists(parts_dir):
+        shutil.rmtree(parts_dir)
+    os.makedirs(parts_dir, exist_ok=True)
+
+    partitions = split_date_range(date_range)
+    print(f"🧩 {len(partitions)} particiones de {PAGOS_PARTITION_DAYS} día(s), {workers} en paralelo")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(
+                in_current_stage(lambda partition: scan_partition(db, partition, parts_dir, lookup_cache, resume)),
+                partitions,
+            )
+        )
+
+    for filename in (csv_file, inconsistent_file):
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    unapplied_count = 0
+    inconsistent_loans = set()
+    with_header = True
+    for result in results:
+        inconsistent_loans.update(result["inconsistent_loans"])
+        if not result["unapplied_count"]:
+            continue
+        unapplied_count += result["unapplied_count"]
+        with open(result["csv_file"], "r", newline="") as part, open(csv_file, "a", newline="") as merged:
+            header = part.readline()
+            if with_header:
+                merged.write(header)
+                with_header = False
+            shutil.copyfileobj(part, merged)
+
+    if inconsistent_loans:
+        write_inconsistent_file(sorted(inconsistent_loans), inconsistent_file, description)
+    shutil.rmtree(parts_dir)
+
+    payments_processed = sum(result["payments_processed"] for result in results)
+    return unapplied_count, sorted(inconsistent_loans), payments_processed
+
+
+def run(db, date_range="recent", limit=None, engine="python", lookup_cache=None, resume=False,
+        workers=PAGOS_PARTITION_WORKERS):
+    """Busca las transacciones no aplicadas, exporta el CSV y el TXT y retorna el resumen de la ejecución.
+
+    Con el motor python los archivos se escriben a medida que avanza el recorrido,
+    con puntos de control periódicos; `resume` continúa desde el último de ellos.
+    Los rangos (inicio, fin) de más de una partición se recorren en paralelo con
+    `workers` hilos (ver scan_partitions).
+    """
+    # Determinar nombres de archivos según el rango de fechas
+    csv_file, inconsistent_file, description = output_files(date_range, limit)
+    partitioned = (
+        engine == "python" and not limit and isinstance(date_range, tuple) and len(split_date_range(date_range)) > 1
+    )
+
+    stages = Instrumentation()
+    checkpoint = None
+    if partitioned:
+        with stages.stage("scan"):
+            unapplied_count, inconsistent_loan_ids, total_payments_processed = scan_partitions(
+                db, date_range, csv_file, inconsistent_file, description, lookup_cache, resume, workers
+            )
+    elif engine == "python":
+        checkpoint = ScanCheckpoint(
+            checkpoint_filename(csv_file), csv_file, inconsistent_file, description, date_range, limit, resume
+        )
+    elif resume:
+        print(f"⚠️  --resume solo aplica al motor python; el motor {engine} empieza desde el inicio")
+
+    unapplied = []
+    if not partitioned:
+        with stages.stage("scan"):
+            unapplied, inconsistent_loan_ids, total_payments_processed = get_unapplied_transactions(
+                db, date_range, limit, engine, lookup_cache, checkpoint
+            )
+        unapplied_count = checkpoint.unapplied_count if checkpoint else len(unapplied)
+
+    print("\n📊 Resumen:")
+    print(f"   • Pagos procesados: {total_payments_processed}")
+    print(f"   • Unapplied transactions: {unapplied_count}")
+    print(f"   • Inconsistent loans: {len(inconsistent_loan_ids)}")
+
+    # Con punto de control o particiones, el CSV y el TXT ya se escribieron durante el recorrido
+    if checkpoint:
+        checkpoint.finish()
+    elif unapplied:
+        # Exportar transacciones no aplicadas a CSV
+        with stages.stage("export"), open(csv_file, mode="w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
             writer.writeheader()
             writer.writerows(unapplied)
+
+    if unapplied_count:
         print(f"\n📄 Exported unapplied transactions to {csv_file}")
     else:
         print(f"\n✅ No unapplied transactions to export.")
 
-    # Exportar IDs de créditos con inconsistencias
+    # Exportar IDs de créditos con inconsistencias (ya sin duplicados y ordenados)
     if inconsistent_loan_ids:
-        # Eliminar duplicados y ordenar
-        unique_loan_ids = sorted(list(set(inconsistent_loan_ids)))
-        
-        with open(inconsistent_file, mode="w") as f:
-            f.write(f"IDs de créditos con inconsistencias encontradas {description}:\n")
-            f.write("=" * 60 + "\n\n")
-            for loan_id in unique_loan_ids:
-                f.write(f"{loan_id}\n")
-            f.write("\n")  # Línea vacía al final
-        
-        print(f"📄 Exported {len(unique_loan_ids)} unique inconsistent loan IDs to {inconsistent_file}")
-        if len(inconsistent_loan_ids) != len(unique_loan_ids):
-            print(f"   • Duplicados eliminados: {len(inconsistent_loan_ids) - len(unique_loan_ids)}")
+        if not checkpoint and not partitioned:
+            with stages.stage("export"):
+                write_inconsistent_file(inconsistent_loan_ids, inconsistent_file, description)
+        print(f"📄 Exported {len(inconsistent_loan_ids)} unique inconsistent loan IDs to {inconsistent_file}")
     else:
         print("✅ No inconsistent loans found.")
     
@@ -457,26 +987,93 @@ if __name__ == "__main__":
     print("\n" + "=" * 60)
     print("📊 RESUMEN FINAL:")
     print(f"   • Pagos procesados: {total_payments_processed}")
-    print(f"   • Transacciones no aplicadas: {len(unapplied)}")
+    print(f"   • Transacciones no aplicadas: {unapplied_count}")
     print(f"   • Préstamos con inconsistencias: {len(inconsistent_loan_ids)}")
     print(f"   • Archivo CSV: {csv_file}")
     print(f"   • Archivo TXT: {inconsistent_file}")
+    stage_breakdown = stages.breakdown()
+    print_breakdown(stage_breakdown)
     print("=" * 60)
     
-    # Enviar notificación por correo
-    print("\n📧 Enviando notificación por correo...")
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    execution_summary = {
+    return {
         'timestamp': timestamp,
         'execution_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'date_range': date_range,
+        'date_range': format_date_range(date_range),
         'payments_processed': total_payments_processed,  # Dato real de pagos procesados
-        'unapplied_transactions': len(unapplied),
+        'unapplied_transactions': unapplied_count,
         'inconsistent_loans': len(inconsistent_loan_ids),
         'csv_file': csv_file,
-        'txt_file': inconsistent_file
+        'txt_file': inconsistent_file,
+        'stages': stage_breakdown,
     }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Identifica transacciones de pago no aplicadas")
+    parser.add_argument(
+        "date_range",
+        nargs="?",
+        default="recent",  # Por defecto: últimos 2 días
+        type=str.lower,
+        choices=["recent", "august", "september", "october"],
+        help="Rango de fechas a consultar",
+    )
+    # Segundo argumento opcional: límite de pagos
+    parser.add_argument("limit", nargs="?", type=int, default=None, help="Número máximo de pagos (modo test)")
+    parser.add_argument(
+        "--engine",
+        choices=["python", "aggregation", "async"],
+        default="python",
+        help="python: cruce en el script; aggregation: cruce con $lookup en MongoDB; async: consultas concurrentes",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continúa desde el último punto de control del motor python",
+    )
+    parser.add_argument(
+        "--from",
+        dest="date_from",
+        help="Primer día del rango (YYYY-MM-DD); reemplaza al rango con nombre",
+    )
+    parser.add_argument("--to", dest="date_to", help="Último día del rango, inclusive (por defecto hoy)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=PAGOS_PARTITION_WORKERS,
+        help="Particiones de --from/--to que se recorren a la vez",
+    )
+    args = parser.parse_args()
+
+    date_range = args.date_range
+    limit = args.limit
+    engine = args.engine
+
+    if args.date_from:
+        try:
+            date_range = date_range_from_args(args.date_from, args.date_to)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.date_to:
+        parser.error("--to requiere --from")
+
+    if limit:
+        print(f"🧪 MODO TEST: Limitando a {limit} pagos")
     
+    print(f"🔍 Procesando pagos: {format_date_range(date_range)} (motor: {engine})")
+    print("=" * 60)
+    
+    db = connect_to_mongodb()
+    try:
+        execution_summary = run(db, date_range, limit, engine, resume=args.resume, workers=args.workers)
+    finally:
+        db.client.close()
+
+    # Enviar notificación por correo
+    print("\n📧 Enviando notificación por correo...")
     email_sent = send_email_notification(execution_summary)
     if email_sent:
         print("✅ Notificación por correo enviada exitosamente")
@@ -0,0 +1,63 @@
+"""
+Proyecciones de las consultas del checker.
+
+Cada etapa declara solo los campos que realmente lee; los backups usan el
+documento completo mediante una consulta separada.
+"""
+
+# Campos de amortization que deben ser enteros
+int_keys = [
+    "principal",
+    "total_amount",
+    "principal_payment_amount",
+    "interest_amount",
+    "taxes",
+    "days_in_arrear",
+    "pending_payment",
+    "arrear_interest_amount",
+    "pending_principal_payment_amount",
+    "pending_interest_amount",
+    "pending_interest_taxes_amount",
+    "pending_arrear_interest_amount",
+    "pending_guarantee_amount",
+    "pending_guarantee_taxes_amount",
+    "pending_other_expenses_amount",
+    "period_days",
+    "interest_taxes_amount",
+    "guarantee_amount",
+    "guarantee_taxes_amount",
+    "other_expenses_amount",
+    "arrear_interest_paid",
+    "arrear_interest_taxes_amount",
+    "pending_arrear_interest_taxes_amount",
+]
+
+
+# main.get_loan_documents → update_amortization_arrears / validate_user_status
+LOAN_ARREARS_PROJECTION = {
+    "user_id": 1,
+    "amortization.id": 1,
+    **{f"amortization.{key}": 1 for key in int_keys},
+}
+
+# main.validate_user_status
+USER_STATUS_PROJECTION = {"status": 1}
+
+# main.get_todays_payments_regex_approach
+TODAYS_PAYMENTS_PROJECTION = {"payment_date": 1, "limit_payment_date": 1}
+
+# pagos_no_aplicados.get_unapplied_transactions
+PAYMENT_TRANSACTIONS_PROJECTION = {
+    "loan_id": 1,
+    "transactions.id": 1,
+    "transactions.details.term": 1,
+}
+LOAN_PAYMENT_INFO_PROJECTION = {"status": 1, "amortization.payment_info": 1}
+
+# mora_saldo_cero.main
+ZERO_BALANCE_PROJECTION = {
+    "amortization._id": 1,
+    "amortization.id": 1,
+    "amortization.days_in_arrear": 1,
+    "amortization.pending_payment": 1,
+}
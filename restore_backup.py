@@ -0,0 +1,316 @@
+"""
+Restaura en la colección loan los documentos guardados en un backup del checker.
+
+Lee el backup documento por documento (cualquier formato de backups.read_backup)
+y devuelve a su valor original solo los campos que modifican los scripts:
+payment_date, limit_payment_date, el payment_date normalizado y, en cada cuota
+de amortization, days_in_arrear y payment_info. Las cuotas se buscan por su id,
+así que los demás campos de la cuota y las cuotas agregadas después del backup
+no se tocan. Los campos que no existían en el backup se eliminan. Cada
+escritura exige que los campos restaurados conserven el valor leído justo
+antes, para no pisar cambios concurrentes. Con --replace se reemplaza el
+documento completo.
+
+Las escrituras se envían con bulk_write en lotes de --batch-size documentos.
+Con --dry-run no se escribe nada: se compara cada documento del backup con el
+actual y se muestran los campos que cambiarían.
+
+Uso:
+    python restore_backup.py backups/loan_documents_20250101_070000.ndjson.gz --dry-run
+    python restore_backup.py backups/loan_saldo_cero_documents_20250101_070000.ndjson.gz
+"""
+import os
+import time
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+
+from backups import parse_backup_filename, read_backup
+from config import DATABASE_NAME, MONGODB_URI, PAYMENT_DATE_NORMALIZED_FIELD
+from mongo_utils import chunked, create_client, execute_bulk, fetch_by_ids
+
+RESTORED_FIELDS = (
+    "amortization",
+    "payment_date",
+    "limit_payment_date",
+    PAYMENT_DATE_NORMALIZED_FIELD,
+)
+
+# Campos de cada cuota que escriben main.py, mora_saldo_cero.py y loan_rules.py
+AMORTIZATION_RESTORED_FIELDS = ("days_in_arrear", "payment_info")
+
+RESTORE_BATCH_SIZE = int(os.getenv("RESTORE_BATCH_SIZE", "1000"))
+
+# Valor del guard para un campo que no existía al leer el documento actual
+MISSING_FIELD = {"$exists": False}
+
+
+def _legacy_id(value):
+    """Los backups JSON anteriores guardaban el ObjectId del _id como string"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def iter_backup_documents(filename):
+    """Itera los documentos del backup, recuperando el ObjectId en los backups JSON anteriores"""
+    backup_format, _ = parse_backup_filename(filename)
+    for document in read_backup(filename):
+        if backup_format == "json":
+            document["_id"] = _legacy_id(document["_id"])
+        yield document
+
+
+def plan_restore(current, backup, fields=RESTORED_FIELDS, amortization_fields=AMORTIZATION_RESTORED_FIELDS):
+    """Compara el documento actual con el backup y retorna (guard, to_set, to_unset, cuotas no encontradas).
+
+    amortization no se reemplaza completo: cada cuota del backup se busca por su
+    id en el documento actual y solo se restauran sus `amortization_fields`. Los
+    demás campos de la cuota y las cuotas agregadas después del backup se
+    conservan. `guard` exige que cada campo restaurado conserve el valor leído,
+    para no pisar un cambio hecho entre la lectura y la escritura.
+    """
+    guard = {"_id": backup["_id"]}
+    to_set = {}
+    to_unset = {}
+    missing_installments = []
+
+    def restore_field(path, current_parent, backup_parent, field):
+        if field in current_parent and field in backup_parent and current_parent[field] == backup_parent[field]:
+            return
+        if field not in current_parent and field not in backup_parent:
+            return
+        guard[path] = current_parent[field] if field in current_parent else MISSING_FIELD
+        if field in backup_parent:
+            to_set[path] = backup_parent[field]
+        else:
+            to_unset[path] = ""
+
+    for field in fields:
+        if field != "amortization":
+            restore_field(field, current, backup, field)
+            continue
+
+        current_amortization = current.get("amortization") or []
+        current_indexes = {
+            element["id"]: index
+            for index, element in enumerate(current_amortization)
+            if isinstance(element, dict) and element.get("id") is not None
+        }
+        for element in backup.get("amortization") or []:
+            index = current_indexes.get(element.get("id"))
+            if index is None:
+                missing_installments.append(element.get("id"))
+                continue
+
+            restored_paths = len(to_set) + len(to_unset)
+            for amortization_field in amortization_fields:
+                restore_field(
+                    f"amortization.{index}.{amortization_field}",
+                    current_amortization[index],
+                    element,
+                    amortization_field,
+                )
+            if len(to_set) + len(to_unset) > restored_paths:
+                # La cuota debe seguir en la misma posición al escribir
+                guard[f"amortization.{index}.id"] = element["id"]
+
+    return guard, to_set, to_unset, missing_installments
+
+
+def describe_restore(guard, to_set, to_unset):
+    """Retorna una descripción de cada campo que cambiaría la restauración"""
+    changes = []
+    for path in list(to_set) + list(to_unset):
+        current_value = "(sin valor)" if guard[path] == MISSING_FIELD else repr(guard[path])
+        backup_value = repr(to_set[path]) if path in to_set else "(sin valor)"
+        changes.append(f"{path}: {current_value} -> {backup_value}")
+    return changes
+
+
+def diff_document(current, backup, fields):
+    """Retorna una descripción de cada campo cuyo valor actual difiere del backup (usado con --replace)"""
+    changes = []
+    for field in fields:
+        current_value = current.get(field)
+        backup_value = backup.get(field)
+        if current_value == backup_value:
+            continue
+
+        if field == "amortization" and isinstance(current_value, list) and isinstance(backup_value, list):
+            changed_indexes = [
+                index
+                for index in range(max(len(current_value), len(backup_value)))
+                if index >= len(current_value)
+                or index >= len(backup_value)
+                or current_value[index] != backup_value[index]
+            ]
+            changes.append(f"amortization: {len(changed_indexes)} cuotas {changed_indexes[:10]}")
+        else:
+            changes.append(f"{field}: {current_value!r} -> {backup_value!r}")
+    return changes
+
+
+def _print_changes(loan_id, changes):
+    print(f"   🔄 Préstamo {loan_id}:")
+    for change in changes:
+        print(f"      • {change}")
+
+
+def _restore_fields_batch(loan_collection, batch, fields, amortization_fields, dry_run, summary):
+    """Restaura los campos indicados de un lote, comparando con los documentos actuales"""
+    current_documents = fetch_by_ids(loan_collection, [doc["_id"] for doc in batch], list(fields))
+
+    planned = []
+    for document in batch:
+        current = current_documents.get(document["_id"])
+        if current is None:
+            summary["missing"] += 1
+            print(f"   ⚠️  Préstamo {document['_id']} no existe en la colección")
+            continue
+
+        guard, to_set, to_unset, missing_installments = plan_restore(current, document, fields, amortization_fields)
+        if missing_installments:
+            print(f"   ⚠️  Préstamo {document['_id']}: cuotas del backup que ya no existen {missing_installments[:10]}")
+        if not to_set and not to_unset:
+            summary["unchanged"] += 1
+            continue
+        planned.append((document, guard, to_set, to_unset))
+
+    if dry_run:
+        summary["matched"] += len(planned)
+        for document, guard, to_set, to_unset in planned:
+            _print_changes(document["_id"], describe_restore(guard, to_set, to_unset))
+        return
+
+    operations = []
+    for _, guard, to_set, to_unset in planned:
+        update = {}
+        if to_set:
+            update["$set"] = to_set
+        if to_unset:
+            update["$unset"] = to_unset
+        operations.append(UpdateOne(guard, update))
+    if not operations:
+        return
+
+    details, errors = execute_bulk(loan_collection, operations)
+    for index, message in errors.items():
+        print(f"   ❌ Error en préstamo {planned[index][0]['_id']}: {message}")
+
+    conflicts = len(operations) - len(errors) - details["nMatched"]
+    if conflicts:
+        print(f"   ⚠️  {conflicts} préstamos cambiaron después de leerlos y no se restauraron")
+
+    summary["matched"] += details["nMatched"]
+    summary["modified"] += details["nModified"]
+    summary["conflicts"] += conflicts
+    summary["errors"] += len(errors)
+
+
+def _replace_batch(loan_collection, batch, dry_run, summary):
+    """Reemplaza los documentos completos de un lote por los del backup"""
+    if dry_run:
+        current_documents = fetch_by_ids(loan_collection, [doc["_id"] for doc in batch])
+        for document in batch:
+            current = current_documents.get(document["_id"])
+            if current is None:
+                summary["missing"] += 1
+                print(f"   ⚠️  Préstamo {document['_id']} no existe en la colección")
+                continue
+
+            changes = diff_document(current, document, list(document))
+            if not changes:
+                summary["unchanged"] += 1
+                continue
+
+            summary["matched"] += 1
+            _print_changes(document["_id"], changes)
+        return
+
+    operations = [ReplaceOne({"_id": document["_id"]}, document) for document in batch]
+    details, errors = execute_bulk(loan_collection, operations)
+    for index, message in errors.items():
+        print(f"   ❌ Error en préstamo {batch[index]['_id']}: {message}")
+
+    summary["matched"] += details["nMatched"]
+    summary["modified"] += details["nModified"]
+    summary["errors"] += len(errors)
+    summary["missing"] += len(batch) - details["nMatched"] - len(errors)
+    summary["unchanged"] += details["nMatched"] - details["nModified"]
+
+
+def restore(loan_collection, documents, fields=RESTORED_FIELDS, replace=False, dry_run=False,
+            batch_size=RESTORE_BATCH_SIZE, amortization_fields=AMORTIZATION_RESTORED_FIELDS):
+    """Restaura los documentos por lotes y retorna el resumen de la restauración"""
+    summary = {
+        "read": 0, "matched": 0, "modified": 0, "missing": 0, "unchanged": 0, "conflicts": 0, "errors": 0,
+    }
+    start = time.monotonic()
+
+    for batch in chunked(documents, batch_size):
+        summary["read"] += len(batch)
+
+        if replace:
+            _replace_batch(loan_collection, batch, dry_run, summary)
+        else:
+            _restore_fields_batch(loan_collection, batch, fields, amortization_fields, dry_run, summary)
+
+        elapsed = time.monotonic() - start
+        print(f"📦 {summary['read']} documentos procesados ({summary['read'] / max(elapsed, 1e-6):,.0f} docs/s)")
+
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Restaura en la colección loan un backup del checker")
+    parser.add_argument("backup_file", help="Archivo de backup (.ndjson, .bson, opcionalmente .gz/.zst, o .json anterior)")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra los cambios sin escribir en la base de datos")
+    parser.add_argument("--replace", action="store_true", help="Reemplaza el documento completo en lugar de solo los campos restaurados")
+    parser.add_argument(
+        "--fields",
+        default=",".join(RESTORED_FIELDS),
+        help="Campos a restaurar separados por coma (ignorado con --replace)",
+    )
+    parser.add_argument(
+        "--amortization-fields",
+        default=",".join(AMORTIZATION_RESTORED_FIELDS),
+        help="Campos de cada cuota a restaurar cuando --fields incluye amortization",
+    )
+    parser.add_argument("--batch-size", type=int, default=RESTORE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fields = tuple(field.strip() for field in args.fields.split(",") if field.strip())
+    amortization_fields = tuple(field.strip() for field in args.amortization_fields.split(",") if field.strip())
+
+    client = create_client(MONGODB_URI)
+    try:
+        loan_collection = client[DATABASE_NAME].loan
+
+        mode = "reemplazo completo" if args.replace else f"campos {', '.join(fields)}"
+        print(f"♻️  Restaurando {args.backup_file} ({mode}){' [DRY RUN]' if args.dry_run else ''}")
+
+        summary = restore(
+            loan_collection,
+            iter_backup_documents(args.backup_file),
+            fields=fields,
+            replace=args.replace,
+            dry_run=args.dry_run,
+            batch_size=args.batch_size,
+            amortization_fields=amortization_fields,
+        )
+
+        print("\n📊 Resumen:")
+        print(f"   • Documentos en el backup: {summary['read']}")
+        if args.dry_run:
+            print(f"   • Documentos que cambiarían: {summary['matched']}")
+        else:
+            print(f"   • Documentos restaurados: {summary['modified']}")
+            print(f"   • Cambiados después de leerlos (no restaurados): {summary['conflicts']}")
+            print(f"   • Errores: {summary['errors']}")
+        print(f"   • Sin cambios: {summary['unchanged']}")
+        print(f"   • No encontrados en la colección: {summary['missing']}")
+    finally:
+        client.close()
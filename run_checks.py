@@ -0,0 +1,507 @@
+"""
+Runner que ejecuta los scripts del checker en un solo proceso.
+
+Cada script se registra como un job con su función run(db, ...). Todos los jobs
+comparten un único MongoClient (mongo_utils.create_client) y al final se envía
+un solo correo con el resumen de todos.
+
+Cada job declara los campos que lee y escribe ("colección.campo"). Dos jobs
+entran en conflicto si uno escribe un campo que el otro lee o escribe (o un
+prefijo/subcampo de él); los jobs sin conflicto se ejecutan en paralelo en un
+pool de hilos y los que tienen conflicto respetan el orden de JOBS.
+
+Uso:
+    python run_checks.py                            # los jobs de DEFAULT_JOBS
+    python run_checks.py --jobs mora_saldo_cero     # solo los jobs indicados
+    python run_checks.py --max-workers 1            # todos en secuencia
+    python run_checks.py --incremental              # main y mora solo con préstamos modificados
+    python run_checks.py --metrics-textfile checker.prom   # además exporta las métricas (ver metrics.py)
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import resend
+from dotenv import load_dotenv
+
+import incremental
+import int_keys_audit
+import loan_rules
+import main
+import metrics
+import mora_saldo_cero
+import pagos_no_aplicados
+from instrumentation import Instrumentation, print_breakdown, stage_metrics
+from mongo_utils import LookupCache, create_client
+
+load_dotenv()
+
+MONGODB_URI = os.getenv("MONGODB_URI")
+DATABASE_NAME = os.getenv("DATABASE_NAME")
+
+# Configuración de email
+RESEND_API_KEY = os.getenv("RESEND_API_KEY")
+EMAIL_FROM = os.getenv("EMAIL_FROM")
+EMAIL_TO = os.getenv("EMAIL_TO")
+
+# Jobs que pueden ejecutarse a la vez
+RUNNER_MAX_WORKERS = int(os.getenv("RUNNER_MAX_WORKERS", "3"))
+
+# Jobs en el orden en que se ejecutan. Cada uno define cómo ejecutarse con las
+# opciones de la línea de comandos, qué campos lee y escribe, y qué métricas y
+# archivos reporta en el correo. Los backups leen el documento completo ("loan").
+JOBS = {
+    "main": {
+        "title": "LeanCore Consistency Checker",
+        "reads": {"loan", "user.status"},
+        "writes": {
+            "loan.amortization.days_in_arrear",
+            "loan.payment_date",
+            "loan.limit_payment_date",
+            f"loan.{main.PAYMENT_DATE_NORMALIZED_FIELD}",
+            "user.status",
+        },
+        "run": lambda db, options, cache: run_maybe_incremental(
+            db, "main", options, lambda loan_filter: main.run(
+                db, options.payment_date_mode, options.main_engine, loan_filter
+            )
+        ),
+        "metrics": lambda summary: [
+            ("Documentos de loan encontrados", summary["loan_documents_count"]),
+            ("Préstamos con amortization actualizada", summary["amortization_updates_count"]),
+            ("Usuarios validados", summary["users_validated_count"]),
+            ("Usuarios actualizados", summary["users_updated_count"]),
+            ("Cuotas con campos no enteros (int_keys)", summary.get("int_keys_invalid_installments", 0)),
+        ],
+        "files": lambda summary: summary["files_generated"],
+    },
+    "pagos_no_aplicados": {
+        "title": "Pagos No Aplicados",
+        "reads": {"payment", "loan.status", "loan.amortization.payment_info"},
+        "writes": set(),
+        "run": lambda db, options, cache: pagos_no_aplicados.run(
+            db,
+            options.date_range,
+            engine=options.pagos_engine,
+            lookup_cache=cache,
+            resume=options.pagos_resume,
+            workers=options.pagos_workers,
+        ),
+        "metrics": lambda summary: [
+            ("Rango de fechas", summary["date_range"]),
+            ("Pagos procesados", summary["payments_processed"]),
+            ("Transacciones no aplicadas", summary["unapplied_transactions"]),
+            ("Préstamos con inconsistencias", summary["inconsistent_loans"]),
+        ],
+        "files": lambda summary: [summary["csv_file"], summary["txt_file"]],
+    },
+    "mora_saldo_cero": {
+        "title": "Mora con Saldo Cero",
+        "reads": {"loan"},
+        "writes": {"loan.amortization.days_in_arrear"},
+        "run": lambda db, options, cache: run_maybe_incremental(
+            db, "mora_saldo_cero", options, lambda loan_filter: mora_saldo_cero.run(db, options.mora_mode, loan_filter)
+        ),
+        "metrics": lambda summary: [
+            ("Documentos encontrados", summary["documents_found"]),
+            ("Cuotas encontradas", summary["installments_found"]),
+            ("Préstamos actualizados", summary["loans_modified"]),
+            ("Cuotas actualizadas", summary["amortizations_updated"]),
+        ],
+        "files": lambda summary: [summary["backup_file"]],
+    },
+    # Reemplaza a mora_saldo_cero y a los pasos 3 y 4 de main con un solo recorrido
+    # de loan; no está en DEFAULT_JOBS para no corregir dos veces lo mismo
+    "loan_rules": {
+        "title": "Reglas de Préstamos",
+        "reads": {"loan", "payment.loan_id", "payment.transactions.id", "user.status"},
+        "writes": {"loan.amortization.days_in_arrear", "loan.amortization.payment_info", "user.status"},
+        "run": lambda db, options, cache: loan_rules.run(db, options.loan_rules),
+        "metrics": lambda summary: [
+            ("Préstamos recorridos", summary["loans_scanned"]),
+            ("Préstamos corregidos", summary["loans_updated"]),
+            ("Préstamos con datos que no se pudieron evaluar", summary["loans_malformed"]),
+            ("Préstamos en conflicto", summary["loans_conflicted"]),
+        ] + [
+            (name, ", ".join(f"{key}={value}" for key, value in rule_summary.items()))
+            for name, rule_summary in summary["rules_summary"].items()
+        ],
+        "files": lambda summary: summary["files_generated"],
+    },
+    # Solo lectura; se ejecuta con --jobs para auditar todos los préstamos de las entidades
+    "int_keys_audit": {
+        "title": "Auditoría de int_keys",
+        "reads": {"loan.financial_entity_id", "loan.amortization"},
+        "writes": set(),
+        "run": lambda db, options, cache: int_keys_audit.run(db),
+        "metrics": lambda summary: [
+            ("Préstamos con campos double", summary["loans_with_doubles"]),
+            ("Cuotas con campos double", summary["installments_with_doubles"]),
+        ] + [(f"Campo {key}", count) for key, count in summary["fields"].items()],
+        "files": lambda summary: [summary["csv_file"]],
+    },
+}
+
+# Jobs que se ejecutan si no se indica --jobs
+DEFAULT_JOBS = ["main", "pagos_no_aplicados", "mora_saldo_cero"]
+
+
+def run_maybe_incremental(db, job, options, run):
+    """Ejecuta `run(loan_filter)` con el filtro incremental si se pidió --incremental"""
+    if not options.incremental:
+        return run(None)
+    return incremental.run_incremental(
+        db, job, run, strategy=options.incremental_strategy, full_rescan=options.full_rescan
+    )
+
+
+def fields_overlap(first, second):
+    """Indica si dos rutas "colección.campo" se refieren al mismo dato o una contiene a la otra"""
+    return first == second or first.startswith(f"{second}.") or second.startswith(f"{first}.")
+
+
+def jobs_conflict(first, second):
+    """Dos jobs entran en conflicto si uno escribe algo que el otro lee o escribe"""
+    first_job, second_job = JOBS[first], JOBS[second]
+    checks = [
+        (first_job["writes"], second_job["reads"] | second_job["writes"]),
+        (second_job["writes"], first_job["reads"] | first_job["writes"]),
+    ]
+    return any(
+        fields_overlap(written, touched)
+        for written_fields, touched_fields in checks
+        for written in written_fields
+        for touched in touched_fields
+    )
+
+
+def build_dependencies(job_names):
+    """Retorna, para cada job, los jobs anteriores con los que entra en conflicto"""
+    return {
+        name: [previous for previous in job_names[:index] if jobs_conflict(previous, name)]
+        for index, name in enumerate(job_names)
+    }
+
+
+def run_job(name, db, options, cache):
+    """Ejecuta un job y retorna su resultado. Los errores quedan en el resultado"""
+    job = JOBS[name]
+    print(f"\n▶️  Job: {name}")
+
+    start = time.monotonic()
+    try:
+        summary = job["run"](db, options, cache)
+        result = {"job": name, "status": "ok", "summary": summary, "error": None}
+    except Exception as e:
+        print(f"❌ Error en el job {name}: {e}")
+        result = {"job": name, "status": "error", "summary": None, "error": str(e)}
+    result["seconds"] = time.monotonic() - start
+
+    print(f"⏱️  Job {name} terminado en {result['seconds']:.1f}s ({result['status']})")
+    return result
+
+
+def run_jobs(db, job_names, options, max_workers=RUNNER_MAX_WORKERS):
+    """Ejecuta los jobs en paralelo respetando sus conflictos.
+
+    Un job empieza cuando terminaron los jobs anteriores con los que entra en
+    conflicto. Un error en un job se registra en su resultado y no detiene a
+    los siguientes. Retorna los resultados en el orden de `job_names` y el tiempo
+    total de la ejecución.
+    """
+    dependencies = build_dependencies(job_names)
+    for name in job_names:
+        if dependencies[name]:
+            print(f"🔗 {name} espera a: {', '.join(dependencies[name])}")
+
+    cache = LookupCache()
+    results = {}
+    pending = list(job_names)
+    running = {}
+    start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if all(dependency in results for dependency in dependencies[name]):
+                    running[executor.submit(run_job, name, db, options, cache)] = name
+                    pending.remove(name)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                # Lo leído antes de las escrituras de este job ya no es confiable
+                for collection in {field.split(".", 1)[0] for field in JOBS[name]["writes"]}:
+                    cache.invalidate(collection)
+
+    wall_seconds = time.monotonic() - start
+    print(f"🗃️  Caché de consultas por _id: {cache.hits} aciertos, {cache.misses} consultados")
+    return [results[name] for name in job_names], wall_seconds
+
+
+def describe_timing(results, wall_seconds):
+    """Compara el tiempo real de la ejecución con la suma de los tiempos de cada job"""
+    sequential_seconds = sum(result["seconds"] for result in results)
+    speedup = sequential_seconds / wall_seconds if wall_seconds else 1
+    return f"Tiempo total: {wall_seconds:.1f}s (en secuencia: {sequential_seconds:.1f}s, {speedup:.1f}x)"
+
+
+def build_job_section(result):
+    """Construye el bloque HTML y el bloque de texto de un job para el correo"""
+    job = JOBS[result["job"]]
+
+    if result["status"] != "ok":
+        html = f"""
+            <div class="summary">
+                <h3>{job['title']}</h3>
+                <div class="metric">
+                    <span class="metric-label">Estado:</span>
+                    <span class="metric-value error">❌ {result['error']}</span>
+                </div>
+            </div>
+        """
+        text = f"{job['title']}\n• Estado: ❌ {result['error']}\n"
+        return html, text
+
+    metrics = job["metrics"](result["summary"]) + [("Duración", f"{result['seconds']:.1f}s")]
+    if "incremental" in result["summary"]:
+        metrics.append(("Modo incremental", result["summary"]["incremental"]))
+    metrics += stage_metrics(result["summary"].get("stages", {}))
+    files = job["files"](result["summary"])
+
+    html = f"""
+            <div class="summary">
+                <h3>{job['title']}</h3>
+    """
+    for label, value in metrics:
+        html += f"""
+                <div class="metric">
+                    <span class="metric-label">{label}:</span>
+                    <span class="metric-value">{value}</span>
+                </div>
+        """
+    html += """
+                <div class="files">
+                    <ul>
+    """
+    html += "".join(f"<li>{file}</li>" for file in files)
+    html += """
+                    </ul>
+                </div>
+            </div>
+    """
+
+    text = f"{job['title']}\n"
+    text += "".join(f"• {label}: {value}\n" for label, value in metrics)
+    text += "".join(f"• {file}\n" for file in files)
+    return html, text
+
+
+def send_combined_email(results, timestamp, wall_seconds):
+    """Envía un solo correo con el resumen de todos los jobs ejecutados"""
+    try:
+        if not RESEND_API_KEY or not EMAIL_FROM or not EMAIL_TO:
+            print("⚠️  Variables de email no configuradas. Saltando notificación por correo.")
+            return False
+
+        resend.api_key = RESEND_API_KEY
+
+        failed = [result["job"] for result in results if result["status"] != "ok"]
+        status = f"❌ Con errores en: {', '.join(failed)}" if failed else "✅ Completado exitosamente"
+        subject = f"📊 Resumen de Ejecución - LeanCore Consistency Checker - {timestamp}"
+        timing = describe_timing(results, wall_seconds)
+
+        sections = [build_job_section(result) for result in results]
+
+        html_content = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <title>Resumen de Ejecución</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 20px; }}
+                .header {{ background-color: #f8f9fa; padding: 20px; border-radius: 8px; margin-bottom: 20px; }}
+                .summary {{ background-color: #e9ecef; padding: 15px; border-radius: 8px; margin-bottom: 20px; }}
+                .section {{ margin-bottom: 15px; }}
+                .metric {{ display: flex; justify-content: space-between; margin: 5px 0; }}
+                .metric-label {{ font-weight: bold; }}
+                .metric-value {{ color: #007bff; }}
+                .success {{ color: #28a745; }}
+                .warning {{ color: #ffc107; }}
+                .error {{ color: #dc3545; }}
+                .files {{ background-color: #f8f9fa; padding: 10px; border-radius: 5px; }}
+                .footer {{ margin-top: 20px; font-size: 12px; color: #6c757d; }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h2>🚀 LeanCore Consistency Checker</h2>
+                <p>Resumen de ejecución del {timestamp}</p>
+                <p>Estado: {status}</p>
+                <p>{timing}</p>
+            </div>
+            {"".join(html for html, _ in sections)}
+            <div class="footer">
+                <p>Este es un mensaje automático generado por el LeanCore Consistency Checker.</p>
+            </div>
+        </body>
+        </html>
+        """
+
+        print("📧 Preparando email...")
+        print(f"   FROM: {EMAIL_FROM}")
+        print(f"   TO: {EMAIL_TO}")
+        print(f"   SUBJECT: {subject}")
+
+        params = {
+            "from": EMAIL_FROM,
+            "to": [EMAIL_TO] if isinstance(EMAIL_TO, str) else EMAIL_TO,
+            "subject": subject,
+            "html": html_content,
+            "text": f"Estado: {status}\n{timing}\n\n" + "\n".join(text for _, text in sections),
+        }
+
+        print("📤 Enviando email...")
+        response = resend.Emails.send(params)
+
+        if response and isinstance(response, dict) and 'id' in response:
+            print(f"✅ Notificación por correo enviada exitosamente. ID: {response['id']}")
+            return True
+        else:
+            print(f"❌ Error al enviar notificación por correo. Respuesta: {response}")
+            return False
+
+    except Exception as e:
+        print(f"❌ Error al enviar notificación por correo: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ejecuta los scripts del checker con una sola conexión")
+    parser.add_argument(
+        "--jobs",
+        default=",".join(DEFAULT_JOBS),
+        help=f"Jobs a ejecutar separados por coma ({', '.join(JOBS)})",
+    )
+    parser.add_argument("--payment-date-mode", choices=["regex", "range"], default="regex")
+    parser.add_argument(
+        "--date-range",
+        default="recent",
+        type=str.lower,
+        choices=["recent", "august", "september", "october"],
+        help="Rango de fechas de pagos_no_aplicados",
+    )
+    parser.add_argument("--date-from", help="Primer día (YYYY-MM-DD) de pagos_no_aplicados; reemplaza a --date-range")
+    parser.add_argument("--date-to", help="Último día, inclusive, de pagos_no_aplicados (por defecto hoy)")
+    parser.add_argument(
+        "--pagos-workers",
+        type=int,
+        default=pagos_no_aplicados.PAGOS_PARTITION_WORKERS,
+        help="Particiones de --date-from/--date-to que se recorren a la vez",
+    )
+    parser.add_argument("--main-engine", choices=["sync", "async"], default="sync")
+    parser.add_argument("--pagos-engine", choices=["python", "aggregation", "async"], default="python")
+    parser.add_argument(
+        "--pagos-resume",
+        action="store_true",
+        help="pagos_no_aplicados continúa desde su último punto de control (motor python)",
+    )
+    parser.add_argument("--mora-mode", choices=["bulk", "update_many"], default="bulk")
+    parser.add_argument(
+        "--loan-rules",
+        type=loan_rules.parse_rule_names,
+        default=loan_rules.default_rule_names(),
+        help=f"Reglas del job loan_rules separadas por coma ({', '.join(loan_rules.RULES)})",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="main y mora_saldo_cero solo revisan los préstamos modificados desde su última ejecución",
+    )
+    parser.add_argument(
+        "--incremental-strategy",
+        choices=incremental.STRATEGIES,
+        default=incremental.INCREMENTAL_STRATEGY,
+    )
+    parser.add_argument(
+        "--full-rescan",
+        action="store_true",
+        help="Con --incremental, recorre todos los préstamos y guarda el punto de control",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        default=metrics.METRICS_TEXTFILE,
+        help="Archivo OpenMetrics para el textfile collector de node_exporter",
+    )
+    parser.add_argument(
+        "--metrics-pushgateway",
+        default=metrics.METRICS_PUSHGATEWAY_URL,
+        help="URL del Pushgateway al que se envían las métricas",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=RUNNER_MAX_WORKERS,
+        help="Jobs que pueden ejecutarse a la vez (1 = en secuencia)",
+    )
+    args = parser.parse_args()
+
+    if args.date_from:
+        try:
+            args.date_range = pagos_no_aplicados.date_range_from_args(args.date_from, args.date_to)
+        except ValueError as e:
+            parser.error(str(e))
+
+    job_names = [name.strip() for name in args.jobs.split(",") if name.strip()]
+    unknown = [name for name in job_names if name not in JOBS]
+    if unknown:
+        parser.error(f"Jobs desconocidos: {', '.join(unknown)}")
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    print(f"🚀 Ejecutando jobs: {', '.join(job_names)}")
+
+    client = create_client(MONGODB_URI)
+    try:
+        client.admin.command("ping")
+        print("✅ Conexión exitosa a MongoDB")
+        results, wall_seconds = run_jobs(client[DATABASE_NAME], job_names, args, args.max_workers)
+    finally:
+        client.close()
+        print("🔌 Conexión cerrada")
+
+    print("\n" + "=" * 60)
+    print("📊 RESUMEN DE JOBS:")
+    for result in results:
+        icon = "✅" if result["status"] == "ok" else "❌"
+        print(f"   {icon} {result['job']}: {result['seconds']:.1f}s")
+    print(f"   ⏱️  {describe_timing(results, wall_seconds)}")
+    print("=" * 60)
+
+    print("\n📧 Enviando notificación por correo...")
+    runner_stages = Instrumentation()
+    with runner_stages.stage("email"):
+        send_combined_email(results, timestamp, wall_seconds)
+    print_breakdown(runner_stages.breakdown())
+
+    # Resultados de todos los jobs con su tiempo por etapa, más el envío del correo
+    report_file = f"{main.output_dir}/run_report_{timestamp}.json"
+    report = {
+        "timestamp": timestamp,
+        "jobs": results,
+        "wall_seconds": round(wall_seconds, 3),
+        "stages": runner_stages.breakdown(),
+    }
+    if main.save_to_json(report, report_file):
+        print(f"📄 Reporte de la ejecución guardado en: {report_file}")
+
+    metrics.export(results, wall_seconds, args.metrics_textfile, args.metrics_pushgateway)
+
+    if any(result["status"] != "ok" for result in results):
+        raise SystemExit(1)
@@ -0,0 +1,116 @@
+"""
+Serialización JSON de los reportes y backups del checker.
+
+Usa orjson cuando está instalado y el módulo json de la librería estándar en
+caso contrario. JSON_BACKEND (auto | orjson | json) permite forzar uno de los dos.
+
+- dumps(): reportes legibles. ObjectId y Decimal128 se escriben como string y
+  las fechas en ISO 8601.
+- dumps_extended(): JSON extendido de MongoDB en una sola línea (backups NDJSON),
+  que bson.json_util.loads recupera con sus tipos originales. Usa el modo
+  relajado salvo para Int64, que ese modo escribiría como un número y volvería
+  como int (int32 al reescribirlo): se escribe como {"$numberLong": ...}.
+"""
+import datetime
+import json
+import os
+
+from bson import Int64, ObjectId, json_util
+from bson.decimal128 import Decimal128
+from bson.json_util import RELAXED_JSON_OPTIONS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+
+# Los reportes se escriben con indentación salvo que se desactive
+JSON_PRETTY = os.getenv("JSON_PRETTY", "true").lower() in ("1", "true", "yes")
+
+
+def _resolve_backend(backend):
+    if backend == "auto":
+        return "orjson" if orjson is not None else "json"
+    if backend == "orjson" and orjson is None:
+        raise RuntimeError("JSON_BACKEND=orjson requiere el paquete 'orjson' (pip install orjson)")
+    if backend not in ("orjson", "json"):
+        raise ValueError(f"Backend JSON desconocido: {backend}")
+    return backend
+
+
+BACKEND = _resolve_backend(JSON_BACKEND)
+
+
+def _report_default(obj):
+    """Convierte los tipos BSON que no son JSON nativo para los reportes"""
+    if isinstance(obj, (ObjectId, Decimal128)):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Tipo no serializable a JSON: {type(obj).__name__}")
+
+
+def _int64(value):
+    return {"$numberLong": str(int(value))}
+
+
+def _preserve_int64(value):
+    """Copia `value` con los Int64 reemplazados por su forma {"$numberLong": ...}"""
+    if isinstance(value, Int64):
+        return _int64(value)
+    if isinstance(value, dict):
+        return {key: _preserve_int64(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_preserve_int64(item) for item in value]
+    return value
+
+
+def _extended_default(obj):
+    # Con OPT_PASSTHROUGH_SUBCLASS orjson pasa aquí las subclases de int, str, dict y list
+    if isinstance(obj, Int64):
+        return _int64(obj)
+    for base in (int, str, dict, list):
+        if isinstance(obj, base):
+            return base(obj)
+    return json_util.default(obj, json_options=RELAXED_JSON_OPTIONS)
+
+
+def dumps(data, pretty=False, backend=None):
+    """Serializa `data` para un reporte y retorna bytes UTF-8"""
+    backend = _resolve_backend(backend) if backend else BACKEND
+
+    if backend == "orjson":
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        return orjson.dumps(data, default=_report_default, option=option)
+
+    return json.dumps(
+        data, indent=2 if pretty else None, ensure_ascii=False, default=_report_default
+    ).encode("utf-8")
+
+
+def dumps_extended(document, backend=None):
+    """Serializa un documento como JSON extendido (modo relajado, Int64 como $numberLong) en una línea, sin salto final.
+
+    Con orjson los float NaN/Infinity se escriben como null; json_util los conserva.
+    """
+    backend = _resolve_backend(backend) if backend else BACKEND
+
+    if backend == "orjson":
+        # Las fechas y los Int64 pasan al default para escribirse como {"$date": ...} y {"$numberLong": ...}
+        return orjson.dumps(
+            document,
+            default=_extended_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS,
+        )
+
+    return json_util.dumps(
+        _preserve_int64(document), json_options=RELAXED_JSON_OPTIONS, ensure_ascii=False
+    ).encode("utf-8")
+
+
+def dump_to_file(data, filename, pretty=JSON_PRETTY):
+    """Escribe `data` como reporte JSON en `filename`"""
+    with open(filename, "wb") as f:
+        f.write(dumps(data, pretty=pretty))
@@ -0,0 +1,134 @@
+"""
+Fixtures compartidas de las pruebas.
+
+`mock_db` es una base de mongomock con lo que le falta para los scripts del
+checker (sesiones, bulk_write con la firma de PyMongo 4 y $set con arrayFilters).
+`mongod_db` es una base en un mongod real, para las agregaciones y los explain
+que mongomock no implementa: usa TEST_MONGODB_URI o, si no está definida,
+pymongo_inmemory; si ninguno está disponible, la prueba se omite.
+"""
+import os
+import re
+import sys
+import uuid
+
+import mongomock
+import pytest
+from mongomock.filtering import filter_applies
+from pymongo import DeleteOne, InsertOne, MongoClient, ReplaceOne, UpdateMany
+from pymongo.results import BulkWriteResult, UpdateResult
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py y mora_saldo_cero.py exigen los IDs de las entidades al importarse
+STOP_ID = os.environ.setdefault("STOP_ID", "stop-entity")
+YOYO_ID = os.environ.setdefault("YOYO_ID", "yoyo-entity")
+
+ARRAY_FILTER_PATH = re.compile(r"^(?P<array>[\w.]+)\.\$\[(?P<identifier>\w+)\]\.(?P<field>[\w.]+)$")
+
+
+class _Session:
+    session_id = {"id": "mongomock"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _apply_array_filters(collection, query, update, array_filters, many):
+    """$set sobre `array.$[e].campo` para los elementos que cumplen el arrayFilter de `e`"""
+    matched = modified = 0
+    documents = list(collection.find(query))
+    for document in documents if many else documents[:1]:
+        matched += 1
+        changed = False
+        for path, value in update.get("$set", {}).items():
+            parts = ARRAY_FILTER_PATH.match(path)
+            conditions = {
+                key.split(".", 1)[1]: condition
+                for array_filter in array_filters
+                for key, condition in array_filter.items()
+                if key.split(".", 1)[0] == parts["identifier"]
+            }
+            for element in document.get(parts["array"]) or []:
+                if filter_applies(conditions, element) and element.get(parts["field"]) != value:
+                    element[parts["field"]] = value
+                    changed = True
+        if changed:
+            collection.replace_one({"_id": document["_id"]}, document)
+            modified += 1
+    return UpdateResult({"n": matched, "nModified": modified}, True)
+
+
+def _with_array_filters(original, many):
+    def update(self, query, document, *args, array_filters=None, session=None, **kwargs):
+        if array_filters:
+            return _apply_array_filters(self, query, document, array_filters, many)
+        return original(self, query, document, *args, **kwargs)
+
+    return update
+
+
+def _bulk_write(self, operations, ordered=True, session=None, **kwargs):
+    counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0}
+    write_errors = []
+    for index, operation in enumerate(operations):
+        try:
+            if isinstance(operation, InsertOne):
+                self.insert_one(operation._doc)
+                counts["nInserted"] += 1
+                continue
+            if isinstance(operation, DeleteOne):
+                counts["nRemoved"] += self.delete_one(operation._filter).deleted_count
+                continue
+            if isinstance(operation, ReplaceOne):
+                result = self.replace_one(operation._filter, operation._doc, upsert=operation._upsert)
+            else:
+                update = self.update_many if isinstance(operation, UpdateMany) else self.update_one
+                result = update(operation._filter, operation._doc, array_filters=operation._array_filters)
+            counts["nMatched"] += result.matched_count
+            counts["nModified"] += result.modified_count
+            counts["nUpserted"] += 1 if result.upserted_id is not None else 0
+        except Exception as e:
+            write_errors.append({"index": index, "errmsg": str(e)})
+            if ordered:
+                break
+    return BulkWriteResult({**counts, "upserted": [], "writeErrors": write_errors, "writeConcernErrors": []}, True)
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """Base de datos de mongomock con sesiones, bulk_write y arrayFilters"""
+    monkeypatch.setattr(mongomock.MongoClient, "start_session", lambda self, **kwargs: _Session(), raising=False)
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", _bulk_write)
+    for name, many in (("update_one", False), ("update_many", True)):
+        original = getattr(mongomock.collection.Collection, name)
+        monkeypatch.setattr(mongomock.collection.Collection, name, _with_array_filters(original, many))
+    return mongomock.MongoClient()["checker_test"]
+
+
+@pytest.fixture(scope="session")
+def mongod_client():
+    uri = os.getenv("TEST_MONGODB_URI")
+    if uri:
+        client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    else:
+        try:
+            import pymongo_inmemory
+
+            client = pymongo_inmemory.MongoClient()
+        except Exception as e:
+            pytest.skip(f"No hay un mongod disponible (TEST_MONGODB_URI o pymongo_inmemory): {e}")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def mongod_db(mongod_client):
+    """Base de datos temporal en un mongod real, eliminada al terminar la prueba"""
+    name = f"checker_test_{uuid.uuid4().hex[:8]}"
+    yield mongod_client[name]
+    mongod_client.drop_database(name)
+
@@ -0,0 +1,111 @@
+import asyncio
+import os
+
+import async_engine
+import config
+import pagos_no_aplicados
+from mongo_utils import MONGO_MAX_POOL_SIZE, LookupCache, create_client
+from test_main import make_loan
+from test_pagos_no_aplicados import DATE_RANGE, load_payments
+
+
+class _BulkResult:
+    def __init__(self, operations):
+        self.bulk_api_result = {"nMatched": len(operations), "nModified": len(operations), "writeErrors": []}
+
+
+class AsyncCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def __aiter__(self):
+        for document in self.documents:
+            yield document
+
+
+class AsyncCollection:
+    """Colección asíncrona en memoria que registra las consultas y las tareas vivas en cada bulk_write"""
+
+    def __init__(self, documents=()):
+        self.full_name = "checker_test.loan"
+        self.documents = {document["_id"]: document for document in documents}
+        self.queried_ids = []
+        self.max_tasks = 0
+
+    def find(self, query, projection=None):
+        ids = query["_id"]["$in"]
+        self.queried_ids.extend(ids)
+        return AsyncCursor([self.documents[_id] for _id in ids if _id in self.documents])
+
+    async def bulk_write(self, operations, ordered=True):
+        self.max_tasks = max(self.max_tasks, len(asyncio.all_tasks()))
+        await asyncio.sleep(0)
+        return _BulkResult(operations)
+
+
+class AsyncDatabase:
+    def __init__(self, loan):
+        self.loan = loan
+
+
+def test_run_with_client_connects_to_the_configured_uri(monkeypatch):
+    uri = "mongodb://db-1.example:27017,db-2.example:27018/?replicaSet=rs0"
+    monkeypatch.setattr(config, "MONGODB_URI", uri)
+    client = create_client(uri)
+
+    async def describe(db, semaphore):
+        return db.name, db.client.options.replica_set_name, db.client.options.pool_options.max_pool_size
+
+    try:
+        assert async_engine.run_with_client(client["checker_db"], describe) == ("checker_db", "rs0", MONGO_MAX_POOL_SIZE)
+    finally:
+        client.close()
+
+
+def test_amortization_batches_in_flight_are_bounded(monkeypatch):
+    monkeypatch.setattr(async_engine, "ASYNC_CONCURRENCY", 3)
+    loan = AsyncCollection()
+
+    async def loan_documents():
+        for i in range(40):
+            yield make_loan(i, terms=2)
+
+    async def update():
+        return await async_engine.update_amortization_arrears(
+            AsyncDatabase(loan), loan_documents(), asyncio.Semaphore(3), batch_size=1
+        )
+
+    updated_loans = asyncio.run(update())
+
+    assert [record["loan_id"] for record in updated_loans] == [f"loan-{i:05d}" for i in range(40)]
+    # Las tareas de los lotes más la del propio recorrido
+    assert loan.max_tasks <= 3 + 1
+
+
+def test_fetch_by_ids_reuses_the_lookup_cache():
+    loan = AsyncCollection([{"_id": "loan-1"}, {"_id": "loan-2"}])
+    lookup_cache = LookupCache()
+
+    async def fetch(ids):
+        return await async_engine.fetch_by_ids(loan, ids, {"status": 1}, asyncio.Semaphore(1), lookup_cache)
+
+    assert asyncio.run(fetch(["loan-1", "loan-missing"])) == {"loan-1": {"_id": "loan-1"}}
+    assert asyncio.run(fetch(["loan-1", "loan-2", "loan-missing"])) == {
+        "loan-1": {"_id": "loan-1"},
+        "loan-2": {"_id": "loan-2"},
+    }
+    assert sorted(loan.queried_ids) == ["loan-1", "loan-2", "loan-missing"]
+    assert (lookup_cache.hits, lookup_cache.misses) == (2, 3)
+
+
+def test_async_engine_matches_python_engine(mongod_db, monkeypatch):
+    host, port = mongod_db.client.address
+    monkeypatch.setattr(config, "MONGODB_URI", os.getenv("TEST_MONGODB_URI") or f"mongodb://{host}:{port}")
+    load_payments(mongod_db)
+
+    for limit in (None, 2):
+        python_result = pagos_no_aplicados.get_unapplied_transactions(mongod_db, DATE_RANGE, limit=limit)
+        async_result = pagos_no_aplicados.get_unapplied_transactions(
+            mongod_db, DATE_RANGE, limit=limit, engine="async", lookup_cache=LookupCache()
+        )
+        assert async_result == python_result
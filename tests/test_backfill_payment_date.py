@@ -0,0 +1,69 @@
+from datetime import date
+
+import pytest
+
+import backfill_payment_date
+import main
+from config import PAYMENT_DATE_NORMALIZED_FIELD
+
+
+@pytest.fixture
+def loans(mock_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(backfill_payment_date, "STATE_FILE", str(tmp_path / "backfill_state.json"))
+    mock_db.loan.insert_many(
+        [{"_id": f"loan-{n}", "payment_date": f"2025-08-0{n}T00:00:00-05:00"} for n in (3, 5, 7)]
+    )
+    return mock_db
+
+
+def missing_normalized(db):
+    return sorted(loan["_id"] for loan in db.loan.find({PAYMENT_DATE_NORMALIZED_FIELD: {"$exists": False}}))
+
+
+def test_completed_run_clears_state_so_a_rerun_fills_new_loans(loans):
+    state = backfill_payment_date.backfill(loans.loan, batch_size=2)
+
+    assert state["updated"] == 3
+    assert missing_normalized(loans) == []
+    assert backfill_payment_date.load_state() == {"last_id": None, "updated": 0}
+
+    # Un préstamo nuevo con un _id menor que el último procesado
+    loans.loan.insert_one({"_id": "loan-1", "payment_date": "2025-08-01T00:00:00-05:00"})
+    backfill_payment_date.backfill(loans.loan, batch_size=2, state=backfill_payment_date.load_state())
+
+    assert missing_normalized(loans) == []
+
+
+def test_interrupted_run_resumes_from_saved_state(loans, monkeypatch):
+    save_state = backfill_payment_date.save_state
+
+    def save_then_stop(state):
+        save_state(state)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(backfill_payment_date, "save_state", save_then_stop)
+    with pytest.raises(KeyboardInterrupt):
+        backfill_payment_date.backfill(loans.loan, batch_size=1)
+    monkeypatch.setattr(backfill_payment_date, "save_state", save_state)
+
+    state = backfill_payment_date.load_state()
+    assert state == {"last_id": "loan-3", "updated": 1}
+
+    state = backfill_payment_date.backfill(loans.loan, batch_size=1, state=state)
+    assert state["updated"] == 3
+    assert missing_normalized(loans) == []
+
+
+def test_range_query_falls_back_to_regex_for_loans_without_the_field(loans):
+    backfill_payment_date.backfill(loans.loan, batch_size=2)
+    # Creados después de la migración: uno sin el campo y otro ya convertido a UTC
+    loans.loan.insert_many(
+        [
+            {"_id": "loan-new", "payment_date": "2025-08-05T10:00:00-05:00"},
+            {"_id": "loan-utc", "payment_date": "2025-08-05T15:00:00Z"},
+        ]
+    )
+
+    query = main.build_todays_payments_query(date(2025, 8, 5), "range")
+
+    assert sorted(loan["_id"] for loan in loans.loan.find(query)) == ["loan-5", "loan-new"]
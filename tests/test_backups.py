@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+from bson import Decimal128, Int64, ObjectId
+
+import backups
+import serializers
+
+
+def make_document():
+    return {
+        "_id": ObjectId("65f1c0ffee0000000000abcd"),
+        "created_at": datetime(2025, 8, 2, 13, 45, 10, 123000),
+        "amount": Decimal128("1250.75"),
+        "user_number": Int64(7),
+        "large_number": Int64(2**40),
+        "term": 3,
+        "rate": 1.0,
+        "signature": b"\x00\x01binary",
+        "deleted_at": None,
+        "active": True,
+        "amortization": [
+            {"id": "1-1", "pending_payment": Int64(0), "days_in_arrear": 0, "payment_info": []},
+            {"id": "1-2", "pending_payment": Int64(125000), "days_in_arrear": 4, "payment_info": [["a", 1]]},
+        ],
+    }
+
+
+def assert_same_types(actual, expected):
+    assert type(actual) is type(expected), (actual, expected)
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected)
+        for key in expected:
+            assert_same_types(actual[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(actual) == len(expected)
+        for actual_item, expected_item in zip(actual, expected):
+            assert_same_types(actual_item, expected_item)
+
+
+@pytest.mark.parametrize("json_backend", ["orjson", "json"])
+@pytest.mark.parametrize("backup_format", ["ndjson", "bson"])
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_backup_round_trip_preserves_values_and_types(tmp_path, monkeypatch, json_backend, backup_format, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    if json_backend == "orjson":
+        pytest.importorskip("orjson")
+    monkeypatch.setattr(serializers, "BACKEND", json_backend)
+
+    documents = [make_document(), {"_id": "loan-2", "user_number": Int64(-1), "amortization": []}]
+    filename = backups.backup_filename(str(tmp_path / "loan_documents"), backup_format, compression)
+
+    with backups.BackupWriter(filename) as writer:
+        for document in documents:
+            writer.write(document)
+
+    restored = list(backups.read_backup(filename))
+
+    assert writer.count == 2
+    assert restored == documents
+    assert_same_types(restored, documents)
+
+
+def test_ndjson_backup_writes_int64_as_number_long(tmp_path):
+    filename = backups.backup_filename(str(tmp_path / "loan_documents"), "ndjson", "none")
+
+    with backups.BackupWriter(filename) as writer:
+        writer.write({"_id": "loan-1", "user_number": Int64(7), "term": 3})
+
+    with open(filename, encoding="utf-8") as f:
+        line = f.read()
+
+    assert '{"$numberLong":' in line.replace(": ", ":")
+    assert '"term":3' in line.replace(": ", ":")
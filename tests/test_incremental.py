@@ -0,0 +1,188 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import incremental
+
+
+class FakeChangeStream:
+    """Change stream sobre el historial de FakeLoanCollection; el token es la posición en el historial"""
+
+    def __init__(self, collection, position):
+        self.collection = collection
+        self.position = position
+        self.alive = True
+
+    @property
+    def resume_token(self):
+        return {"_data": self.position}
+
+    def try_next(self):
+        if self.position >= len(self.collection.history):
+            return None
+        loan_id = self.collection.history[self.position]
+        self.position += 1
+        self.collection.events_read += 1
+        return {"documentKey": {"_id": loan_id}}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FakeLoanCollection:
+    def __init__(self):
+        self.history = []
+        self.oldest = 0
+        self.events_read = 0
+        self.error_code = 286
+
+    def modify(self, *loan_ids):
+        self.history.extend(loan_ids)
+
+    def watch(self, pipeline, resume_after=None, max_await_time_ms=None):
+        if resume_after is None:
+            return FakeChangeStream(self, len(self.history))
+        if resume_after["_data"] < self.oldest:
+            raise OperationFailure("resume point may no longer be in the oplog", code=self.error_code)
+        return FakeChangeStream(self, resume_after["_data"])
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.loan = FakeLoanCollection()
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return str(tmp_path / "checker_state.json")
+
+
+def run_job(db, state_file, strategy="change_stream", full_rescan=False):
+    """Ejecuta el job incremental y retorna el filtro que recibió y su resumen"""
+    filters = []
+
+    def run(loan_filter):
+        filters.append(loan_filter)
+        return {}
+
+    summary = incremental.run_incremental(db, "mora", run, strategy, full_rescan, state_file)
+    return filters[0], summary["incremental"]
+
+
+def test_change_stream_reads_the_loans_changed_since_the_saved_token(state_file):
+    db = FakeDatabase()
+    db.loan.modify("loan-1")
+
+    assert run_job(db, state_file) == (None, "recorrido completo")
+    assert incremental.load_state(state_file)["mora"] == {"strategy": "change_stream", "resume_token": {"_data": 1}}
+
+    db.loan.modify("loan-2", "loan-3", "loan-2")
+    loan_filter, description = run_job(db, state_file)
+
+    assert sorted(loan_filter["_id"]["$in"]) == ["loan-2", "loan-3"]
+    assert description == "2 préstamos modificados"
+    assert incremental.load_state(state_file)["mora"]["resume_token"] == {"_data": 4}
+    assert run_job(db, state_file) == ({"_id": {"$in": []}}, "0 préstamos modificados")
+
+
+def test_full_rescan_ignores_the_token_and_saves_a_new_one(state_file):
+    db = FakeDatabase()
+    run_job(db, state_file)
+    db.loan.modify("loan-1", "loan-2")
+
+    assert run_job(db, state_file, full_rescan=True) == (None, "recorrido completo")
+    assert incremental.load_state(state_file)["mora"]["resume_token"] == {"_data": 2}
+
+
+@pytest.mark.parametrize("code", sorted(incremental.CHANGE_STREAM_HISTORY_LOST_CODES))
+def test_lost_change_stream_history_falls_back_to_a_full_scan(state_file, code):
+    db = FakeDatabase()
+    run_job(db, state_file)
+    db.loan.modify("loan-1", "loan-2", "loan-3")
+    # El oplog ya no tiene los eventos anteriores a la posición 2
+    db.loan.oldest = 2
+    db.loan.error_code = code
+
+    assert run_job(db, state_file) == (None, "recorrido completo")
+    assert incremental.load_state(state_file)["mora"]["resume_token"] == {"_data": 3}
+
+
+def test_other_change_stream_errors_are_raised(state_file):
+    db = FakeDatabase()
+    run_job(db, state_file)
+    db.loan.modify("loan-1")
+    db.loan.oldest = 1
+    db.loan.error_code = 40573
+
+    with pytest.raises(OperationFailure):
+        run_job(db, state_file)
+
+
+def test_too_many_changes_stop_reading_and_fall_back_to_a_full_scan(state_file, monkeypatch):
+    monkeypatch.setattr(incremental, "INCREMENTAL_MAX_CHANGED_IDS", 3)
+    db = FakeDatabase()
+    run_job(db, state_file)
+    db.loan.modify(*(f"loan-{n}" for n in range(100)))
+
+    assert run_job(db, state_file) == (None, "recorrido completo (más de 3 préstamos modificados)")
+    assert db.loan.events_read == 4
+    # El recorrido completo cubre los eventos sin leer: el token queda al final del historial
+    assert incremental.load_state(state_file)["mora"]["resume_token"] == {"_data": 100}
+
+
+def test_failed_run_keeps_the_previous_checkpoint(state_file):
+    db = FakeDatabase()
+    run_job(db, state_file)
+    db.loan.modify("loan-1")
+
+    def failing_run(loan_filter):
+        raise RuntimeError("fallo del job")
+
+    with pytest.raises(RuntimeError):
+        incremental.run_incremental(db, "mora", failing_run, "change_stream", False, state_file)
+
+    assert incremental.load_state(state_file)["mora"]["resume_token"] == {"_data": 0}
+    assert run_job(db, state_file) == ({"_id": {"$in": ["loan-1"]}}, "1 préstamos modificados")
+
+
+def test_watermark_selects_loans_updated_since_the_previous_run(mock_db, state_file, monkeypatch):
+    assert run_job(mock_db, state_file, "watermark") == (None, "recorrido completo")
+    watermark = incremental.load_state(state_file)["mora"]["watermark"]
+    since = datetime.fromisoformat(watermark).replace(tzinfo=None)
+    overlap = timedelta(seconds=incremental.INCREMENTAL_OVERLAP_SECONDS)
+
+    mock_db.loan.insert_many(
+        [
+            {"_id": "loan-date", "updated_at": since - overlap / 2},
+            {"_id": "loan-text", "updated_at": (since + timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")},
+            {"_id": "loan-old-date", "updated_at": since - overlap * 2},
+            {"_id": "loan-old-text", "updated_at": (since - overlap * 2).strftime("%Y-%m-%dT%H:%M:%SZ")},
+            {"_id": "loan-without-field"},
+        ]
+    )
+    loan_filter, description = run_job(mock_db, state_file, "watermark")
+
+    assert description == f"modificados desde {watermark}"
+    assert sorted(loan["_id"] for loan in mock_db.loan.find(loan_filter)) == ["loan-date", "loan-text"]
+    assert incremental.load_state(state_file)["mora"]["watermark"] > watermark
+
+
+def test_changing_strategy_discards_the_previous_checkpoint(state_file):
+    db = FakeDatabase()
+    run_job(db, state_file, "watermark")
+
+    assert run_job(db, state_file) == (None, "recorrido completo")
+    assert run_job(db, state_file, "watermark") == (None, "recorrido completo")
+
+
+def test_restrict_query_combines_overlapping_keys_with_and():
+    query = {"financial_entity_id": "stop-entity", "_id": {"$gt": "loan-0"}}
+    loan_filter = {"_id": {"$in": ["loan-1"]}}
+
+    assert incremental.restrict_query(query, None) is query
+    assert incremental.restrict_query(query, loan_filter) == {"$and": [query, loan_filter]}
+    assert incremental.restrict_query({"status": "paid"}, loan_filter) == {"status": "paid", **loan_filter}
@@ -0,0 +1,51 @@
+import indexes
+
+FIND_EXPLANATION = {
+    "queryPlanner": {
+        "winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "checker_date"}},
+        "rejectedPlans": [{"stage": "COLLSCAN"}],
+    }
+}
+
+# Agregación cuya consulta inicial queda dentro de la etapa $cursor
+AGGREGATE_EXPLANATION = {
+    "stages": [
+        {"$cursor": {"queryPlanner": {"winningPlan": {"stage": "PROJECTION_SIMPLE", "inputStage": {"stage": "COLLSCAN"}}}}},
+        {"$lookup": {"from": "loan", "as": "loan"}},
+    ]
+}
+
+# Con el motor de ejecución basado en slots el plan queda en queryPlan
+SBE_EXPLANATION = {
+    "queryPlanner": {"winningPlan": {"queryPlan": {"stage": "GROUP", "inputStage": {"stage": "IXSCAN"}}, "slotBasedPlan": {}}}
+}
+
+
+def test_winning_plan_stages_ignores_rejected_plans():
+    assert indexes.winning_plan_stages(FIND_EXPLANATION) == ["FETCH", "IXSCAN"]
+
+
+def test_winning_plan_stages_reads_aggregation_explanations():
+    assert indexes.winning_plan_stages(AGGREGATE_EXPLANATION) == ["PROJECTION_SIMPLE", "COLLSCAN"]
+    assert indexes.winning_plan_stages(SBE_EXPLANATION) == ["GROUP", "IXSCAN"]
+
+
+def test_checker_pipelines_cover_every_aggregation():
+    sources = [source for source, _, _ in indexes.checker_pipelines()]
+
+    assert "main.count_user_loans (aggregate)" in sources
+    assert "int_keys_audit.audit_rows" in sources
+    assert "pagos_no_aplicados --engine aggregation (august)" in sources
+
+
+def test_advise_reports_collection_scans_until_indexes_exist(mongod_db):
+    mongod_db.loan.insert_one({"_id": "loan-1", "user_id": "user-1", "status": "paid", "amortization": []})
+    mongod_db.payment.insert_one({"_id": "payment-1", "loan_id": "loan-1", "date": "2025-08-02", "transactions": []})
+    mongod_db.user.insert_one({"_id": "user-1", "status": "arrear"})
+
+    collection_scans = indexes.advise(mongod_db)
+    assert "pagos_no_aplicados --engine aggregation (august)" in collection_scans
+    assert "main.count_user_loans (aggregate)" in collection_scans
+
+    indexes.ensure_indexes(mongod_db)
+    assert indexes.advise(mongod_db) == []
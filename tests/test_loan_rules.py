@@ -0,0 +1,86 @@
+import loan_rules
+from backups import read_backup
+from conftest import STOP_ID, YOYO_ID
+
+
+def installment(term, days_in_arrear, pending_payment=1000):
+    return {"id": f"{term}", "days_in_arrear": days_in_arrear, "pending_payment": pending_payment, "payment_info": []}
+
+
+def load_loans(db):
+    loans = [
+        # paid_loan_arrears
+        {"_id": "loan-paid", "user_id": "user-1", "financial_entity_id": STOP_ID, "status": "paid",
+         "amortization": [installment(1, 0), installment(2, 4)]},
+        # zero_balance_arrears
+        {"_id": "loan-zero", "user_id": "user-2", "financial_entity_id": YOYO_ID, "status": "active",
+         "amortization": [installment(1, 6, pending_payment=0), installment(2, 2)]},
+        # days_in_arrear que paid_loan_arrears no puede convertir a entero
+        {"_id": "loan-malformed", "user_id": "user-3", "financial_entity_id": STOP_ID, "status": "paid",
+         "amortization": [installment(1, 3), installment(2, "tres")]},
+        {"_id": "loan-other-entity", "user_id": "user-4", "financial_entity_id": "other", "status": "paid",
+         "amortization": [installment(1, 5)]},
+    ]
+    db.loan.insert_many(loans)
+    db.user.insert_many([{"_id": f"user-{n}", "status": "active"} for n in range(1, 5)])
+    return loans
+
+
+def test_rules_back_up_and_fix_loans_in_one_scan(mock_db, monkeypatch, tmp_path):
+    loans = load_loans(mock_db)
+    monkeypatch.setattr(loan_rules, "output_dir", str(tmp_path))
+    scans = []
+    stream_find = loan_rules.stream_find
+
+    def counting_stream_find(collection, query, projection=None, **kwargs):
+        scans.append(projection)
+        return stream_find(collection, query, projection, **kwargs)
+
+    monkeypatch.setattr(loan_rules, "stream_find", counting_stream_find)
+
+    summary = loan_rules.run(mock_db)
+
+    assert scans == [None]
+    backup = list(read_backup(summary["files_generated"][0]))
+    assert backup == loans[:3]
+
+    assert summary["loans_scanned"] == 3
+    assert summary["loans_updated"] == 2
+    amortization = {loan["_id"]: loan["amortization"] for loan in mock_db.loan.find()}
+    assert [element["days_in_arrear"] for element in amortization["loan-paid"]] == [0, 0]
+    assert [element["days_in_arrear"] for element in amortization["loan-zero"]] == [0, 2]
+    assert [element["days_in_arrear"] for element in amortization["loan-malformed"]] == [3, "tres"]
+
+
+def test_loans_a_rule_cannot_evaluate_are_counted(mock_db, monkeypatch, tmp_path, capsys):
+    load_loans(mock_db)
+    monkeypatch.setattr(loan_rules, "output_dir", str(tmp_path))
+
+    summary = loan_rules.run(mock_db)
+
+    assert summary["loans_malformed"] == 1
+    assert summary["rules_summary"]["paid_loan_arrears"]["loans_malformed"] == 1
+    assert summary["rules_summary"]["zero_balance_arrears"]["loans_malformed"] == 0
+    assert "Préstamo loan-malformed: Error al evaluar paid_loan_arrears" in capsys.readouterr().out
+
+
+def test_loans_changed_before_the_bulk_write_are_conflicts(mock_db, monkeypatch, tmp_path):
+    load_loans(mock_db)
+    monkeypatch.setattr(loan_rules, "output_dir", str(tmp_path))
+    execute_bulk = loan_rules.execute_bulk
+
+    def changing_execute_bulk(collection, operations):
+        # Otro proceso cambia la cuota en mora de loan-paid entre el recorrido y el bulk_write
+        mock_db.loan.update_one({"_id": "loan-paid"}, {"$set": {"amortization.1.days_in_arrear": 9}})
+        return execute_bulk(collection, operations)
+
+    monkeypatch.setattr(loan_rules, "execute_bulk", changing_execute_bulk)
+
+    summary = loan_rules.run(mock_db)
+
+    assert summary["loans_updated"] == 1
+    assert summary["loans_conflicted"] == 1
+    assert summary["rules_summary"]["paid_loan_arrears"]["loans_updated"] == 0
+    assert summary["rules_summary"]["paid_loan_arrears"]["users_validated"] == 0
+    assert summary["rules_summary"]["zero_balance_arrears"]["loans_updated"] == 1
+    assert mock_db.loan.find_one({"_id": "loan-paid"})["amortization"][1]["days_in_arrear"] == 9
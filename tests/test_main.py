@@ -0,0 +1,179 @@
+import tracemalloc
+
+import pytest
+
+import main
+from amortization_schema import IntKeysReport, validate_int_keys
+from conftest import STOP_ID
+from projections import int_keys
+
+LOANS = 3000
+
+
+def make_loan(i, terms=24):
+    return {
+        "_id": f"loan-{i:05d}",
+        "user_id": f"user-{i:05d}",
+        "financial_entity_id": STOP_ID,
+        "status": "paid",
+        "amortization": [
+            {"id": f"{i}-{term}", **dict.fromkeys(int_keys, 1000), "days_in_arrear": 3, "payment_info": ["x" * 40]}
+            for term in range(1, terms + 1)
+        ],
+    }
+
+
+class GeneratedCursor:
+    """Cursor que crea cada documento al pedirlo, como un cursor real entre lotes de getMore"""
+
+    def __init__(self, count):
+        self.count = count
+
+    def sort(self, *args):
+        return self
+
+    def allow_disk_use(self, allow):
+        return self
+
+    def limit(self, limit):
+        self.count = min(self.count, limit)
+        return self
+
+    def __iter__(self):
+        return (make_loan(i) for i in range(self.count))
+
+    def close(self):
+        pass
+
+
+class GeneratedLoanCollection:
+    """Colección loan de `count` préstamos generados, sin guardarlos en memoria"""
+
+    def __init__(self, count):
+        self.count = count
+        self.database = self
+        self.client = self
+
+    def start_session(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def find(self, query, projection=None, **kwargs):
+        return GeneratedCursor(self.count)
+
+
+class GeneratedDatabase:
+    def __init__(self, count):
+        self.loan = GeneratedLoanCollection(count)
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_loan_documents_stream_with_bounded_memory():
+    """El pico de memoria de leer y validar los préstamos no crece con la cantidad de préstamos"""
+    db = GeneratedDatabase(LOANS)
+
+    def read_loans():
+        loan_refs = []
+        documents = validate_int_keys(main.get_loan_documents(db), IntKeysReport(), batch_size=50)
+        for _ in main.collect_loan_refs(documents, loan_refs):
+            pass
+        assert len(loan_refs) == LOANS
+
+    streamed = peak_memory(read_loans)
+    materialized = peak_memory(lambda: list(main.get_loan_documents(db)))
+
+    assert streamed < materialized / 10
+
+
+def test_cursor_error_mid_stream_is_not_swallowed(mock_db, monkeypatch):
+    mock_db.loan.insert_many([make_loan(i, terms=2) for i in range(3)])
+
+    def failing_stream(collection, query, projection=None, **kwargs):
+        yield from collection.find(query, projection).limit(1)
+        raise ConnectionError("cursor perdido")
+
+    monkeypatch.setattr(main, "stream_find", failing_stream)
+
+    with pytest.raises(ConnectionError):
+        list(main.get_loan_documents(mock_db))
+    with pytest.raises(ConnectionError):
+        main.update_amortization_arrears(mock_db, main.get_loan_documents(mock_db))
+
+
+def pending_amortization_updates(loans):
+    return [main.build_amortization_update(i, loan) for i, loan in enumerate(loans, 1)]
+
+
+def test_amortization_batch_reports_loans_when_every_operation_modified(mock_db):
+    loans = [make_loan(i, terms=3) for i in range(3)]
+    mock_db.loan.insert_many(loans)
+
+    updated_loans = main.flush_amortization_updates(mock_db.loan, pending_amortization_updates(loans))
+
+    assert [loan["loan_id"] for loan in updated_loans] == ["loan-00000", "loan-00001", "loan-00002"]
+    assert mock_db.loan.count_documents({"amortization.days_in_arrear": {"$gt": 0}}) == 0
+
+
+def test_amortization_batch_confirms_each_loan_when_one_was_not_modified(mock_db):
+    loans = [make_loan(i, terms=3) for i in range(3)]
+    mock_db.loan.insert_many(loans)
+    pending_updates = pending_amortization_updates(loans)
+    # Otro proceso borra un préstamo entre la lectura y el bulk_write
+    mock_db.loan.delete_one({"_id": "loan-00001"})
+
+    updated_loans = main.flush_amortization_updates(mock_db.loan, pending_updates)
+
+    assert [loan["loan_id"] for loan in updated_loans] == ["loan-00000", "loan-00002"]
+
+
+def test_amortization_batch_excludes_operations_with_errors():
+    pending_updates = pending_amortization_updates([make_loan(i, terms=2) for i in range(3)])
+    details = {"nMatched": 2, "nModified": 2}
+    confirmed = main.confirmed_operations(details, {1: "error"}, len(pending_updates))
+
+    updated_loans = main.report_amortization_batch(pending_updates, details, {1: "error"}, confirmed)
+
+    assert [loan["loan_id"] for loan in updated_loans] == ["loan-00000", "loan-00002"]
+
+
+def test_confirmed_operations_verifies_only_when_modifications_are_missing():
+    verified = []
+
+    def verify(indexes):
+        verified.append(indexes)
+        return {0}
+
+    assert main.confirmed_operations({"nModified": 2}, {1: "error"}, 3, verify) == {0, 2}
+    assert verified == []
+    assert main.confirmed_operations({"nModified": 1}, {1: "error"}, 3, verify) == {0}
+    assert verified == [{0, 2}]
+    assert main.confirmed_operations({"nModified": 1}, {}, 3) == set()
+
+
+def test_user_updates_are_confirmed_per_user(mock_db):
+    # user-2 dejó de estar en arrear después de leerlo
+    mock_db.user.insert_many([{"_id": "user-1", "status": "arrear"}, {"_id": "user-2", "status": "blocked"}])
+    pending_updates = [("user-1", "Usuario tiene solo un préstamo"), ("user-2", "Usuario tiene solo un préstamo")]
+
+    details, errors = main.execute_bulk(mock_db.user, main.build_user_status_updates(pending_updates))
+    confirmed = main.confirmed_operations(
+        details, errors, len(pending_updates), lambda indexes: main.verify_user_updates(mock_db.user, pending_updates, indexes)
+    )
+
+    assert confirmed == {0}
+    assert main.report_user_updates(pending_updates, details, errors, confirmed) == [
+        {"user_id": "user-1", "old_status": "arrear", "new_status": "active", "reason": "Usuario tiene solo un préstamo"}
+    ]
@@ -0,0 +1,71 @@
+import pytest
+
+import mora_saldo_cero
+from conftest import STOP_ID
+
+
+def make_loan(_id, *installments):
+    """Cada cuota es (days_in_arrear, pending_payment)"""
+    return {
+        "_id": _id,
+        "financial_entity_id": STOP_ID,
+        "amortization": [
+            {"id": f"{_id}-{n}", "days_in_arrear": days, "pending_payment": pending}
+            for n, (days, pending) in enumerate(installments)
+        ],
+    }
+
+
+@pytest.fixture
+def loans(mock_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(mora_saldo_cero, "output_dir", str(tmp_path))
+    mock_db.loan.insert_many(
+        [
+            make_loan("loan-a", (5, 0), (3, 0), (0, 0)),
+            make_loan("loan-b", (2, 0), (4, 100)),
+            make_loan("loan-c", (0, 0), (7, 50)),
+        ]
+    )
+    return mock_db
+
+
+def zero_balance_arrears(db):
+    return db.loan.count_documents({"amortization": mora_saldo_cero.ZERO_BALANCE_ELEMENT})
+
+
+@pytest.mark.parametrize("mode", ["bulk", "update_many"])
+def test_run_counts_installments_of_modified_loans(loans, mode):
+    summary = mora_saldo_cero.run(loans, mode)
+
+    assert summary["documents_found"] == 2
+    assert summary["installments_found"] == 3
+    assert summary["loans_modified"] == 2
+    assert summary["amortizations_updated"] == 3
+    assert zero_balance_arrears(loans) == 0
+    # La cuota con saldo pendiente conserva su mora
+    assert loans.loan.find_one({"_id": "loan-b"})["amortization"][1]["days_in_arrear"] == 4
+
+
+def test_bulk_batch_counts_each_loan_when_one_changed(loans):
+    pending_updates = [("loan-a", [0, 1]), ("loan-b", [0])]
+    # loan-b se borra entre el recorrido y el bulk_write
+    loans.loan.delete_one({"_id": "loan-b"})
+
+    assert mora_saldo_cero.flush_zero_balance_updates(loans.loan, pending_updates) == (1, 2)
+    assert zero_balance_arrears(loans) == 0
+
+
+def test_update_many_counts_installments_of_confirmed_loans(loans, monkeypatch):
+    original_update_many = loans.loan.update_many
+
+    def update_many(*args, **kwargs):
+        # Otro proceso borra loan-b justo antes del update_many
+        loans.loan.delete_one({"_id": "loan-b"})
+        return original_update_many(*args, **kwargs)
+
+    monkeypatch.setattr(loans.loan, "update_many", update_many)
+    summary = mora_saldo_cero.run(loans, "update_many")
+
+    assert summary["installments_found"] == 3
+    assert summary["loans_modified"] == 1
+    assert summary["amortizations_updated"] == 2
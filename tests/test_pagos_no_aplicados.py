@@ -0,0 +1,174 @@
+import os
+
+import pytest
+
+import pagos_no_aplicados
+from conftest import STOP_ID, YOYO_ID
+
+DATE_RANGE = ("2025-08-01", "2025-08-04")
+
+
+def installment(*payment_info):
+    return {"payment_info": list(payment_info)}
+
+
+def load_payments(db):
+    """Un caso por cada problema que detectan los motores, más pagos sin problemas"""
+    db.loan.insert_many(
+        [
+            {"_id": "loan-ok", "status": "active", "amortization": [installment("p1"), installment("p2")]},
+            {"_id": "loan-unapplied", "status": "active", "amortization": [installment(), installment("p3"), installment()]},
+            {"_id": "loan-paid", "status": "paid", "amortization": [installment()]},
+            {"_id": "loan-empty", "status": "active", "amortization": []},
+            {"_id": "loan-null-info", "status": "arrear", "amortization": [{"payment_info": None}, {}]},
+        ]
+    )
+
+    def payment(_id, loan_id, *terms, entity=STOP_ID, date="2025-08-02"):
+        transactions = [{"id": f"{_id}-t{n}", "details": {"term": term}} for n, term in enumerate(terms)]
+        return {"_id": _id, "loan_id": loan_id, "date": date, "financial_entity_id": entity, "transactions": transactions}
+
+    payments = [
+        payment("pay-01", "loan-ok", 1, 2),
+        # Términos desordenados y repetidos: una fila por cuota, con todas sus transacciones
+        payment("pay-02", "loan-unapplied", 3, 1, 3, entity=YOYO_ID),
+        payment("pay-03", "loan-paid", 1),
+        payment("pay-04", "loan-missing", 1),
+        payment("pay-05", "loan-empty", 1),
+        payment("pay-06", "loan-unapplied", 0, 4, 2),
+        payment("pay-07", "loan-null-info", 2, 1),
+        payment("pay-08", "loan-unapplied", 1, date="2025-08-05"),
+        payment("pay-09", "loan-unapplied", 1, entity="other-entity"),
+        {"_id": "pay-10", "loan_id": "loan-unapplied", "date": "2025-08-03", "financial_entity_id": STOP_ID},
+    ]
+    # Transacción sin id: el CSV conserva su posición como un elemento vacío
+    payments.append(payment("pay-11", "loan-unapplied", 3, 3))
+    del payments[-1]["transactions"][0]["id"]
+    db.payment.insert_many(payments)
+
+
+def test_aggregation_engine_matches_python_engine(mongod_db):
+    load_payments(mongod_db)
+
+    python_rows, python_loans, _ = pagos_no_aplicados.get_unapplied_transactions(mongod_db, DATE_RANGE)
+    aggregation_rows, aggregation_loans, _ = pagos_no_aplicados.get_unapplied_transactions(
+        mongod_db, DATE_RANGE, engine="aggregation"
+    )
+
+    assert aggregation_rows == python_rows
+    assert aggregation_loans == python_loans
+    assert [(row["payment_id"], row["term"], row["transaction_ids"]) for row in python_rows] == [
+        ("pay-02", 1, "pay-02-t1"),
+        ("pay-02", 3, "pay-02-t0,pay-02-t2"),
+        ("pay-07", 1, "pay-07-t1"),
+        ("pay-07", 2, "pay-07-t0"),
+        ("pay-11", 3, ",pay-11-t1"),
+    ]
+    assert python_loans == ["loan-empty", "loan-missing", "loan-null-info", "loan-unapplied"]
+
+
+def test_aggregation_engine_limit_takes_the_same_payments(mongod_db):
+    load_payments(mongod_db)
+
+    for limit in (1, 2, 7):
+        python_result = pagos_no_aplicados.get_unapplied_transactions(mongod_db, DATE_RANGE, limit=limit)
+        aggregation_result = pagos_no_aplicados.get_unapplied_transactions(
+            mongod_db, DATE_RANGE, limit=limit, engine="aggregation"
+        )
+        assert aggregation_result[:2] == python_result[:2]
+
+
+def test_python_engine_orders_rows_by_payment_and_term(mock_db):
+    load_payments(mock_db)
+
+    rows, inconsistent_loans, count = pagos_no_aplicados.get_unapplied_transactions(mock_db, DATE_RANGE)
+
+    assert [(row["payment_id"], row["term"]) for row in rows] == [
+        ("pay-02", 1),
+        ("pay-02", 3),
+        ("pay-07", 1),
+        ("pay-07", 2),
+        ("pay-11", 3),
+    ]
+    assert rows[-1]["transaction_ids"] == ",pay-11-t1"
+    assert "loan-paid" not in inconsistent_loans
+    assert count == 9
+
+
+def scan_with_checkpoint(db, resume=False, name="unapplied"):
+    checkpoint = pagos_no_aplicados.ScanCheckpoint(
+        f"{name}.checkpoint.json", f"{name}.csv", f"{name}.txt", "de prueba", DATE_RANGE, None, resume
+    )
+    pagos_no_aplicados.get_unapplied_transactions(db, DATE_RANGE, checkpoint=checkpoint)
+    checkpoint.finish()
+    with open(f"{name}.csv", "rb") as csv_file, open(f"{name}.txt", "rb") as txt_file:
+        return csv_file.read(), txt_file.read()
+
+
+def crash_on_chunk(monkeypatch, chunk_number):
+    """El recorrido falla al evaluar el bloque `chunk_number` (contando desde 1)"""
+    process_payment_chunk = pagos_no_aplicados.process_payment_chunk
+    calls = []
+
+    def failing_process_payment_chunk(*args):
+        calls.append(None)
+        if len(calls) == chunk_number:
+            raise ConnectionError("conexión perdida")
+        return process_payment_chunk(*args)
+
+    monkeypatch.setattr(pagos_no_aplicados, "process_payment_chunk", failing_process_payment_chunk)
+    return lambda: monkeypatch.setattr(pagos_no_aplicados, "process_payment_chunk", process_payment_chunk)
+
+
+@pytest.fixture
+def checkpointed_scan(mock_db, monkeypatch, tmp_path):
+    """Bloques de 2 pagos y punto de control cada 3 pagos: se guarda tras el bloque 2, no tras el 3"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pagos_no_aplicados, "LOAN_LOOKUP_CHUNK_SIZE", 2)
+    monkeypatch.setattr(pagos_no_aplicados, "PAGOS_CHECKPOINT_INTERVAL", 3)
+    load_payments(mock_db)
+    return scan_with_checkpoint(mock_db, name="reference")
+
+
+def test_resume_after_crash_produces_the_same_files(mock_db, monkeypatch, checkpointed_scan):
+    restore = crash_on_chunk(monkeypatch, 4)
+    with pytest.raises(ConnectionError):
+        scan_with_checkpoint(mock_db)
+    restore()
+
+    assert os.path.exists("unapplied.checkpoint.json")
+    assert scan_with_checkpoint(mock_db, resume=True) == checkpointed_scan
+    assert not os.path.exists("unapplied.checkpoint.json")
+
+
+def test_new_scan_discards_the_previous_checkpoint(mock_db, monkeypatch, checkpointed_scan):
+    restore = crash_on_chunk(monkeypatch, 4)
+    with pytest.raises(ConnectionError):
+        scan_with_checkpoint(mock_db)
+    restore()
+
+    # Una ejecución nueva que falla antes de su primer punto de control
+    restore = crash_on_chunk(monkeypatch, 1)
+    with pytest.raises(ConnectionError):
+        scan_with_checkpoint(mock_db)
+    restore()
+
+    assert not os.path.exists("unapplied.checkpoint.json")
+    assert scan_with_checkpoint(mock_db, resume=True) == checkpointed_scan
+
+
+def test_resume_with_missing_output_files_starts_over(mock_db, monkeypatch, checkpointed_scan):
+    restore = crash_on_chunk(monkeypatch, 4)
+    with pytest.raises(ConnectionError):
+        scan_with_checkpoint(mock_db)
+    restore()
+    os.remove("unapplied.csv")
+
+    assert scan_with_checkpoint(mock_db, resume=True) == checkpointed_scan
+
+    for filename, size in (("unapplied.csv", os.path.getsize("unapplied.csv") + 1), ("missing.csv", 10)):
+        with pytest.raises(ValueError):
+            pagos_no_aplicados.ScanCheckpoint._truncate(filename, size)
+    assert not os.path.exists("missing.csv")
+    with open("unapplied.csv", "rb") as f:
+        assert b"\x00" not in f.read()
@@ -0,0 +1,93 @@
+import copy
+
+import restore_backup
+from config import PAYMENT_DATE_NORMALIZED_FIELD
+
+
+def make_backup_loan():
+    return {
+        "_id": "loan-1",
+        "status": "active",
+        "payment_date": "2025-08-02T00:00:00-05:00",
+        PAYMENT_DATE_NORMALIZED_FIELD: "2025-08-02T05:00:00Z",
+        "amortization": [
+            {"id": "1-1", "days_in_arrear": 5, "pending_payment": 0, "payment_info": ["tx-1"]},
+            {"id": "1-2", "days_in_arrear": 3, "pending_payment": 1000, "payment_info": []},
+        ],
+    }
+
+
+def load_checked_loan(db):
+    """El préstamo después del checker y de cambios posteriores de otros procesos"""
+    loan = make_backup_loan()
+    db.loan.insert_one(copy.deepcopy(loan))
+    # Lo que escribió el checker
+    db.loan.update_one(
+        {"_id": "loan-1"},
+        {
+            "$set": {"amortization.0.days_in_arrear": 0, "payment_date": "2025-08-02T05:00:00Z"},
+            "$unset": {PAYMENT_DATE_NORMALIZED_FIELD: ""},
+        },
+    )
+    # Cambios posteriores: un pago aplicado, una cuota nueva al inicio y el préstamo pagado
+    db.loan.update_one(
+        {"_id": "loan-1"},
+        {
+            "$set": {"amortization.1.pending_payment": 0, "status": "paid"},
+            "$push": {"amortization": {"$each": [{"id": "1-0", "days_in_arrear": 0}], "$position": 0}},
+        },
+    )
+    return loan
+
+
+def test_restore_reverts_checker_fields_and_keeps_later_changes(mock_db):
+    backup = load_checked_loan(mock_db)
+
+    summary = restore_backup.restore(mock_db.loan, [backup])
+
+    restored = mock_db.loan.find_one({"_id": "loan-1"})
+    assert summary["modified"] == 1
+    assert restored["payment_date"] == backup["payment_date"]
+    assert restored[PAYMENT_DATE_NORMALIZED_FIELD] == backup[PAYMENT_DATE_NORMALIZED_FIELD]
+    assert restored["status"] == "paid"
+    assert restored["amortization"] == [
+        {"id": "1-0", "days_in_arrear": 0},
+        {"id": "1-1", "days_in_arrear": 5, "pending_payment": 0, "payment_info": ["tx-1"]},
+        {"id": "1-2", "days_in_arrear": 3, "pending_payment": 0, "payment_info": []},
+    ]
+
+    assert restore_backup.restore(mock_db.loan, [backup])["unchanged"] == 1
+
+
+def test_restore_skips_fields_changed_after_reading_them(mock_db):
+    backup = load_checked_loan(mock_db)
+    current = mock_db.loan.find_one({"_id": "loan-1"})
+    guard, to_set, to_unset, missing_installments = restore_backup.plan_restore(current, backup)
+
+    assert to_set == {
+        "payment_date": backup["payment_date"],
+        PAYMENT_DATE_NORMALIZED_FIELD: backup[PAYMENT_DATE_NORMALIZED_FIELD],
+        "amortization.1.days_in_arrear": 5,
+    }
+    assert to_unset == {}
+    assert missing_installments == []
+    assert guard[PAYMENT_DATE_NORMALIZED_FIELD] == restore_backup.MISSING_FIELD
+
+    # Otro proceso vuelve a calcular la mora entre la lectura y la escritura
+    mock_db.loan.update_one({"_id": "loan-1"}, {"$set": {"amortization.1.days_in_arrear": 7}})
+    result = mock_db.loan.update_one(guard, {"$set": to_set})
+
+    assert result.matched_count == 0
+    assert mock_db.loan.find_one({"_id": "loan-1"})["amortization"][1]["days_in_arrear"] == 7
+
+
+def test_dry_run_reports_changes_without_writing(mock_db, capsys):
+    backup = load_checked_loan(mock_db)
+    before = mock_db.loan.find_one({"_id": "loan-1"})
+
+    summary = restore_backup.restore(mock_db.loan, [backup, {"_id": "loan-missing"}], dry_run=True)
+
+    assert mock_db.loan.find_one({"_id": "loan-1"}) == before
+    assert summary["matched"] == 1
+    assert summary["missing"] == 1
+    assert "amortization.1.days_in_arrear: 0 -> 5" in capsys.readouterr().out